@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+import logging
+
+import torch
+import hydra
+from omegaconf import DictConfig
+from hydra.core.hydra_config import HydraConfig
+
+from src.utils.io import set_paths
+import src.benchmarks as benchmarks
+
+log = logging.getLogger(__name__)
+
+
+@hydra.main(version_base=None, config_path="conf", config_name="config")
+def main(cfg: DictConfig):
+    """ Performance benchmarks. The options are:
+        - runtime: Throughput and mIoU of the precisions and memory formats of the model
+        - lovasz: Batched Lovasz-Softmax against the previous per-class implementation
+        - models: Parameters, FLOPs, CPU latency and mIoU after a fixed training budget of the model variants
+        - mc_dropout: Cost of the MC dropout inference relative to the deterministic inference
+        - imports: Import-time budget of the command line scripts (fails if a script exceeds it)
+    """
+
+    cfg = set_paths(cfg, HydraConfig.get().runtime.output_dir)
+
+    if 'device' in cfg:
+        device = torch.device(cfg.device)
+    else:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    if cfg.option == 'runtime':
+        benchmarks.benchmark_runtime(cfg, device)
+    elif cfg.option == 'lovasz':
+        benchmarks.benchmark_lovasz(cfg, device)
+    elif cfg.option == 'models':
+        benchmarks.benchmark_models(cfg, device)
+    elif cfg.option == 'mc_dropout':
+        benchmarks.benchmark_mc_dropout(cfg, device)
+    elif cfg.option == 'imports':
+        benchmarks.benchmark_imports(cfg)
+    else:
+        raise ValueError(f'Option "{cfg.option}" is not supported')
+
+
+if __name__ == '__main__':
+    main()
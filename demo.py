@@ -6,18 +6,8 @@ from omegaconf import DictConfig
 from hydra.core.hydra_config import HydraConfig
 
 from src.utils.io import set_paths
-from src.kitti360 import KITTI360Converter
-
-from src.visualizations.filters import visualize_filters
-from src.visualizations.dataset import visualize_scans, visualize_clouds, \
-    visualize_statistics, visualize_augmentation, visualize_scan_mapping
-from src.visualizations.superpoints import visualize_feature, visualize_superpoints
-from src.visualizations.experiment import visualize_model_comparison, visualize_learning, \
-    visualize_loss_comparison, visualize_baseline, visualize_class_distribution
-from src.visualizations.model import visualize_model_predictions
-from src.visualizations.selection import visualize_voxel_selection, \
-    visualize_superpoint_selection, visualize_uncertainty_score_voxels, \
-    visualize_uncertainty_score_superpoints
+import src.kitti360 as kitti360
+import src.visualizations as vis
 
 log = logging.getLogger(__name__)
 
@@ -39,15 +29,15 @@ def main(cfg: DictConfig):
     """
 
     if cfg.option == 'dataset_scans':
-        visualize_scans(cfg)
+        vis.visualize_scans(cfg)
     elif cfg.option == 'dataset_clouds':
-        visualize_clouds(cfg)
+        vis.visualize_clouds(cfg)
     elif cfg.option == 'dataset_statistics':
-        visualize_statistics(cfg)
+        vis.visualize_statistics(cfg)
     elif cfg.option == 'augmentation':
-        visualize_augmentation(cfg)
+        vis.visualize_augmentation(cfg)
     elif cfg.option == 'scan_mapping':
-        visualize_scan_mapping(cfg)
+        vis.visualize_scan_mapping(cfg)
 
         # ==================== SUPERPOINT VISUALIZATIONS ====================
 
@@ -60,9 +50,9 @@ def main(cfg: DictConfig):
         """
 
     elif cfg.option == 'feature':
-        visualize_feature(cfg)
+        vis.visualize_feature(cfg)
     elif cfg.option == 'superpoints':
-        visualize_superpoints(cfg)
+        vis.visualize_superpoints(cfg)
 
         # ==================== EXPERIMENT VISUALIZATIONS ====================
 
@@ -75,15 +65,15 @@ def main(cfg: DictConfig):
         """
 
     elif cfg.option == 'model_comparison':
-        visualize_model_comparison(cfg)
+        vis.visualize_model_comparison(cfg)
     elif cfg.option == 'loss_comparison':
-        visualize_loss_comparison(cfg)
+        vis.visualize_loss_comparison(cfg)
     elif cfg.option == 'baseline':
-        visualize_baseline(cfg)
+        vis.visualize_baseline(cfg)
     elif cfg.option == 'strategy_comparison':
-        visualize_learning(cfg)
+        vis.visualize_learning(cfg)
     elif cfg.option == 'class_distribution':
-        visualize_class_distribution(cfg)
+        vis.visualize_class_distribution(cfg)
 
         # ==================== SELECTION VISUALIZATIONS ====================
 
@@ -93,28 +83,28 @@ def main(cfg: DictConfig):
         """
 
     elif cfg.option == 'voxel_selection':
-        visualize_voxel_selection(cfg)
+        vis.visualize_voxel_selection(cfg)
     elif cfg.option == 'superpoint_selection':
-        visualize_superpoint_selection(cfg)
-    elif cfg.option == 'scan_mapping':
-        visualize_uncertainty_score_voxels(cfg)
+        vis.visualize_superpoint_selection(cfg)
+    elif cfg.option == 'uncertainty_score_voxels':
+        vis.visualize_uncertainty_score_voxels(cfg)
     elif cfg.option == 'uncertainty_score_superpoints':
-        visualize_uncertainty_score_superpoints(cfg)
+        vis.visualize_uncertainty_score_superpoints(cfg)
 
     # ==================== FILTERING ====================
 
     elif cfg.option == 'filters':
-        visualize_filters(cfg)
+        vis.visualize_filters(cfg)
 
     # ==================== MODEL PREDICTIONS ====================
 
     elif cfg.option == 'model_predictions':
-        visualize_model_predictions(cfg)
+        vis.visualize_model_predictions(cfg)
 
     # ==================== DATASET CONVERSION ====================
 
     elif cfg.option == 'kitti360_conversion':
-        converter = KITTI360Converter(cfg)
+        converter = kitti360.KITTI360Converter(cfg)
         converter.visualize()
     elif cfg.option == 'semantic_kitti_conversion':
         raise NotImplementedError
@@ -6,9 +6,9 @@ from omegaconf import DictConfig
 from hydra.core.hydra_config import HydraConfig
 
 from src.utils.io import set_paths
-from src.kitti360 import KITTI360Converter
-from src.semantickitti import SemanticKITTIConverter
-from src.process import create_superpoints, compute_redal_features
+import src.kitti360 as kitti360
+import src.semantickitti as semantickitti
+import src.process as processing
 
 log = logging.getLogger(__name__)
 
@@ -25,16 +25,16 @@ def main(cfg: DictConfig):
 
     if cfg.option == 'convert_dataset':
         if cfg.ds.name == 'KITTI-360':
-            converter = KITTI360Converter(cfg)
+            converter = kitti360.KITTI360Converter(cfg)
         elif cfg.ds.name == 'SemanticKITTI':
-            converter = SemanticKITTIConverter(cfg)
+            converter = semantickitti.SemanticKITTIConverter(cfg)
         else:
             raise NotImplementedError(f'The dataset "{cfg.ds.name}" is not supported')
         converter.convert()
     elif cfg.option == 'create_superpoints':
-        create_superpoints(cfg)
+        processing.create_superpoints(cfg)
     elif cfg.option == 'compute_redal_features':
-        compute_redal_features(cfg)
+        processing.compute_redal_features(cfg)
     else:
         raise ValueError(f'Option "{cfg.option}" is not supported')
 
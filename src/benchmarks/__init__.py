@@ -0,0 +1,9 @@
+from src.utils.lazy import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    '.imports': ['benchmark_imports'],
+    '.lovasz': ['benchmark_lovasz'],
+    '.mc_dropout': ['benchmark_mc_dropout'],
+    '.models': ['benchmark_models'],
+    '.runtime': ['benchmark_runtime'],
+})
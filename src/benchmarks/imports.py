@@ -0,0 +1,63 @@
+import sys
+import json
+import logging
+import subprocess
+
+from omegaconf import DictConfig
+
+log = logging.getLogger(__name__)
+
+MEASURE = '''
+import sys, time, json
+start = time.perf_counter()
+import {script}
+duration = time.perf_counter() - start
+print(json.dumps({{'time': duration, 'modules': [m for m in {heavy_modules} if m in sys.modules]}}))
+'''
+
+
+def benchmark_imports(cfg: DictConfig) -> list[dict]:
+    """ Import-time budget of the command line scripts (the keys of cfg.benchmark.import_budgets). Every script
+    is imported in a fresh interpreter, the import time (the startup before Hydra) is the minimum
+    of cfg.benchmark.import_runs runs. The heavy modules (cfg.benchmark.heavy_modules) must not be loaded
+    by the import, they are imported only by the options that need them.
+
+    :return: The results of the scripts.
+    :raises RuntimeError: If a script exceeds its budget (if not null) or loads a heavy module.
+    """
+
+    heavy_modules = list(cfg.benchmark.heavy_modules)
+    results = []
+    for script, budget in cfg.benchmark.import_budgets.items():
+        times, modules = [], []
+        for _ in range(cfg.benchmark.import_runs):
+            result = measure_import(script, heavy_modules, cfg.path.root)
+            times.append(result['time'])
+            modules = result['modules']
+        results.append({'script': script, 'time': min(times), 'budget': budget, 'heavy_modules': modules})
+
+    failures = []
+    log.info(f'{"Script":<20}{"Import time [s]":>16}{"Budget [s]":>12}  Heavy modules')
+    for r in results:
+        budget = f'{r["budget"]:.2f}' if r['budget'] is not None else '-'
+        log.info(f'{r["script"]:<20}{r["time"]:>16.3f}{budget:>12}  {", ".join(r["heavy_modules"]) or "-"}')
+        if (r['budget'] is not None and r['time'] > r['budget']) or len(r['heavy_modules']) > 0:
+            failures.append(r['script'])
+    if len(failures) > 0:
+        raise RuntimeError(f'Import budget exceeded (or heavy modules loaded) by: {", ".join(failures)}')
+    log.info('All scripts import within their budgets without heavy modules.')
+    return results
+
+
+def measure_import(script: str, heavy_modules: list, root: str) -> dict:
+    """ Imports the script in a fresh interpreter in the root directory.
+
+    :return: Dictionary with the import time in seconds and the heavy modules loaded by the import.
+    :raises RuntimeError: If the import fails.
+    """
+
+    code = MEASURE.format(script=script, heavy_modules=heavy_modules)
+    process = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f'Import of {script} failed:\n{process.stderr}')
+    return json.loads(process.stdout.strip().splitlines()[-1])
@@ -0,0 +1,53 @@
+import time
+import logging
+
+import torch
+from omegaconf import DictConfig
+
+from src.losses.lovasz import lovasz_softmax
+from src.old.lovasz import lovasz_softmax as reference_lovasz_softmax
+
+log = logging.getLogger(__name__)
+
+
+def benchmark_lovasz(cfg: DictConfig, device: torch.device) -> dict:
+    """ Compares the batched Lovasz-Softmax with the previous per-class implementation (src/old/lovasz.py)
+    on random logits of the size of the training batches (batch_size x num_classes x 64 x 1024). The time
+    of the forward and backward pass and the largest difference of the losses and the gradients are reported
+    for the batch and the per-image mode.
+
+    :return: The results of both modes.
+    """
+
+    shape = (cfg.benchmark.batch_size, cfg.ds.num_classes, 64, 1024)
+    logits = torch.randn(shape, device=device)
+    labels = torch.randint(0, cfg.ds.num_classes, (shape[0], *shape[2:]), device=device)
+
+    def run(fn, per_image):
+        probs = logits.clone().requires_grad_(True)
+        start = time.perf_counter()
+        loss = fn(probs, labels, per_image=per_image, ignore=cfg.ds.ignore_index)
+        loss.backward()
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        return time.perf_counter() - start, loss.detach(), probs.grad
+
+    results = {}
+    for per_image in [False, True]:
+        times, reference_times = [], []
+        for _ in range(cfg.benchmark.num_batches):
+            duration, loss, grad = run(lovasz_softmax, per_image)
+            reference_duration, reference_loss, reference_grad = run(reference_lovasz_softmax, per_image)
+            times.append(duration)
+            reference_times.append(reference_duration)
+
+        mode = 'per-image' if per_image else 'batch'
+        results[mode] = {'time': sum(times[1:]) / max(len(times) - 1, 1),
+                         'reference_time': sum(reference_times[1:]) / max(len(reference_times) - 1, 1),
+                         'loss_difference': (loss - reference_loss).abs().item(),
+                         'grad_difference': (grad - reference_grad).abs().max().item()}
+        r = results[mode]
+        log.info(f'Lovasz-Softmax ({mode}): {r["time"] * 1000:.1f} ms, previous {r["reference_time"] * 1000:.1f} ms, '
+                 f'speedup {r["reference_time"] / r["time"]:.2f}x, loss difference {r["loss_difference"]:.2e}, '
+                 f'gradient difference {r["grad_difference"]:.2e}')
+    return results
@@ -0,0 +1,51 @@
+import time
+import logging
+
+import torch
+from omegaconf import DictConfig
+
+from src.utils.wb import pull_artifact
+from src.models import get_model
+from src.selection.inference import MCDropoutEngine
+from .utils import load_batches, forward
+
+log = logging.getLogger(__name__)
+
+
+def benchmark_mc_dropout(cfg: DictConfig, device: torch.device) -> list[dict]:
+    """ Compares the cost of the MC dropout inference (cfg.active.mc_samples samples, cfg.active.memory_budget)
+    with the deterministic inference used by the Entropy / Margin strategies on the validation batches.
+    The MC dropout is measured with the replicated batch only and with the deterministic prefix of the model
+    computed once per batch. The cost is reported as the time relative to the deterministic inference.
+
+    :return: The results of the inference modes.
+    """
+
+    batches = load_batches(cfg, 'val', device)
+    model = get_model(cfg, device)
+    if cfg.benchmark.model_artifact is not None:
+        model.load_state_dict(pull_artifact(cfg.benchmark.model_artifact, device=device))
+
+    def measure(step) -> float:
+        with torch.inference_mode():
+            step(batches[0][0])
+            start = time.perf_counter()
+            for inputs, _ in batches[1:]:
+                step(inputs)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        return time.perf_counter() - start
+
+    model.eval()
+    reference = measure(lambda inputs: forward(model, inputs))
+    results = [{'mode': 'deterministic', 'time': reference}]
+    for share_prefix in [False, True]:
+        engine = MCDropoutEngine(model, cfg.active.mc_samples, cfg.active.memory_budget, share_prefix=share_prefix)
+        results.append({'mode': f'mc_dropout{"_shared_prefix" if share_prefix else ""}', 'time': measure(engine)})
+        model.eval()
+
+    log.info(f'{"Mode":<28}{"Time [s]":>10}{"Cost":>8}   ({cfg.active.mc_samples} MC dropout samples)')
+    for r in results:
+        r['ratio'] = r['time'] / reference
+        log.info(f'{r["mode"]:<28}{r["time"]:>10.3f}{r["ratio"]:>7.2f}x')
+    return results
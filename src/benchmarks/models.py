@@ -0,0 +1,97 @@
+import os
+import time
+import logging
+from itertools import cycle
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from omegaconf import DictConfig, OmegaConf
+
+from src.losses import get_loss
+from src.models import get_model
+from .utils import load_batches, forward, evaluate
+
+log = logging.getLogger(__name__)
+
+
+def benchmark_models(cfg: DictConfig, device: torch.device) -> list[dict]:
+    """ Compares the model variants cfg.benchmark.models (names of the configurations in conf/model). For every
+    variant the number of parameters, the FLOPs and the CPU latency of a single image of the size
+    cfg.benchmark.image_size are measured. The variant is then trained from scratch on the training batches
+    for cfg.benchmark.train_budget seconds and its mIoU on the validation batches is reported.
+
+    :return: The results of the variants.
+    """
+
+    train_batches = load_batches(cfg, 'train', device)
+    val_batches = load_batches(cfg, 'val', device)
+    loss_fn = get_loss(cfg.train.loss, device=device, ignore_index=cfg.ds.ignore_index)
+    image = torch.randn(1, cfg.ds.num_channels, *cfg.benchmark.image_size)
+
+    results = []
+    for name in cfg.benchmark.models:
+        model_cfg = OmegaConf.load(os.path.join(cfg.path.root, 'conf', 'model', f'{name}.yaml'))
+        model = get_model(OmegaConf.merge(cfg, {'model': model_cfg}), device)
+
+        parameters = sum(p.numel() for p in model.parameters())
+        flops = count_flops(model.cpu(), image)
+        latency = cpu_latency(model, image, cfg.benchmark.latency_runs)
+        model = model.to(device)
+
+        optimizer = optim.Adam(model.parameters(), lr=cfg.train.learning_rate)
+        model.train()
+        steps, start = 0, time.perf_counter()
+        for inputs, targets in cycle(train_batches):
+            if time.perf_counter() - start >= cfg.benchmark.train_budget:
+                break
+            optimizer.zero_grad()
+            loss_fn(forward(model, inputs), targets).backward()
+            optimizer.step()
+            steps += 1
+        miou = evaluate(model, val_batches, cfg.ds.num_classes, cfg.ds.ignore_index)
+
+        results.append({'model': name, 'parameters': parameters, 'flops': flops, 'latency': latency,
+                        'steps': steps, 'miou': miou})
+
+    log.info(f'{"Model":<20}{"Parameters [M]":>16}{"GFLOPs":>10}{"CPU latency [ms]":>18}{"Steps":>8}{"mIoU":>8}')
+    for r in results:
+        log.info(f'{r["model"]:<20}{r["parameters"] / 1e6:>16.2f}{r["flops"] / 1e9:>10.2f}'
+                 f'{r["latency"] * 1000:>18.1f}{r["steps"]:>8}{r["miou"]:>8.4f}')
+    return results
+
+
+def count_flops(model: nn.Module, inputs: torch.Tensor) -> int:
+    """ Counts the FLOPs (2 per multiply-accumulate) of the convolutional and linear layers in a forward pass.
+    The other layers (normalization, activations, pooling) are not counted.
+    """
+
+    flops = []
+
+    def hook(module, _, output):
+        if isinstance(module, nn.Conv2d):
+            kernel = module.in_channels // module.groups * module.kernel_size[0] * module.kernel_size[1]
+        else:
+            kernel = module.in_features
+        flops.append(2 * output.numel() * kernel)
+
+    handles = [m.register_forward_hook(hook) for m in model.modules() if isinstance(m, (nn.Conv2d, nn.Linear))]
+    model.eval()
+    with torch.no_grad():
+        forward(model, inputs)
+    for handle in handles:
+        handle.remove()
+    return sum(flops)
+
+
+def cpu_latency(model: nn.Module, inputs: torch.Tensor, runs: int = 10) -> float:
+    """ Returns the mean time of the forward pass of the model on CPU in seconds (after one warmup pass).
+    """
+
+    model = model.cpu().eval()
+    with torch.inference_mode():
+        forward(model, inputs)
+        start = time.perf_counter()
+        for _ in range(runs):
+            forward(model, inputs)
+    return (time.perf_counter() - start) / runs
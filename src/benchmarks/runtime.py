@@ -0,0 +1,72 @@
+import logging
+
+import torch
+import torch.optim as optim
+from omegaconf import DictConfig
+
+from src.losses import get_loss
+from src.utils.wb import pull_artifact
+from src.models import get_model, ModelRuntime
+from .utils import load_batches, forward, throughput, evaluate
+
+log = logging.getLogger(__name__)
+
+
+def benchmark_runtime(cfg: DictConfig, device: torch.device) -> list[dict]:
+    """ Compares the precisions and memory formats of the model (cfg.benchmark.precisions x channels-last off/on).
+    For every runtime the inference and the training throughput (samples per second) on the validation batches
+    are measured, together with the mIoU difference to the fp32 NCHW model. The mIoU is meaningful only
+    with trained weights (cfg.benchmark.model_artifact).
+
+    :return: The results of the runtimes.
+    """
+
+    batches = load_batches(cfg, 'val', device)
+    state_dict = pull_artifact(cfg.benchmark.model_artifact, device=device) \
+        if cfg.benchmark.model_artifact is not None else None
+    loss_fn = get_loss(cfg.train.loss, device=device, ignore_index=cfg.ds.ignore_index)
+
+    results = []
+    for precision in cfg.benchmark.precisions:
+        for channels_last in [False, True]:
+            runtime = ModelRuntime(precision, channels_last, device)
+            model = runtime.prepare_model(get_model(cfg, device))
+            if state_dict is not None:
+                model.load_state_dict(state_dict)
+            runtime_batches = [(runtime.prepare_input(x), y) for x, y in batches]
+
+            def inference_step(inputs, _):
+                with torch.no_grad(), runtime.autocast():
+                    forward(model, inputs)
+
+            def predict(m, inputs):
+                with runtime.autocast():
+                    return forward(m, inputs)
+
+            model.eval()
+            inference = throughput(inference_step, runtime_batches)
+            miou = evaluate(model, runtime_batches, cfg.ds.num_classes, cfg.ds.ignore_index, prepare=predict)
+
+            optimizer = optim.Adam(model.parameters(), lr=cfg.train.learning_rate)
+
+            def train_step(inputs, targets):
+                optimizer.zero_grad()
+                with runtime.autocast():
+                    outputs = forward(model, inputs)
+                runtime.scaler.scale(loss_fn(outputs.float(), targets)).backward()
+                runtime.scaler.step(optimizer)
+                runtime.scaler.update()
+
+            model.train()
+            training = throughput(train_step, runtime_batches)
+
+            results.append({'precision': runtime.precision, 'channels_last': channels_last,
+                            'inference': inference, 'training': training, 'miou': miou})
+
+    reference = results[0]['miou']
+    log.info(f'{"Runtime":<24}{"Inference [samples/s]":>24}{"Training [samples/s]":>24}{"mIoU delta":>12}')
+    for r in results:
+        r['miou_delta'] = r['miou'] - reference
+        name = f'{r["precision"]}{" channels-last" if r["channels_last"] else ""}'
+        log.info(f'{name:<24}{r["inference"]:>24.2f}{r["training"]:>24.2f}{r["miou_delta"]:>+12.4f}')
+    return results
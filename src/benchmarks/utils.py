@@ -0,0 +1,64 @@
+import time
+
+import torch
+from omegaconf import DictConfig
+from torch.utils.data import DataLoader
+
+from src.datasets import SemanticDataset, get_parser
+from src.learn.metrics import ConfusionMatrix
+
+
+def load_batches(cfg: DictConfig, split: str, device: torch.device) -> list[tuple[torch.Tensor, torch.Tensor]]:
+    """ Loads the first cfg.benchmark.num_batches batches of the dataset split into the memory, so that
+    the benchmarks measure only the model and not the data loading.
+    """
+
+    dataset = SemanticDataset(split=split,
+                              cfg=cfg.ds,
+                              dataset_path=cfg.ds.path,
+                              project_name='benchmark',
+                              num_clouds=cfg.train.dataset_size,
+                              al_experiment=False)
+    parser = get_parser(dataset.parser_type, device)
+    loader = DataLoader(dataset, batch_size=cfg.benchmark.batch_size, shuffle=False,
+                        num_workers=cfg.train.num_workers)
+    batches = []
+    for batch in loader:
+        batches.append(parser.parse_batch(batch))
+        if len(batches) == cfg.benchmark.num_batches:
+            break
+    return batches
+
+
+def forward(model: torch.nn.Module, inputs: torch.Tensor) -> torch.Tensor:
+    outputs = model(inputs)
+    return outputs['out'] if isinstance(outputs, dict) else outputs
+
+
+def throughput(step, batches: list, warmup: int = 1) -> float:
+    """ Runs the step on every batch (after the warmup batches) and returns the number of samples per second.
+    """
+
+    for inputs, targets in batches[:warmup]:
+        step(inputs, targets)
+    start, samples = time.perf_counter(), 0
+    for inputs, targets in batches[warmup:]:
+        step(inputs, targets)
+        samples += inputs.shape[0]
+    return samples / max(time.perf_counter() - start, 1e-9)
+
+
+def evaluate(model: torch.nn.Module, batches: list, num_classes: int, ignore_index: int,
+             prepare=None) -> float:
+    """ Returns the mIoU of the model on the batches.
+
+    :param prepare: Optional function (model, inputs) -> outputs used instead of the plain forward pass.
+    """
+
+    model.eval()
+    matrix = ConfusionMatrix(num_classes, ignore_index, batches[0][0].device)
+    with torch.no_grad():
+        for inputs, targets in batches:
+            outputs = prepare(model, inputs) if prepare is not None else forward(model, inputs)
+            matrix.update(outputs.float(), targets)
+    return matrix.miou()
@@ -1,5 +1,9 @@
-from .base_dataset import Dataset
-from .parsers import get_parser, Parser
-from .semantic_dataset import SemanticDataset
-from .partition_dataset import PartitionDataset
-from .semantickitti_dataset import SemanticKITTIDataset
+from src.utils.lazy import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    '.base_dataset': ['Dataset'],
+    '.parsers': ['get_parser', 'Parser'],
+    '.semantic_dataset': ['SemanticDataset'],
+    '.partition_dataset': ['PartitionDataset'],
+    '.semantickitti_dataset': ['SemanticKITTIDataset'],
+})
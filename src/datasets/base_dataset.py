@@ -111,6 +111,14 @@ class Dataset(TorchDataset):
         selected = np.where(self.scan_selection_mask == 1)[0]
         return self.scan_files[selected]
 
+    @property
+    def scan_cloud_ids(self) -> np.ndarray:
+        """ Returns the index of the cloud (in cloud_files) of each scan in scan_files.
+        """
+
+        cloud_index = {cloud: i for i, cloud in enumerate(self.cloud_files)}
+        return np.array([cloud_index[cloud] for cloud in self.cloud_map], dtype=np.int64)
+
     @property
     def num_scans(self):
         size = 0
@@ -196,6 +204,26 @@ class Dataset(TorchDataset):
         self.CI.write_voxel_selection(cloud_path, voxels)
         self.cloud_selection_mask[cloud_idx] = True
 
+    def label_clouds(self, cloud_voxels: dict) -> None:
+        """ Labels the voxels of multiple clouds at once. The scans are grouped by their clouds only once,
+        instead of searching the scans of every cloud separately.
+
+        :param cloud_voxels: Dictionary {cloud path: indices of all labeled voxels of the cloud}.
+        """
+
+        cloud_index = {cloud: i for i, cloud in enumerate(self.cloud_files)}
+        scan_cloud_ids = self.scan_cloud_ids
+        order = np.argsort(scan_cloud_ids, kind='stable')
+        bounds = np.searchsorted(scan_cloud_ids[order], np.arange(len(self.cloud_files) + 1))
+
+        for cloud_path, voxels in tqdm(cloud_voxels.items(), desc='Labeling voxels'):
+            cloud_idx = cloud_index[cloud_path]
+            for scan_idx in order[bounds[cloud_idx]:bounds[cloud_idx + 1]]:
+                sample_idx = self.scan_id_map[scan_idx]
+                self.scan_selection_mask[sample_idx] = self.SI.select_voxels(self.scan_files[scan_idx], voxels)
+            self.CI.write_voxel_selection(cloud_path, voxels)
+            self.cloud_selection_mask[cloud_idx] = True
+
     def __initialize(self):
         load_args = (self.path, self.project_name, self.sequences, self.split, self.al_experiment, self.resume)
         loaded_data = load_dataset(*load_args)
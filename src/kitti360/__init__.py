@@ -1,2 +1,6 @@
-from .config import create_kitti360_config
-from .converter import KITTI360Converter
+from src.utils.lazy import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    '.config': ['create_kitti360_config'],
+    '.converter': ['KITTI360Converter'],
+})
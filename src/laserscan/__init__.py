@@ -1,2 +1,6 @@
-from .scan import LaserScan
-from .scanvis import ScanVis
+from src.utils.lazy import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    '.scan': ['LaserScan'],
+    '.scanvis': ['ScanVis'],
+})
@@ -1,2 +1,6 @@
-from .passive import train_model_passive, train_semantickitti_original
-from .active import train_model_active
+from src.utils.lazy import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    '.passive': ['train_model_passive', 'train_semantickitti_original'],
+    '.active': ['train_model_active', 'create_seed'],
+})
@@ -5,16 +5,33 @@ import wandb
 import omegaconf
 from omegaconf import DictConfig
 
-from src.selection import get_selector
+from src.selection import get_selector, selection_chain
+from src.learn.checkpoint import TrainingCheckpoint
+from src.learn.distributed import is_main_process, main_process_first, broadcast_object, broadcast_selection
 from src.learn.trainer import SemanticTrainer
-from src.utils.wb import push_artifact, pull_artifact
+from src.utils.wb import push_artifact, pull_artifact, pull_run_metric
 from src.datasets.semantic_dataset import SemanticDataset
 from src.utils.log import log_selection_metric_statistics, log_dataset_statistics
 
 log = logging.getLogger(__name__)
 
 
-def train_model_active(cfg: DictConfig, device: torch.device) -> None:
+def train_model_active(cfg: DictConfig, device: torch.device, resume: bool = False) -> None:
+    """ Trains the model with active learning. In every iteration the voxels are selected by the best model
+    of the previous iteration (or by the seed model) and the model is trained on the labeled voxels.
+
+    If train.checkpoint_dir is set, the state of the loop is checkpointed after the selection, after every epoch
+    (and every train.checkpoint_batches batches) and after every iteration. With resume, the loop continues
+    from the checkpoint without repeating the finished selections and epochs.
+
+    :param cfg: The configuration of the experiment.
+    :param device: The device used for the training and the selection.
+    :param resume: Whether to resume the loop from the checkpoint.
+
+    In the distributed training (src.learn.distributed.launch) only the main process selects and labels
+    the voxels, the selection masks are broadcast to the other processes.
+    """
+
     percentages = cfg.active.percentages
     model_artifact = cfg.active.model_artifact
     selection_artifact = cfg.active.selection_artifact
@@ -36,28 +53,29 @@ def train_model_active(cfg: DictConfig, device: torch.device) -> None:
     weighted_metric_stats = f'WeightedMetricStats_{info}'
 
     # Create datasets
-    train_ds = SemanticDataset(split='train',
-                               cfg=cfg.ds,
-                               dataset_path=cfg.ds.path,
-                               project_name=info,
-                               num_clouds=cfg.train.dataset_size,
-                               al_experiment=True,
-                               selection_mode=False,
-                               filter_type=cfg.active.filter_type)
-
-    val_ds = SemanticDataset(split='val',
-                             cfg=cfg.ds,
-                             dataset_path=cfg.ds.path,
-                             project_name=info,
-                             num_clouds=cfg.train.dataset_size,
-                             al_experiment=True,
-                             selection_mode=False)
+    with main_process_first():
+        train_ds = SemanticDataset(split='train',
+                                   cfg=cfg.ds,
+                                   dataset_path=cfg.ds.path,
+                                   project_name=info,
+                                   num_clouds=cfg.train.dataset_size,
+                                   al_experiment=True,
+                                   selection_mode=False,
+                                   filter_type=cfg.active.filter_type)
+
+        val_ds = SemanticDataset(split='val',
+                                 cfg=cfg.ds,
+                                 dataset_path=cfg.ds.path,
+                                 project_name=info,
+                                 num_clouds=cfg.train.dataset_size,
+                                 al_experiment=True,
+                                 selection_mode=False)
 
     # Create Selector for selecting labeled voxels
     selector = get_selector(cfg=cfg,
                             project_name=info,
                             cloud_paths=train_ds.cloud_files,
-                            device=device)
+                            device=device) if is_main_process() else None
 
     # Create trainer
     trainer = SemanticTrainer(cfg=cfg,
@@ -65,44 +83,114 @@ def train_model_active(cfg: DictConfig, device: torch.device) -> None:
                               val_ds=val_ds,
                               device=device)
 
-    # Load voxel selection
-    selection = pull_artifact(selection_artifact, device=torch.device('cpu'))
-    selector.load_voxel_selection(selection, train_ds)
+    # Load voxel selection (a delta selection is applied on top of its parent selections)
+    if is_main_process():
+        for selection in selection_chain(selection_artifact, pull_artifact):
+            selector.load_voxel_selection(selection, train_ds)
 
     # Load model state dict
-    seed_model_state_dict = pull_artifact(model_artifact, device=device)
-
-    for p in percentages:
+    seed_model_state_dict = broadcast_object(pull_artifact(model_artifact, device=device)
+                                             if is_main_process() else None)
+
+    # Restore the state of the loop from the checkpoint: the selections of the loop are applied again
+    # and the trainer continues from the checkpointed epoch and batch
+    checkpoint = TrainingCheckpoint(cfg.train.checkpoint_dir, info) if cfg.train.checkpoint_dir is not None else None
+    state = checkpoint.load(device) if resume and checkpoint is not None and checkpoint.exists() else None
+    if resume and state is None:
+        log.warning('No training checkpoint found, starting from the first iteration.')
+    selections = state['selections'] if state is not None else []
+    parent = state.get('parent', selection_artifact) if state is not None else selection_artifact
+    if is_main_process():
+        for loop_selection in selections:
+            selector.load_voxel_selection(loop_selection, train_ds)
+    broadcast_selection(train_ds)
+    if state is not None:
+        trainer.load_state_dict(state['trainer'])
+        log.info(f'Resuming from iteration {state["iteration"]}, epoch {trainer.epoch}, batch {trainer.batch}')
+    trainer.checkpoint = checkpoint
+
+    for i, p in enumerate(percentages):
+        if state is not None and i < state['iteration']:
+            continue
+        resumed = state is not None and i == state['iteration'] and state['selected']
         with wandb.init(project=wandb_project,
                         group=wandb_group,
                         name=f'Iteration-{p}%',
+                        id=state['wandb_id'] if resumed else None,
+                        resume='allow' if resumed else None,
                         config=omegaconf.OmegaConf.to_container(cfg, resolve=True)):
-
-            # Load model for selection
-            if trainer.best_model['state_dict'] is not None:
-                selector.model.load_state_dict(trainer.best_model['state_dict'])
-            else:
-                selector.model.load_state_dict(seed_model_state_dict)
-
-            # Select voxels
-            selection, normal_metric_statistics, weighted_metric_statistics = selector.select(train_ds, p)
-            selector.load_voxel_selection(selection, train_ds)
-
-            push_artifact(selection_name, selection, 'selection')
-            log_dataset_statistics(cfg, train_ds, dataset_stats)
-
-            if normal_metric_statistics is not None:
-                log_selection_metric_statistics(cfg, normal_metric_statistics, metric_stats)
-            if weighted_metric_statistics is not None:
-                log_selection_metric_statistics(cfg, weighted_metric_statistics, weighted_metric_stats, weighted=True)
+            trainer.checkpoint_state = dict(iteration=i, selected=True, selections=selections, wandb_id=wandb.run.id,
+                                            parent=parent)
+            warm_start = cfg.active.warm_start and i > 0
+
+            if not resumed:
+                if is_main_process():
+                    # Load model for selection
+                    if trainer.best_model['state_dict'] is not None:
+                        selector.model.load_state_dict(trainer.best_model['state_dict'])
+                    else:
+                        selector.model.load_state_dict(seed_model_state_dict)
+
+                    # Select voxels, a delta selection refers to the selection artifact of the previous iteration
+                    selector.selection_parent = parent
+                    selection, normal_metric_statistics, weighted_metric_statistics = selector.select(train_ds, p)
+                    selector.load_voxel_selection(selection, train_ds)
+                    selections.append(selection)
+
+                    # The version is aliased by the run id, so that the next delta can refer to it
+                    push_artifact(selection_name, selection, 'selection', aliases=[f'run-{wandb.run.id}'])
+                    parent = f'{wandb.run.entity}/{wandb.run.project}/{selection_name}:run-{wandb.run.id}'
+                    trainer.checkpoint_state['parent'] = parent
+                    log_dataset_statistics(cfg, train_ds, dataset_stats)
+
+                    if normal_metric_statistics is not None:
+                        log_selection_metric_statistics(cfg, normal_metric_statistics, metric_stats)
+                    if weighted_metric_statistics is not None:
+                        log_selection_metric_statistics(cfg, weighted_metric_statistics, weighted_metric_stats,
+                                                        weighted=True)
+                broadcast_selection(train_ds)
+
+                # Initialize the model either from the seed model or from the model of the previous iteration
+                if warm_start:
+                    trainer.warm_start(cfg.active.warm_start_epochs, cfg.active.warm_start_min_epochs)
+                else:
+                    trainer.model.load_state_dict(seed_model_state_dict)
+                trainer.save_checkpoint()
 
             # Train model on selected voxels
-            trainer.model.load_state_dict(seed_model_state_dict)
             trainer.train()
-            push_artifact(model_name, trainer.best_model['state_dict'], 'model')
-            push_artifact(history_name, trainer.history, 'history')
+            if is_main_process():
+                if warm_start and cfg.active.warm_start_baseline is not None:
+                    log_baseline_comparison(trainer.best_model['miou'], cfg.active.warm_start_baseline,
+                                            wandb_group, f'Iteration-{p}%')
+                push_artifact(model_name, trainer.best_model['state_dict'], 'model')
+                push_artifact(history_name, trainer.history, 'history')
             trainer.reset()
 
+            # The iteration is finished, the next one starts with the selection
+            trainer.checkpoint_state = dict(iteration=i + 1, selected=False, selections=selections, wandb_id=None,
+                                            parent=parent)
+            trainer.save_checkpoint()
+
+
+def log_baseline_comparison(miou: float, baseline_project: str, group: str, run_name: str) -> None:
+    """ Compares the mIoU of the warm started training with the run of the same iteration trained from scratch.
+
+    :param miou: Best validation mIoU of the warm started training.
+    :param baseline_project: W&B project of the runs trained from scratch.
+    :param group: Group of the runs.
+    :param run_name: Name of the run of the iteration.
+    """
+
+    baseline_miou = pull_run_metric(baseline_project, group, run_name, 'MIoU Val')
+    if baseline_miou is None:
+        return
+    log.info(f'Warm start mIoU: {miou:.4f}, from scratch mIoU: {baseline_miou:.4f}, '
+             f'difference: {miou - baseline_miou:+.4f}')
+    wandb.run.summary.update({"Warm Start MIoU": miou,
+                              "Baseline MIoU": baseline_miou,
+                              "Warm Start MIoU Delta": miou - baseline_miou})
+
 
 def create_seed(cfg: DictConfig, device: torch.device) -> None:
     selection_name = f'Seed_{cfg.ds.name}'
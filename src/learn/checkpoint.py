@@ -0,0 +1,37 @@
+import os
+import logging
+
+import torch
+
+log = logging.getLogger(__name__)
+
+
+class TrainingCheckpoint(object):
+    """ Local checkpoint of the training (model, optimizer, scheduler, logger history, epoch and batch) together
+    with the state of the active learning loop (iteration and the applied selections). The checkpoint is written
+    to a temporary file first and then atomically renamed, so an interruption at any moment leaves either
+    the previous or the new checkpoint, never a corrupted one:
+
+        {{ directory }}/{{ name }}.pt
+
+    :param directory: The directory of the checkpoints.
+    :param name: Name of the checkpoint (e.g. the experiment info).
+    """
+
+    def __init__(self, directory: str, name: str):
+        self.path = os.path.join(directory, f'{name}.pt')
+        os.makedirs(directory, exist_ok=True)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def save(self, state: dict) -> None:
+        torch.save(state, f'{self.path}.tmp')
+        os.replace(f'{self.path}.tmp', self.path)
+        log.debug(f'Training checkpoint saved to {self.path}')
+
+    def load(self, device: torch.device = torch.device('cpu')) -> dict:
+        if not self.exists():
+            raise FileNotFoundError(f'Training checkpoint {self.path} does not exist.')
+        log.info(f'Loading training checkpoint {self.path}')
+        return torch.load(self.path, map_location=device)
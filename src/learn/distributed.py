@@ -0,0 +1,129 @@
+import os
+import logging
+from contextlib import contextmanager
+from typing import Any, Callable
+
+import torch
+import numpy as np
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+log = logging.getLogger(__name__)
+
+# Format of the Hydra job logging (conf/hydra), the processes of the distributed training add their rank
+LOG_FORMAT = '[%(asctime)s][%(name)s][%(levelname)s] - %(message)s'
+
+
+def launch(fn: Callable, world_size: int, *args) -> None:
+    """ Runs fn(*args) in world_size processes on this machine. The processes form a gloo process group,
+    so the training is data parallel on CPU (gradients and metrics are all-reduced). The intra-op threads
+    are divided among the processes. Only the main process (rank 0) communicates with W&B.
+
+    The spawned processes do not inherit the logging of Hydra, it is configured again in every process:
+    to the console and to the log file of the Hydra job (if any). The main process logs from the INFO level,
+    the other processes only the warnings.
+
+    The training samples are split among the processes by the DistributedSampler, which pads the dataset
+    to a multiple of world_size by repeating samples. An epoch therefore contains up to world_size - 1
+    duplicated samples.
+
+    :param fn: The training function (must be importable by the spawned processes).
+    :param world_size: Number of processes. If 1, fn is called directly in this process.
+    :param args: Arguments of fn.
+    """
+
+    if world_size <= 1:
+        return fn(*args)
+
+    os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+    os.environ.setdefault('MASTER_PORT', '29500')
+    log.info(f'Launching {world_size} training processes on {os.environ["MASTER_ADDR"]}:{os.environ["MASTER_PORT"]}')
+    log_files = [h.baseFilename for h in logging.getLogger().handlers if isinstance(h, logging.FileHandler)]
+    mp.spawn(_run, args=(world_size, fn, args, log_files), nprocs=world_size, join=True)
+
+
+def _run(rank: int, world_size: int, fn: Callable, args: tuple, log_files: list = None) -> None:
+    _configure_logging(rank, log_files if log_files is not None else [])
+    if rank != 0:
+        os.environ['WANDB_MODE'] = 'disabled'
+    torch.set_num_threads(max(1, torch.get_num_threads() // world_size))
+
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    try:
+        fn(*args)
+    finally:
+        dist.destroy_process_group()
+
+
+def _configure_logging(rank: int, log_files: list) -> None:
+    """ Configures the logging of a spawned process like the Hydra job logging of the parent process.
+    """
+
+    handlers = [logging.StreamHandler()] + [logging.FileHandler(path, mode='a') for path in log_files]
+    logging.basicConfig(level=logging.INFO if rank == 0 else logging.WARNING,
+                        format=LOG_FORMAT.replace('[%(levelname)s]', f'[%(levelname)s][rank {rank}]'),
+                        handlers=handlers, force=True)
+
+
+def is_distributed() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank() -> int:
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size() -> int:
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process() -> bool:
+    return get_rank() == 0
+
+
+def barrier() -> None:
+    if is_distributed():
+        dist.barrier()
+
+
+@contextmanager
+def main_process_first():
+    """ The main process runs the block first (e.g. creates the project files), the other processes afterwards.
+    """
+
+    if not is_main_process():
+        barrier()
+    yield
+    if is_main_process():
+        barrier()
+
+
+def broadcast_object(obj: Any) -> Any:
+    """ Returns the object of the main process in all processes.
+    """
+
+    if not is_distributed():
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=0)
+    return objects[0]
+
+
+def all_reduce_sum(tensor: torch.Tensor) -> torch.Tensor:
+    """ Sums the tensor over all processes in place.
+    """
+
+    if is_distributed():
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor
+
+
+def broadcast_selection(dataset) -> None:
+    """ Copies the selection masks of the dataset from the main process, which labels the voxels
+    (and writes the labels to the project files), to the other processes.
+    """
+
+    if not is_distributed():
+        return
+    scan_mask, cloud_mask = broadcast_object((dataset.scan_selection_mask, dataset.cloud_selection_mask))
+    dataset.scan_selection_mask, dataset.cloud_selection_mask = np.asarray(scan_mask), np.asarray(cloud_mask)
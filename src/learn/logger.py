@@ -3,9 +3,9 @@ import logging
 import wandb
 import torch
 import numpy as np
-from torchmetrics.classification import MulticlassAccuracy, \
-    MulticlassJaccardIndex, MulticlassConfusionMatrix
 
+from .metrics import ConfusionMatrix
+from .distributed import all_reduce_sum, is_main_process
 from src.utils.log import log_class_iou, log_class_accuracy, log_confusion_matrix, log_gradient_flow
 
 log = logging.getLogger(__name__)
@@ -41,16 +41,13 @@ class SemanticLogger(object):
         self.ignore_index = ignore_index
         self.label_names = [v for k, v in labels.items() if k != ignore_index]
 
-        metric_args = dict(num_classes=num_classes, ignore_index=ignore_index, validate_args=False)
-        self.acc = MulticlassAccuracy(**metric_args).to(device)
-        self.iou = MulticlassJaccardIndex(**metric_args).to(device)
-        self.class_acc = MulticlassAccuracy(**metric_args, average='none').to(device)
-        self.class_iou = MulticlassJaccardIndex(**metric_args, average='none').to(device)
-        self.conf_matrix = MulticlassConfusionMatrix(**metric_args, normalize='true').to(device)
+        # All metrics are derived from a single confusion matrix
+        self.conf_matrix = ConfusionMatrix(num_classes, ignore_index, device)
 
         self.batch_loss_history = []
         self.batch_avg_grad_history = []
         self.batch_max_grad_history = []
+        self.grad_sizes = None
 
         self.history = {
 
@@ -74,6 +71,9 @@ class SemanticLogger(object):
             # Gradients
             'maximum_gradients': [],
             'average_gradients': [],
+
+            # Learning rate
+            'learning_rate': [],
         }
 
     def miou_converged(self, min_epochs: int = 30, patience: int = 10):
@@ -109,33 +109,67 @@ class SemanticLogger(object):
         log.info(f'Last miou: {last_miou}, max miou: {max_miou}, improvement: {improvement}')
         return improvement > 0
 
+    def state_dict(self) -> dict:
+        """ State of the logger including the metrics accumulated in the current epoch.
+        """
+
+        return {'history': self.history,
+                'confusion_matrix': self.conf_matrix.matrix,
+                'batch_loss_history': self.batch_loss_history,
+                'batch_avg_grad_history': self.batch_avg_grad_history,
+                'batch_max_grad_history': self.batch_max_grad_history}
+
+    def load_state_dict(self, state: dict) -> None:
+        self.history = state['history']
+        self.conf_matrix.matrix.copy_(state['confusion_matrix'])
+        self.batch_loss_history = state['batch_loss_history']
+        self.batch_avg_grad_history = [g.to(self.device) for g in state['batch_avg_grad_history']]
+        self.batch_max_grad_history = [g.to(self.device) for g in state['batch_max_grad_history']]
+
+        # The checkpoint holds the metrics of the unfinished epoch accumulated by the main process only
+        if not is_main_process():
+            self.conf_matrix.reset()
+            self.batch_loss_history = []
+
+    def log_learning_rate(self, learning_rate: float, epoch: int):
+        self.history['learning_rate'].append(learning_rate)
+        wandb.log({"Learning Rate": learning_rate}, step=epoch)
+
+    def log_training_time(self, epochs: int, max_epochs: int, duration: float):
+        """ Log the number of trained epochs and the time saved by the early stopping to the W&B summary.
+
+        :param epochs: Number of trained epochs
+        :param max_epochs: Maximum number of epochs
+        :param duration: Duration of the trained epochs in seconds (accumulated over resumes)
+        """
+
+        epoch_time = duration / max(epochs, 1)
+        time_saved = (max_epochs - epochs) * epoch_time
+        log.info(f'Trained {epochs} of {max_epochs} epochs in {duration:.0f} s '
+                 f'({epoch_time:.0f} s per epoch), estimated time saved: {time_saved:.0f} s')
+        if wandb.run is not None:
+            wandb.run.summary.update({"Epochs Trained": epochs,
+                                      "Epochs Saved": max_epochs - epochs,
+                                      "Training Time": duration,
+                                      "Time Saved": time_saved})
+
     def update(self, loss: float, outputs: torch.Tensor, targets: torch.Tensor, named_params: dict = None):
         """ Update loss and metrics
 
         :param loss: Loss value
         :param outputs: Model outputs (predictions)
         :param targets: Targets (ground truth)
-        :param named_params: Named parameters of the model
+        :param named_params: Named parameters of the model. If None, the gradients of the batch are not sampled.
         """
 
         self.batch_loss_history.append(loss)
 
-        self.acc.update(outputs, targets)
-        self.iou.update(outputs, targets)
-
-        self.class_acc.update(outputs, targets)
-        self.class_iou.update(outputs, targets)
-
-        self.conf_matrix.update(outputs, targets)
+        self.conf_matrix.update(outputs.detach(), targets)
 
         if named_params is not None:
             self.__update_gradients(named_params)
 
     def reset(self):
-        self.acc.reset()
-        self.iou.reset()
-        self.class_acc.reset()
-        self.class_iou.reset()
         self.conf_matrix.reset()
 
         self.history['loss_val'] = []
@@ -154,6 +188,8 @@ class SemanticLogger(object):
         self.history['average_gradients'] = []
         self.history['maximum_gradients'] = []
 
+        self.history['learning_rate'] = []
+
     def log_train(self, epoch: int):
         """Log train metrics to W&B and save to history.
 
@@ -161,15 +197,9 @@ class SemanticLogger(object):
         """
 
         # Compute loss and metrics
-        acc = self.acc.compute().cpu().item()
-        iou = self.iou.compute().cpu().item()
-        loss = sum(self.batch_loss_history) / len(self.batch_loss_history)
-
-        # Compute gradients
-        avg_batch_grads = np.array(self.batch_avg_grad_history)
-        max_batch_grads = np.array(self.batch_max_grad_history)
-        avg_grads = np.mean(avg_batch_grads, axis=0)
-        max_grads = np.mean(max_batch_grads, axis=0)
+        loss = self.__reduce()
+        acc = self.conf_matrix.accuracy()
+        iou = self.conf_matrix.miou()
 
         # Log loss
         self.history[f'loss_train'].append(loss)
@@ -182,17 +212,20 @@ class SemanticLogger(object):
         self.history[f'accuracy_train'].append(acc)
         wandb.log({f"Accuracy Train": acc}, step=epoch)
 
-        # Log gradients
-        self.history['average_gradients'].append(avg_grads)
-        self.history['maximum_gradients'].append(max_grads)
-        log_gradient_flow(average_gradients=avg_grads, maximum_gradients=max_grads, step=epoch)
+        # Log gradients of the sampled batches (the buffers are synchronized only once per epoch)
+        if len(self.batch_avg_grad_history) > 0:
+            avg_grads = torch.stack(self.batch_avg_grad_history).mean(dim=0).cpu().numpy()
+            max_grads = torch.stack(self.batch_max_grad_history).mean(dim=0).cpu().numpy()
+            self.history['average_gradients'].append(avg_grads)
+            self.history['maximum_gradients'].append(max_grads)
+            log_gradient_flow(average_gradients=avg_grads, maximum_gradients=max_grads, step=epoch)
 
         # Reset batch loss and metrics
-        self.iou.reset()
-        self.acc.reset()
+        self.conf_matrix.reset()
         self.batch_loss_history = []
         self.batch_avg_grad_history = []
         self.batch_max_grad_history = []
+        self.grad_sizes = None
 
     def log_val(self, epoch: int):
         """Log val metrics to W&B and save to history.
@@ -201,12 +234,12 @@ class SemanticLogger(object):
         """
 
         # Compute loss and metrics
-        acc = self.acc.compute().cpu().item()
-        iou = self.iou.compute().cpu().item()
-        class_acc = self.class_acc.compute().cpu()
-        class_iou = self.class_iou.compute().cpu()
-        conf_matrix = self.conf_matrix.compute().cpu()
-        loss = sum(self.batch_loss_history) / len(self.batch_loss_history)
+        loss = self.__reduce()
+        acc = self.conf_matrix.accuracy()
+        iou = self.conf_matrix.miou()
+        class_acc = self.conf_matrix.class_accuracy().cpu()
+        class_iou = self.conf_matrix.class_iou().cpu()
+        conf_matrix = self.conf_matrix.normalized().cpu()
 
         # Log loss
         self.history[f'loss_val'].append(loss)
@@ -232,20 +265,29 @@ class SemanticLogger(object):
                              ignore_index=self.ignore_index, step=epoch)
 
         # Reset batch loss and metrics
-        self.iou.reset()
-        self.acc.reset()
-        self.class_acc.reset()
-        self.class_iou.reset()
         self.conf_matrix.reset()
         self.batch_loss_history = []
 
+    def __reduce(self) -> float:
+        """ Sums the confusion matrix and the batch losses over the processes of the distributed training
+        (no-op in a single process) and returns the mean loss of the epoch.
+        """
+
+        all_reduce_sum(self.conf_matrix.matrix)
+        loss = all_reduce_sum(torch.tensor([sum(self.batch_loss_history), len(self.batch_loss_history)],
+                                           dtype=torch.float64))
+        return (loss[0] / loss[1]).item()
+
     def __update_gradients(self, named_params: dict):
-        avg_grads = []
-        max_grads = []
-        for n, p in named_params:
-            if p.requires_grad and ("bias" not in n):
-                avg_grads.append(p.grad.abs().mean().cpu())
-                max_grads.append(p.grad.abs().max().cpu())
-
-        self.batch_avg_grad_history.append(np.array(avg_grads))
-        self.batch_max_grad_history.append(np.array(max_grads))
+        grads = [p.grad for n, p in named_params if p.requires_grad and p.grad is not None and "bias" not in n]
+        if len(grads) == 0:
+            return
+        if self.grad_sizes is None or self.grad_sizes.shape[0] != len(grads):
+            self.grad_sizes = torch.tensor([g.numel() for g in grads], dtype=torch.float32, device=grads[0].device)
+
+        # Fused reductions over all parameters, the results stay on the device until the end of the epoch
+        avg_grads = torch.stack(torch._foreach_norm(grads, 1)).float() / self.grad_sizes
+        max_grads = torch.stack(torch._foreach_norm(grads, float('inf'))).float()
+
+        self.batch_avg_grad_history.append(avg_grads)
+        self.batch_max_grad_history.append(max_grads)
@@ -0,0 +1,68 @@
+import torch
+
+
+class ConfusionMatrix(object):
+    """ Confusion matrix of the semantic segmentation accumulated over the batches. Each update is a single pass
+    over the batch (one argmax and one bincount), all metrics are derived from the matrix when they are computed:
+        - mIoU and per-class IoU
+        - Accuracy (mean of the per-class accuracies) and per-class accuracy
+        - Confusion matrix normalized over the true labels
+
+    The macro averages skip the ignored class and the classes that are neither in the targets nor in the predictions.
+
+    :param num_classes: Number of semantic classes.
+    :param ignore_index: Target value that is ignored. If None, all targets are used.
+    :param device: Device of the accumulated matrix (the device of the model outputs).
+    """
+
+    def __init__(self, num_classes: int, ignore_index: int = None, device: torch.device = torch.device('cpu')):
+        self.num_classes = num_classes
+        self.ignore_index = ignore_index
+        self.matrix = torch.zeros((num_classes, num_classes), dtype=torch.long, device=device)
+
+    def update(self, outputs: torch.Tensor, targets: torch.Tensor) -> None:
+        """ Adds the batch to the matrix.
+
+        :param outputs: Model outputs with the shape (B, C, ...).
+        :param targets: Targets with the shape (B, ...).
+        """
+
+        predictions = outputs.argmax(dim=1)
+        if self.ignore_index is not None:
+            mask = targets != self.ignore_index
+            predictions, targets = predictions[mask], targets[mask]
+        indices = targets.reshape(-1) * self.num_classes + predictions.reshape(-1)
+        counts = torch.bincount(indices, minlength=self.num_classes ** 2)
+        self.matrix += counts.view(self.num_classes, self.num_classes)
+
+    def reset(self) -> None:
+        self.matrix.zero_()
+
+    def class_iou(self) -> torch.Tensor:
+        matrix = self.matrix.double()
+        true_positives = torch.diag(matrix)
+        union = matrix.sum(dim=0) + matrix.sum(dim=1) - true_positives
+        return (true_positives / union.clamp(min=1)).float()
+
+    def class_accuracy(self) -> torch.Tensor:
+        matrix = self.matrix.double()
+        return (torch.diag(matrix) / matrix.sum(dim=1).clamp(min=1)).float()
+
+    def miou(self) -> float:
+        return self.class_iou()[self.__valid_classes()].mean().item()
+
+    def accuracy(self) -> float:
+        return self.class_accuracy()[self.__valid_classes()].mean().item()
+
+    def normalized(self) -> torch.Tensor:
+        """ Returns the confusion matrix normalized over the true labels (rows).
+        """
+
+        matrix = self.matrix.double()
+        return (matrix / matrix.sum(dim=1, keepdim=True).clamp(min=1)).float()
+
+    def __valid_classes(self) -> torch.Tensor:
+        valid = (self.matrix.sum(dim=0) + self.matrix.sum(dim=1)) > 0
+        if self.ignore_index is not None and 0 <= self.ignore_index < self.num_classes:
+            valid[self.ignore_index] = False
+        return valid
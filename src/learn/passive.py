@@ -8,6 +8,7 @@ from omegaconf import DictConfig
 
 from src.utils.wb import push_artifact
 from src.learn.trainer import SemanticTrainer
+from src.learn.distributed import is_main_process, main_process_first
 from src.datasets import SemanticDataset, SemanticKITTIDataset
 
 log = logging.getLogger(__name__)
@@ -20,18 +21,19 @@ def train_model_passive(cfg: DictConfig, device: torch.device) -> None:
 
     project_name = cfg.project_name if cfg.project_name is not None else 'Baseline'
 
-    train_ds = SemanticDataset(split='train',
-                               cfg=cfg.ds,
-                               dataset_path=cfg.ds.path,
-                               project_name=info,
-                               num_clouds=cfg.train.dataset_size,
-                               al_experiment=False)
-    val_ds = SemanticDataset(split='val',
-                             cfg=cfg.ds,
-                             dataset_path=cfg.ds.path,
-                             project_name=info,
-                             num_clouds=cfg.train.dataset_size,
-                             al_experiment=False)
+    with main_process_first():
+        train_ds = SemanticDataset(split='train',
+                                   cfg=cfg.ds,
+                                   dataset_path=cfg.ds.path,
+                                   project_name=info,
+                                   num_clouds=cfg.train.dataset_size,
+                                   al_experiment=False)
+        val_ds = SemanticDataset(split='val',
+                                 cfg=cfg.ds,
+                                 dataset_path=cfg.ds.path,
+                                 project_name=info,
+                                 num_clouds=cfg.train.dataset_size,
+                                 al_experiment=False)
 
     trainer = SemanticTrainer(cfg=cfg,
                               train_ds=train_ds,
@@ -44,8 +46,9 @@ def train_model_passive(cfg: DictConfig, device: torch.device) -> None:
                     group=cfg.ds.name, name=f'{cfg.model.architecture}-{cfg.train.loss}',
                     config=omegaconf.OmegaConf.to_container(cfg, resolve=True)):
         trainer.train()
-        push_artifact(model_name, trainer.best_model['state_dict'], 'model')
-        push_artifact(history_name, trainer.history, 'history')
+        if is_main_process():
+            push_artifact(model_name, trainer.best_model['state_dict'], 'model')
+            push_artifact(history_name, trainer.history, 'history')
 
 
 def train_semantickitti_original(cfg: DictConfig, device: torch.device) -> None:
@@ -1,3 +1,5 @@
+import copy
+import time
 import logging
 from collections import OrderedDict
 
@@ -6,11 +8,14 @@ import numpy as np
 from tqdm import tqdm
 import torch.optim as optim
 from omegaconf import DictConfig
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Subset
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data.distributed import DistributedSampler
 
 from .logger import get_logger
+from .distributed import is_distributed, is_main_process, get_rank, get_world_size
 from src.losses import get_loss
-from src.models import get_model
+from src.models import get_model, compile_model, ModelRuntime
 from src.datasets import Dataset, get_parser
 
 log = logging.getLogger(__name__)
@@ -28,26 +33,133 @@ class BaseTrainer(object):
         self.batch_size = cfg.train.batch_size
         self.num_workers = cfg.train.num_workers if device.type == 'cuda' else 4
 
-        self.model = get_model(cfg, device)
-        self.loss_fn = get_loss(cfg.train.loss, weights, device)
+        self.runtime = ModelRuntime(cfg.train.precision, cfg.train.channels_last, device)
+        self.model = self.runtime.prepare_model(get_model(cfg, device))
+        self.sparse_loss = cfg.train.sparse_loss
+        self.loss_fn = get_loss(cfg.train.loss, weights, device, cfg.ds.ignore_index, sparse=self.sparse_loss)
         self.parser = get_parser(train_ds.parser_type, device)
         self.logger = get_logger(cfg.model.type, cfg.ds.num_classes, cfg.ds.labels_train, device, cfg.ds.ignore_index)
         self.optimizer = optim.Adam(self.model.parameters(), lr=cfg.train.learning_rate)
+        self.scheduler = self._create_scheduler()
+        self.ddp_model = self._wrap_model()
 
         self.epoch = 0
+        self.batch = 0
         self.epochs = cfg.train.epochs
         self.min_epochs = cfg.train.min_epochs
+        self.training_time = 0.0
         self.patience = cfg.train.patience
+        self.early_stopping = cfg.train.early_stopping
+        self.gradient_interval = cfg.train.gradient_interval
+
+        # Local checkpoint of the training, the checkpoint state is extended by the caller (e.g. the AL loop state)
+        self.checkpoint = None
+        self.checkpoint_state = {}
+        self.checkpoint_batches = cfg.train.checkpoint_batches
 
     @property
     def history(self):
         return self.logger.history
 
+    def state_dict(self) -> dict:
+        return {'model': self.model.state_dict(),
+                'optimizer': self.optimizer.state_dict(),
+                'scheduler': self.scheduler.state_dict() if self.scheduler is not None else None,
+                'scaler': self.runtime.scaler.state_dict(),
+                'logger': self.logger.state_dict(),
+                'epoch': self.epoch,
+                'batch': self.batch,
+                'epochs': self.epochs,
+                'min_epochs': self.min_epochs,
+                'training_time': self.training_time}
+
+    def load_state_dict(self, state: dict) -> None:
+        self.model.load_state_dict(state['model'])
+        self.optimizer.load_state_dict(state['optimizer'])
+        if self.scheduler is not None and state['scheduler'] is not None:
+            self.scheduler.load_state_dict(state['scheduler'])
+        self.runtime.scaler.load_state_dict(state['scaler'])
+        self.logger.load_state_dict(state['logger'])
+        self.epoch, self.batch, self.epochs = state['epoch'], state['batch'], state['epochs']
+        self.min_epochs = state.get('min_epochs', self.cfg.train.min_epochs)
+        self.training_time = state.get('training_time', 0.0)
+
+    def save_checkpoint(self) -> None:
+        """ Saves the state of the trainer and the checkpoint state of the caller to the checkpoint (if set).
+        """
+
+        if self.checkpoint is not None and is_main_process():
+            self.checkpoint.save({**self.checkpoint_state, 'trainer': self.state_dict()})
+
     def train(self):
         raise NotImplementedError
 
+    def _create_scheduler(self):
+        """ Creates the learning rate scheduler selected by cfg.train.lr_schedule:
+            - exponential: The learning rate is multiplied by lr_decay after every epoch.
+            - plateau: The learning rate is multiplied by lr_plateau_factor when the validation mIoU
+              does not improve for lr_plateau_patience epochs.
+            - None: The learning rate is constant.
+        """
+
+        schedule = self.cfg.train.lr_schedule
+        if schedule is None:
+            return None
+        elif schedule == 'exponential':
+            return optim.lr_scheduler.ExponentialLR(self.optimizer, gamma=self.cfg.train.lr_decay)
+        elif schedule == 'plateau':
+            return optim.lr_scheduler.ReduceLROnPlateau(self.optimizer, mode='max',
+                                                        factor=self.cfg.train.lr_plateau_factor,
+                                                        patience=self.cfg.train.lr_plateau_patience)
+        else:
+            raise ValueError(f'Unknown learning rate schedule: {schedule}')
+
+    def _wrap_model(self) -> torch.nn.Module:
+        """ Wraps the model for the training step. In the distributed training the model is wrapped
+        in DistributedDataParallel, which all-reduces the gradients in the backward pass. With train.compile
+        the training step uses the compiled model (with a fallback to the eager model). The model itself
+        (self.model) stays unwrapped, so its state dict is the same as in the single process training.
+        """
+
+        model = self.model
+        if is_distributed():
+            device_ids = [self.device] if self.device.type == 'cuda' else None
+            model = DistributedDataParallel(model, device_ids=device_ids)
+
+        mode = self.cfg.train.compile
+        if mode == 'trace':
+            log.warning('TorchScript tracing is supported only for the inference, the training uses the eager model.')
+            mode = None
+        return compile_model(model, mode, self.cfg.train.compile_cache)
+
+    def _train_indices(self) -> list:
+        """ Indices of the training samples of this process in the current epoch, without the finished batches.
+        In the distributed training each process gets an equally sized shard from the DistributedSampler.
+        The sampler pads the dataset to a multiple of the world size by repeating samples, so up to
+        world_size - 1 samples are trained twice in an epoch.
+        """
+
+        if is_distributed():
+            indices = list(DistributedSampler(self.train_ds, shuffle=False))
+        else:
+            indices = list(range(len(self.train_ds)))
+        return indices[self.batch * self.batch_size:]
+
+    def _step_scheduler(self):
+        """ Updates the learning rate after the validation of the epoch.
+        """
+
+        if self.scheduler is None:
+            return
+        if isinstance(self.scheduler, optim.lr_scheduler.ReduceLROnPlateau):
+            self.scheduler.step(self.logger.history['miou_val'][-1])
+        else:
+            self.scheduler.step()
+
     def train_epoch(self, validate: bool = True):
         """ Train the model for one epoch. If validate is True, the model will be validated after the epoch.
+        If the training is resumed from a checkpoint in the middle of the epoch, the finished batches are skipped
+        (the order of the batches is deterministic).
 
         :param validate: Whether to validate the model after the epoch.
         :return: The logger history. Can be used to save the model state and then resume training from that point.
@@ -56,29 +168,46 @@ class BaseTrainer(object):
         self.model.train()
         # self.train_ds.train_mode()
         self.train_ds.selection_mode = False
-        loader = DataLoader(self.train_ds, batch_size=self.batch_size, shuffle=False, num_workers=self.num_workers)
-        for batch_idx, batch in enumerate(tqdm(loader, desc=f'Training epoch number {self.epoch}')):
+        dataset = Subset(self.train_ds, self._train_indices()) \
+            if self.batch > 0 or is_distributed() else self.train_ds
+        loader = DataLoader(dataset, batch_size=self.batch_size, shuffle=False, num_workers=self.num_workers)
+        for batch_idx, batch in enumerate(tqdm(loader, desc=f'Training epoch number {self.epoch}'), start=self.batch):
             # Zero the parameter gradients
             self.optimizer.zero_grad()
 
             # Load the batch
             inputs, targets = self.parser.parse_batch(batch)
+            inputs = self.runtime.prepare_input(inputs)
 
-            # Forward pass
-            outputs = self.model(inputs)
+            # Forward pass (in the precision of the runtime), the loss is computed in fp32
+            with self.runtime.autocast():
+                outputs = self.ddp_model(inputs)
             if isinstance(outputs, dict) or isinstance(outputs, OrderedDict):
                 outputs = outputs['out']
+            outputs = outputs.float()
+            if self.sparse_loss:
+                # Only the labeled pixels are used by the loss and the metrics
+                outputs, targets = self.loss_fn.gather(outputs, targets)
             loss = self.loss_fn(outputs, targets)
 
-            # Backward pass
-            loss.backward()
+            # Backward pass (the loss is scaled only in fp16)
+            self.runtime.scaler.scale(loss).backward()
 
-            # Update the loss and metrics of the current batch
+            # Update the loss and metrics of the current batch, the gradients are sampled every few batches
+            sample_gradients = self.gradient_interval > 0 and batch_idx % self.gradient_interval == 0
+            if sample_gradients and self.runtime.scaler.is_enabled():
+                self.runtime.scaler.unscale_(self.optimizer)
             with torch.no_grad():
-                self.logger.update(loss.item(), outputs, targets, self.model.named_parameters())
+                self.logger.update(loss.item(), outputs, targets,
+                                   self.model.named_parameters() if sample_gradients else None)
 
             # Update the weights
-            self.optimizer.step()
+            self.runtime.scaler.step(self.optimizer)
+            self.runtime.scaler.update()
+
+            self.batch = batch_idx + 1
+            if self.checkpoint_batches > 0 and self.batch % self.checkpoint_batches == 0:
+                self.save_checkpoint()
 
         # Calculate the loss and metrics of the current epoch and log them
         with torch.no_grad():
@@ -97,16 +226,24 @@ class BaseTrainer(object):
         self.model.eval()
         # self.val_ds.train_mode()
         self.val_ds.selection_mode = False
-        loader = DataLoader(self.val_ds, batch_size=self.batch_size, shuffle=False, num_workers=self.num_workers)
+        # Each process of the distributed training validates a disjoint shard, the metrics are summed
+        dataset = Subset(self.val_ds, range(get_rank(), len(self.val_ds), get_world_size())) \
+            if is_distributed() else self.val_ds
+        loader = DataLoader(dataset, batch_size=self.batch_size, shuffle=False, num_workers=self.num_workers)
         with torch.no_grad():
             for batch_idx, batch in enumerate(tqdm(loader, desc=f'Validation epoch number {self.epoch}')):
                 # Load the batch
                 inputs, targets = self.parser.parse_batch(batch)
+                inputs = self.runtime.prepare_input(inputs)
 
                 # Forward pass
-                outputs = self.model(inputs)
+                with self.runtime.autocast():
+                    outputs = self.model(inputs)
                 if isinstance(outputs, dict) or isinstance(outputs, OrderedDict):
                     outputs = outputs['out']
+                outputs = outputs.float()
+                if self.sparse_loss:
+                    outputs, targets = self.loss_fn.gather(outputs, targets)
                 loss = self.loss_fn(outputs, targets)
 
                 # Update the loss and metrics of the current batch
@@ -123,23 +260,72 @@ class SemanticTrainer(BaseTrainer):
     def __init__(self, cfg: DictConfig, train_ds: Dataset, val_ds: Dataset, device: torch.device,
                  weights: np.ndarray = None):
         super().__init__(cfg, train_ds, val_ds, device, weights)
-        self.best_model = dict(state_dict=None, miou=0, epoch=0)
+        self.best_model = dict(state_dict=None, optimizer_state_dict=None, miou=0, epoch=0)
+
+    def state_dict(self) -> dict:
+        return {**super().state_dict(), 'best_model': self.best_model}
+
+    def load_state_dict(self, state: dict) -> None:
+        super().load_state_dict(state)
+        self.best_model = state['best_model']
 
     def reset(self):
         self.epoch = 0
+        self.batch = 0
+        self.epochs = self.cfg.train.epochs
+        self.min_epochs = self.cfg.train.min_epochs
+        self.training_time = 0.0
         self.logger.reset()
-        self.model = get_model(self.cfg, self.device)
+        self.model = self.runtime.prepare_model(get_model(self.cfg, self.device))
         self.optimizer = optim.Adam(self.model.parameters(), lr=self.cfg.train.learning_rate)
+        self.scheduler = self._create_scheduler()
+        self.ddp_model = self._wrap_model()
+
+    def warm_start(self, epochs: int, min_epochs: int):
+        """ Continues the training from the best model and optimizer state of the previous training with a new
+        epoch budget. The learning rate schedule is replayed from the initial learning rate.
+        Expects the trainer to be reset after the previous training.
+
+        :param epochs: Number of epochs of the warm started training.
+        :param min_epochs: Minimum number of epochs before the early stopping (must be lower than epochs,
+                           otherwise the early stopping never fires).
+        """
+
+        assert self.best_model['state_dict'] is not None, 'There is no previous model to warm start from.'
+        self.model.load_state_dict(self.best_model['state_dict'])
+        self.optimizer.load_state_dict(self.best_model['optimizer_state_dict'])
+        for group in self.optimizer.param_groups:
+            group['lr'] = group['initial_lr'] = self.cfg.train.learning_rate
+        self.scheduler = self._create_scheduler()
+        self.epochs = epochs
+        self.min_epochs = min_epochs
+        if self.early_stopping and min_epochs >= epochs:
+            log.warning(f'Early stopping can not fire in the warm start: min_epochs {min_epochs} >= epochs {epochs}')
+        log.info(f'Warm start from the model of epoch {self.best_model["epoch"]} '
+                 f'with mIoU {self.best_model["miou"]:.4f}, training for {epochs} epochs')
 
     def train(self):
         while self.epoch < self.epochs:
-
+            start = time.time()
             self.train_epoch(validate=True)
+            self.logger.log_learning_rate(self.optimizer.param_groups[0]['lr'], self.epoch)
+            self._step_scheduler()
 
             if self.logger.miou_improved():
-                self.best_model['state_dict'] = self.model.state_dict()
+                self.best_model['state_dict'] = copy.deepcopy(self.model.state_dict())
+                self.best_model['optimizer_state_dict'] = copy.deepcopy(self.optimizer.state_dict())
                 self.best_model['miou'] = self.logger.history['miou_val'][-1]
                 self.best_model['epoch'] = self.epoch
                 log.info(f'New best model found at epoch {self.epoch} with mIoU {self.best_model["miou"]:.4f}')
 
             self.epoch += 1
+            self.batch = 0
+            # The training time is accumulated in the checkpoint, so that it covers the epochs before a resume
+            self.training_time += time.time() - start
+            self.save_checkpoint()
+
+            if self.early_stopping and self.logger.miou_converged(self.min_epochs, self.patience):
+                log.info(f'Early stopping at epoch {self.epoch} of {self.epochs}')
+                break
+
+        self.logger.log_training_time(self.epoch, self.epochs, self.training_time)
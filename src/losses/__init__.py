@@ -1,2 +1,6 @@
-from .lovasz import LovaszSoftmax
-from .main import get_loss
+from src.utils.lazy import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    '.lovasz': ['LovaszSoftmax'],
+    '.main': ['get_loss', 'gather_labeled', 'SparseLoss'],
+})
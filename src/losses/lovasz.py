@@ -1,7 +1,6 @@
 import torch
 import torch.nn as nn
 from itertools import filterfalse
-from torch.autograd import Variable
 
 
 def isnan(x):
@@ -30,21 +29,22 @@ def lovasz_grad(gt_sorted):
     """
     Computes gradient of the Lovasz extension w.r.t sorted errors
     See Alg. 1 in paper
+      gt_sorted: [..., P] Tensor, ground truth sorted by the errors along the last dimension
     """
-    p = len(gt_sorted)
-    gts = gt_sorted.sum()
-    intersection = gts - gt_sorted.float().cumsum(0)
-    union = gts + (1 - gt_sorted).float().cumsum(0)
+    p = gt_sorted.size(-1)
+    gts = gt_sorted.sum(-1, keepdim=True)
+    intersection = gts - gt_sorted.float().cumsum(-1)
+    union = gts + (1 - gt_sorted).float().cumsum(-1)
     jaccard = 1. - intersection / union
     if p > 1:  # cover 1-pixel case
-        jaccard[1:p] = jaccard[1:p] - jaccard[0:-1]
+        jaccard[..., 1:p] = jaccard[..., 1:p] - jaccard[..., 0:-1]
     return jaccard
 
 
 def lovasz_softmax(probs, labels, classes='present', per_image=False, ignore=None):
     """
     Multi-class Lovasz-Softmax loss
-      probs: [B, C, H, W] Variable, class probabilities at each prediction (between 0 and 1).
+      probs: [B, C, H, W] Tensor, class probabilities at each prediction (between 0 and 1).
               Interpreted as binary (sigmoid) output with outputs of size [B, H, W].
       labels: [B, H, W] Tensor, ground truth labels (between 0 and C - 1)
       classes: 'all' for all, 'present' for classes present in labels, or a list of classes to average.
@@ -52,17 +52,23 @@ def lovasz_softmax(probs, labels, classes='present', per_image=False, ignore=Non
       ignore: void class labels
     """
     if per_image:
-        loss = mean(lovasz_softmax_flat(*flatten_probs(prob.unsqueeze(0), lab.unsqueeze(0), ignore), classes=classes)
-                    for prob, lab in zip(probs, labels))
-    else:
-        loss = lovasz_softmax_flat(*flatten_probs(probs, labels, ignore), classes=classes)
-    return loss
+        if probs.dim() == 3:
+            probs = probs.unsqueeze(1)
+        B, C = probs.size(0), probs.size(1)
+        probs = probs.permute(0, 2, 3, 1).reshape(B, -1, C)  # B, P, C
+        labels = labels.reshape(B, -1)
+        valid = torch.ne(labels, ignore) if ignore is not None else None
+        losses, _ = lovasz_softmax_batched(probs, labels, valid, classes=classes)
+        # Images with only void pixels (or without the classes) have zero loss and are averaged in as in the
+        # per-image loop of the original implementation
+        return losses.mean()
+    return lovasz_softmax_flat(*flatten_probs(probs, labels, ignore), classes=classes)
 
 
 def lovasz_softmax_flat(probs, labels, classes='present'):
     """
     Multi-class Lovasz-Softmax loss
-      probs: [P, C] Variable, class probabilities at each prediction (between 0 and 1)
+      probs: [P, C] Tensor, class probabilities at each prediction (between 0 and 1)
       labels: [P] Tensor, ground truth labels (between 0 and C - 1)
       classes: 'all' for all, 'present' for classes present in labels, or a list of classes to average.
     """
@@ -74,25 +80,44 @@ def lovasz_softmax_flat(probs, labels, classes='present'):
     # If probs is [P, C] then ok, if probs [C] then add a dimension
     if probs.dim() == 1:
         probs = probs.unsqueeze(0)
-    C = probs.size(1)
-    losses = []
-    class_to_sum = list(range(C)) if classes in ['all', 'present'] else classes
-    for c in class_to_sum:
-        fg = (labels == c).float()  # foreground for class c
-        if classes == 'present' and fg.sum() == 0:
-            continue
-        if C == 1:
-            if len(classes) > 1:
-                raise ValueError('Sigmoid output possible only with 1 class')
-            class_pred = probs[:, 0]
-        else:
-            class_pred = probs[:, c]
-        errors = (Variable(fg) - class_pred).abs()
-        errors_sorted, perm = torch.sort(errors, 0, descending=True)
-        perm = perm.data
-        fg_sorted = fg[perm]
-        losses.append(torch.dot(errors_sorted, Variable(lovasz_grad(fg_sorted))))
-    return mean(losses)
+    losses, counted = lovasz_softmax_batched(probs.unsqueeze(0), labels.unsqueeze(0), classes=classes)
+    return losses[0] if counted[0] > 0 else probs.sum() * 0.
+
+
+def lovasz_softmax_batched(probs, labels, valid=None, classes='present'):
+    """
+    Lovasz-Softmax loss of multiple images at once. The error vectors of all images and classes are sorted
+    in a single call and the Lovasz gradients are computed with batched cumulative sums.
+      probs: [N, P, C] Tensor, class probabilities at each prediction (between 0 and 1)
+      labels: [N, P] Tensor, ground truth labels (between 0 and C - 1)
+      valid: [N, P] bool Tensor, non-void pixels. Void pixels get zero error and no foreground, they are sorted
+             behind all errors that contribute to the loss, so they do not change the loss.
+      classes: 'all' for all, 'present' for classes present in labels, or a list of classes to average.
+    Returns the loss of each image (mean over its classes) and the number of classes of each image.
+    """
+
+    C = probs.size(2)
+    if C == 1 and len(classes) > 1:
+        raise ValueError('Sigmoid output possible only with 1 class')
+    class_to_sum = list(range(C)) if classes in ['all', 'present'] else list(classes)
+    class_ids = torch.as_tensor(class_to_sum, device=labels.device)
+    channels = class_ids if C > 1 else torch.zeros_like(class_ids)
+
+    fg = (labels.unsqueeze(1) == class_ids.view(1, -1, 1))  # N, K, P foreground of each class
+    if valid is not None:
+        fg = fg & valid.unsqueeze(1)
+    fg = fg.float()
+    errors = (fg - probs[:, :, channels].transpose(1, 2).contiguous()).abs()
+    if valid is not None:
+        errors = errors * valid.unsqueeze(1)
+    errors_sorted, perm = torch.sort(errors, dim=2, descending=True)
+    fg_sorted = torch.gather(fg, 2, perm)
+    losses = (errors_sorted * lovasz_grad(fg_sorted)).sum(dim=2)  # N, K
+
+    counted = (fg.sum(dim=2) > 0) if classes == 'present' else torch.ones_like(losses, dtype=torch.bool)
+    num_counted = counted.sum(dim=1)
+    image_losses = (losses * counted).sum(dim=1) / num_counted.clamp(min=1)
+    return image_losses, num_counted
 
 
 def flatten_probs(probs, labels, ignore=None):
@@ -124,4 +149,9 @@ class LovaszSoftmax(nn.Module):
         self.ignore = ignore
 
     def forward(self, probs, labels):
+        if probs.dim() == 2:
+            # Pixels already flattened to [P, C] (e.g. the labeled pixels gathered by SparseLoss)
+            probs, labels = (probs, labels) if self.ignore is None else \
+                (probs[labels != self.ignore], labels[labels != self.ignore])
+            return lovasz_softmax_flat(probs, labels, self.classes)
         return lovasz_softmax(probs, labels, self.classes, self.per_image, self.ignore)
@@ -1,23 +1,68 @@
 import torch
 import torch.nn as nn
-import segmentation_models_pytorch as smp
 
 from .lovasz import LovaszSoftmax
 
 
-def get_loss(loss_type: str, weight: torch.tensor = None, device: torch.device = torch.device('cpu'), ignore_index=0):
+def get_loss(loss_type: str, weight: torch.tensor = None, device: torch.device = torch.device('cpu'), ignore_index=0,
+             sparse: bool = False):
     if loss_type == 'CombinedLoss':
-        return CombinedLoss(device, weight=weight, ignore_index=ignore_index)
+        loss = CombinedLoss(device, weight=weight, ignore_index=ignore_index)
     elif loss_type == 'CrossEntropyLoss':
-        return nn.CrossEntropyLoss(weight=weight, ignore_index=ignore_index).to(device)
+        loss = nn.CrossEntropyLoss(weight=weight, ignore_index=ignore_index).to(device)
     elif loss_type == 'FocalLoss':
-        return smp.losses.FocalLoss(mode='multiclass', ignore_index=ignore_index).to(device)
+        import segmentation_models_pytorch as smp
+        loss = smp.losses.FocalLoss(mode='multiclass', ignore_index=ignore_index).to(device)
     elif loss_type == 'DiceLoss':
-        return smp.losses.DiceLoss(mode='multiclass', ignore_index=ignore_index).to(device)
+        import segmentation_models_pytorch as smp
+        loss = smp.losses.DiceLoss(mode='multiclass', ignore_index=ignore_index).to(device)
     elif loss_type == 'LovaszLoss':
-        return LovaszSoftmax(ignore=ignore_index).to(device)
+        loss = LovaszSoftmax(ignore=ignore_index).to(device)
     else:
-        raise ValueError(f'Unknown loss: {type}')
+        raise ValueError(f'Unknown loss: {loss_type}')
+    return SparseLoss(loss, ignore_index) if sparse else loss
+
+
+def gather_labeled(logits: torch.Tensor, targets: torch.Tensor, ignore_index: int) -> tuple:
+    """ Gathers the labeled pixels (targets other than ignore_index) of the batch.
+
+    :param logits: Model outputs with the shape (B, C, H, W).
+    :param targets: Targets with the shape (B, H, W).
+    :param ignore_index: Target of the unlabeled and void pixels.
+    :return: Logits of the labeled pixels with the shape (N, C) and their targets with the shape (N,).
+    """
+
+    num_classes = logits.size(1)
+    logits = logits.movedim(1, -1).reshape(-1, num_classes)
+    targets = targets.reshape(-1)
+    labeled = targets != ignore_index
+    return logits[labeled], targets[labeled]
+
+
+class SparseLoss(nn.Module):
+    """ Evaluates the loss only on the labeled pixels, so that its cost scales with the number of labeled pixels
+    and not with the image size. Dense inputs are gathered first, inputs already gathered by gather_labeled
+    (with the shape (N, C)) are used directly.
+
+    :param loss: The loss evaluated on the labeled pixels.
+    :param ignore_index: Target of the unlabeled and void pixels.
+    """
+
+    def __init__(self, loss: nn.Module, ignore_index: int = 0):
+        super(SparseLoss, self).__init__()
+        self.loss = loss
+        self.ignore_index = ignore_index
+
+    def gather(self, logits: torch.Tensor, targets: torch.Tensor) -> tuple:
+        return gather_labeled(logits, targets, self.ignore_index)
+
+    def forward(self, logits, targets):
+        if logits.dim() > 2:
+            logits, targets = self.gather(logits, targets)
+        if targets.numel() == 0:
+            # No labeled pixels in the batch, the gradients should be 0
+            return logits.sum() * 0.
+        return self.loss(logits, targets)
 
 
 class CombinedLoss(nn.Module):
@@ -1,2 +1,9 @@
-from .main import get_model
-from .pointnet import PointNet
+from src.utils.lazy import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    '.main': ['get_model'],
+    '.runtime': ['ModelRuntime'],
+    '.compile': ['CompiledModel', 'compile_model'],
+    '.quantize': ['quantize_model'],
+    '.pointnet': ['PointNet'],
+})
@@ -0,0 +1,144 @@
+import os
+import time
+import hashlib
+import inspect
+import logging
+
+import torch
+import torch.nn as nn
+
+log = logging.getLogger(__name__)
+
+
+class CompiledModel(nn.Module):
+    """ Compiled execution of a model with an automatic fallback to the eager model. The model is compiled lazily
+    on the first forward pass, whose input is used as the example input:
+
+        - compile: torch.compile (inductor backend, which generates C++/OpenMP kernels on the CPU).
+          The compiled kernels are cached by inductor in the cache directory.
+        - trace: TorchScript tracing, for the inference only (the mode of the dropout and the batch norm layers
+          is fixed at the tracing). The traced module is cached in the cache directory, keyed by the model source,
+          the input shape and the runtime, and it is refreshed with the weights of the eager model.
+
+    If the compilation or a compiled forward pass fails, the eager model is used from then on. The compilation
+    time and, after the first benchmark_calls forward passes, the steady-state speedup over the eager model
+    are logged.
+
+    :param model: The eager model. Its parameters are shared with the compiled model (for the traced module
+                  loaded from the cache they are copied by refresh).
+    :param mode: The compilation mode ('compile' or 'trace').
+    :param cache_dir: The directory of the compiled artifacts. If None, nothing is cached.
+    :param benchmark_calls: Number of compiled forward passes after which the speedup is logged.
+    """
+
+    def __init__(self, model: nn.Module, mode: str, cache_dir: str = None, benchmark_calls: int = 10):
+        super().__init__()
+        if mode not in ['compile', 'trace']:
+            raise ValueError(f'Unknown compilation mode: {mode}')
+        self.model = model
+        self.mode = mode
+        self.cache_dir = cache_dir
+        self.benchmark_calls = benchmark_calls
+        self.compiled = None
+        self.failed = False
+        self.eager_time = None
+        self.compiled_times = []
+
+    def forward(self, inputs: torch.Tensor) -> torch.Tensor:
+        if self.failed:
+            return self.model(inputs)
+        try:
+            if self.compiled is None:
+                return self.__compile(inputs)
+            start = time.perf_counter()
+            outputs = self.compiled(inputs)
+            self.__benchmark(time.perf_counter() - start)
+            return outputs
+        except Exception as e:
+            log.warning(f'Compiled model ({self.mode}) failed, falling back to the eager model: {e}')
+            self.failed = True
+            return self.model(inputs)
+
+    def refresh(self) -> None:
+        """ Copies the weights of the eager model to the compiled model, if they are not shared
+        (the traced module loaded from the cache).
+        """
+
+        if self.compiled is not None and not self.failed and self.mode == 'trace':
+            self.compiled.load_state_dict(self.model.state_dict())
+
+    def __getstate__(self):
+        # The compiled model is not picklable (e.g. for the spawned selection shards), it is compiled again
+        state = self.__dict__.copy()
+        state['_modules'] = dict(self._modules, compiled=None)
+        state['compiled_times'] = []
+        return state
+
+    def __compile(self, inputs: torch.Tensor) -> torch.Tensor:
+        # Reference forward pass of the eager model (it only measures the time). It runs in the evaluation mode
+        # without gradients, so that it neither updates the batch norm statistics nor draws dropout masks
+        training = self.model.training
+        self.model.eval()
+        try:
+            start = time.perf_counter()
+            with torch.no_grad():
+                self.model(inputs)
+            self.eager_time = time.perf_counter() - start
+        finally:
+            self.model.train(training)
+
+        start = time.perf_counter()
+        if self.mode == 'compile':
+            if not hasattr(torch, 'compile'):
+                raise RuntimeError(f'torch.compile is not available in PyTorch {torch.__version__}')
+            if self.cache_dir is not None:
+                os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.join(self.cache_dir, 'inductor'))
+            self.compiled = torch.compile(self.model)
+        else:
+            self.compiled = self.__trace(inputs)
+        outputs = self.compiled(inputs)
+        log.info(f'Model compiled ({self.mode}) in {time.perf_counter() - start:.2f} s '
+                 f'(eager forward pass {self.eager_time * 1000:.1f} ms)')
+        return outputs
+
+    def __trace(self, inputs: torch.Tensor) -> torch.jit.ScriptModule:
+        path = os.path.join(self.cache_dir, f'{self.__key(inputs)}.pt') if self.cache_dir is not None else None
+        if path is not None and os.path.exists(path):
+            traced = torch.jit.load(path, map_location=inputs.device)
+            traced.load_state_dict(self.model.state_dict())
+            log.info(f'Traced model loaded from the cache {path}')
+            return traced
+
+        traced = torch.jit.trace(self.model, inputs, check_trace=False)
+        if path is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            torch.jit.save(traced, f'{path}.tmp')
+            os.replace(f'{path}.tmp', path)
+        return traced
+
+    def __key(self, inputs: torch.Tensor) -> str:
+        sha = hashlib.sha1()
+        sha.update(inspect.getsource(type(self.model)).encode())
+        sha.update(str([torch.__version__, type(self.model).__name__, list(inputs.shape[1:]), str(inputs.dtype),
+                        inputs.is_contiguous(memory_format=torch.channels_last), torch.is_autocast_enabled(),
+                        torch.is_autocast_cpu_enabled(), self.model.training]).encode())
+        sha.update(str([(k, list(v.shape)) for k, v in self.model.state_dict().items()]).encode())
+        return sha.hexdigest()
+
+    def __benchmark(self, duration: float) -> None:
+        if len(self.compiled_times) >= self.benchmark_calls:
+            return
+        self.compiled_times.append(duration)
+        if len(self.compiled_times) == self.benchmark_calls:
+            compiled_time = sum(self.compiled_times) / len(self.compiled_times)
+            log.info(f'Compiled model ({self.mode}): {compiled_time * 1000:.1f} ms per forward pass, '
+                     f'eager {self.eager_time * 1000:.1f} ms, speedup {self.eager_time / compiled_time:.2f}x')
+
+
+def compile_model(model: nn.Module, mode: str = None, cache_dir: str = None) -> nn.Module:
+    """ Returns the model for the forward passes: the model itself if mode is None, otherwise the CompiledModel.
+    """
+
+    if mode is None:
+        return model
+    return CompiledModel(model, mode, cache_dir)
@@ -1,6 +1,5 @@
 import torch
 from omegaconf import DictConfig
-import segmentation_models_pytorch as smp
 
 from .pointnet import PointNet
 from .salsanext import SalsaNext
@@ -11,8 +10,12 @@ def get_model(cfg: DictConfig, device: torch.device):
     num_inputs = cfg.ds.num_channels
 
     if cfg.model.architecture == 'SalsaNext':
-        model = SalsaNext(num_inputs, num_outputs)
+        model = SalsaNext(num_inputs, num_outputs,
+                          width=cfg.model.width,
+                          context_blocks=cfg.model.context_blocks,
+                          dilated_context=cfg.model.dilated_context)
     elif cfg.model.architecture == 'DeepLabV3Plus':
+        import segmentation_models_pytorch as smp
         model = smp.DeepLabV3Plus(
             encoder_name='resnet50',
             encoder_weights='imagenet',
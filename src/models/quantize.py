@@ -0,0 +1,61 @@
+import copy
+import time
+import logging
+
+import torch
+import torch.nn as nn
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+log = logging.getLogger(__name__)
+
+DYNAMIC_MODULES = {nn.Linear, nn.LSTM, nn.GRU}
+
+
+def quantize_model(model: nn.Module, calibration_batches: list, mode: str = 'static') -> nn.Module:
+    """ Post-training int8 quantization of the model for the inference on CPU. The quantized model is a copy,
+    the original model is not changed. The inputs and the outputs of the quantized model are float tensors.
+
+    Modes:
+        - static: FX graph mode quantization of the weights and the activations with the default qconfig
+          of the quantized engine (torch.backends.quantized.engine). The activation ranges are calibrated
+          on the calibration batches. If the model can not be traced, the dynamic quantization is used instead.
+        - dynamic: Quantization of the weights of the linear and recurrent layers, the activations are
+          quantized on the fly. Convolutional models (e.g. SalsaNext) have no such layers.
+
+    :param model: The model to be quantized.
+    :param calibration_batches: Input batches for the calibration of the static quantization.
+    :param mode: The quantization mode ('static' or 'dynamic').
+    :return: The quantized model or None if the model has no layers supported by the quantization.
+    """
+
+    if mode not in ['static', 'dynamic']:
+        raise ValueError(f'Unknown quantization mode: {mode}')
+    model = copy.deepcopy(model).cpu().eval()
+
+    if mode == 'static':
+        try:
+            return _quantize_static(model, calibration_batches)
+        except Exception as e:
+            log.warning(f'Static quantization failed, using the dynamic quantization: {e}')
+
+    if not any(type(module) in DYNAMIC_MODULES for module in model.modules()):
+        log.warning('The model has no layers supported by the dynamic quantization, it is not quantized.')
+        return None
+    quantized = quantize_dynamic(model, DYNAMIC_MODULES, dtype=torch.qint8)
+    log.info('Model quantized (dynamic, int8 weights of the linear and recurrent layers)')
+    return quantized
+
+
+def _quantize_static(model: nn.Module, calibration_batches: list) -> nn.Module:
+    start = time.time()
+    engine = torch.backends.quantized.engine
+    example_inputs = (calibration_batches[0].cpu(),)
+    prepared = prepare_fx(model, get_default_qconfig_mapping(engine), example_inputs)
+    with torch.no_grad():
+        for batch in calibration_batches:
+            prepared(batch.cpu())
+    quantized = convert_fx(prepared)
+    log.info(f'Model quantized (static, {engine} engine) with {sum(batch.shape[0] for batch in calibration_batches)} '
+             f'calibration scans in {time.time() - start:.1f} s')
+    return quantized
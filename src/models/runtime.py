@@ -0,0 +1,57 @@
+import logging
+import contextlib
+
+import torch
+import torch.nn as nn
+
+log = logging.getLogger(__name__)
+
+PRECISIONS = {'fp32': None, 'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+
+class ModelRuntime(object):
+    """ Precision and memory format of the model execution. The forward pass runs in the autocast context
+    of the selected precision, the outputs are cast back to fp32, so the losses (including Lovasz) and the
+    selection metrics are always computed in fp32. The channels-last memory format is applied to the model
+    and to the input batches.
+
+    Precisions:
+        - fp32: No autocast.
+        - bf16: Autocast with bfloat16 (CPU and CUDA), no gradient scaling is needed.
+        - fp16: Autocast with float16 and gradient scaling (CUDA only, on CPU bf16 is used instead).
+
+    :param precision: The precision of the forward pass ('fp32', 'bf16' or 'fp16').
+    :param channels_last: Whether to use the channels-last (NHWC) memory format.
+    :param device: The device of the model.
+    """
+
+    def __init__(self, precision: str = 'fp32', channels_last: bool = False,
+                 device: torch.device = torch.device('cpu')):
+        if precision not in PRECISIONS:
+            raise ValueError(f'Unknown precision: {precision}')
+        if precision == 'fp16' and device.type != 'cuda':
+            log.warning('The fp16 autocast with gradient scaling needs CUDA, using bf16 instead.')
+            precision = 'bf16'
+        self.device = device
+        self.precision = precision
+        self.channels_last = channels_last
+        self.dtype = PRECISIONS[precision]
+        self.scaler = torch.cuda.amp.GradScaler(enabled=precision == 'fp16')
+
+    def autocast(self):
+        if self.dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=self.device.type, dtype=self.dtype)
+
+    def prepare_model(self, model: nn.Module) -> nn.Module:
+        if self.channels_last:
+            model = model.to(memory_format=torch.channels_last)
+        return model
+
+    def prepare_input(self, inputs: torch.Tensor) -> torch.Tensor:
+        if self.channels_last and inputs.dim() == 4:
+            inputs = inputs.contiguous(memory_format=torch.channels_last)
+        return inputs
+
+    def __str__(self):
+        return f'ModelRuntime(precision={self.precision}, channels_last={self.channels_last})'
@@ -4,7 +4,7 @@ import torch.nn.functional as F
 
 
 class ResContextBlock(nn.Module):
-    def __init__(self, in_filters, out_filters):
+    def __init__(self, in_filters, out_filters, dilation=2):
         super(ResContextBlock, self).__init__()
         self.conv1 = nn.Conv2d(in_filters, out_filters, kernel_size=(1, 1), stride=1)
         self.act1 = nn.LeakyReLU()
@@ -13,7 +13,7 @@ class ResContextBlock(nn.Module):
         self.act2 = nn.LeakyReLU()
         self.bn1 = nn.BatchNorm2d(out_filters)
 
-        self.conv3 = nn.Conv2d(out_filters, out_filters, (3, 3), dilation=2, padding=2)
+        self.conv3 = nn.Conv2d(out_filters, out_filters, (3, 3), dilation=dilation, padding=dilation)
         self.act3 = nn.LeakyReLU()
         self.bn2 = nn.BatchNorm2d(out_filters)
 
@@ -132,7 +132,7 @@ class UpBlock(nn.Module):
         self.dropout3 = nn.Dropout2d(p=dropout_rate)
 
     def forward(self, x, skip):
-        upA = nn.PixelShuffle(2)(x)
+        upA = F.pixel_shuffle(x, 2)
         if self.drop_out:
             upA = self.dropout1(upA)
 
@@ -163,34 +163,58 @@ class UpBlock(nn.Module):
 
 
 class SalsaNext(nn.Module):
-    def __init__(self, num_inputs, num_outputs):
+    """ SalsaNext with scalable width and context. The default arguments give the original network.
+
+    :param num_inputs: Number of input channels.
+    :param num_outputs: Number of classes.
+    :param width: Multiplier of the channel widths (32 ... 256 in the original network). The base width
+                  is rounded to a multiple of 8.
+    :param context_blocks: Number of the ResContextBlocks at the input resolution (3 in the original network).
+    :param dilated_context: Whether the context blocks use the dilated convolution.
+    """
+
+    def __init__(self, num_inputs, num_outputs, width=1.0, context_blocks=3, dilated_context=True):
         super(SalsaNext, self).__init__()
         self.num_inputs = num_inputs
         self.num_outputs = num_outputs
+        if context_blocks < 1:
+            raise ValueError(f'SalsaNext needs at least one context block, got {context_blocks}')
 
-        self.downCntx = ResContextBlock(num_inputs, 32)
-        self.downCntx2 = ResContextBlock(32, 32)
-        self.downCntx3 = ResContextBlock(32, 32)
+        c = max(8, int(round(32 * width / 8)) * 8)
+        dilation = 2 if dilated_context else 1
+        self.context_names = ['downCntx'] + [f'downCntx{i + 1}' for i in range(1, context_blocks)]
+        for i, name in enumerate(self.context_names):
+            setattr(self, name, ResContextBlock(num_inputs if i == 0 else c, c, dilation=dilation))
 
-        self.resBlock1 = ResBlock(32, 2 * 32, 0.2, pooling=True, drop_out=False)
-        self.resBlock2 = ResBlock(2 * 32, 2 * 2 * 32, 0.2, pooling=True)
-        self.resBlock3 = ResBlock(2 * 2 * 32, 2 * 4 * 32, 0.2, pooling=True)
-        self.resBlock4 = ResBlock(2 * 4 * 32, 2 * 4 * 32, 0.2, pooling=True)
-        self.resBlock5 = ResBlock(2 * 4 * 32, 2 * 4 * 32, 0.2, pooling=False)
+        self.resBlock1 = ResBlock(c, 2 * c, 0.2, pooling=True, drop_out=False)
+        self.resBlock2 = ResBlock(2 * c, 2 * 2 * c, 0.2, pooling=True)
+        self.resBlock3 = ResBlock(2 * 2 * c, 2 * 4 * c, 0.2, pooling=True)
+        self.resBlock4 = ResBlock(2 * 4 * c, 2 * 4 * c, 0.2, pooling=True)
+        self.resBlock5 = ResBlock(2 * 4 * c, 2 * 4 * c, 0.2, pooling=False)
 
-        self.upBlock1 = UpBlock(2 * 4 * 32, 4 * 32, 0.2)
-        self.upBlock2 = UpBlock(4 * 32, 4 * 32, 0.2)
-        self.upBlock3 = UpBlock(4 * 32, 2 * 32, 0.2)
-        self.upBlock4 = UpBlock(2 * 32, 32, 0.2, drop_out=False)
+        self.upBlock1 = UpBlock(2 * 4 * c, 4 * c, 0.2)
+        self.upBlock2 = UpBlock(4 * c, 4 * c, 0.2)
+        self.upBlock3 = UpBlock(4 * c, 2 * c, 0.2)
+        self.upBlock4 = UpBlock(2 * c, c, 0.2, drop_out=False)
 
-        self.logits = nn.Conv2d(32, num_outputs, kernel_size=(1, 1))
+        self.logits = nn.Conv2d(c, num_outputs, kernel_size=(1, 1))
 
     def forward(self, x):
-        downCntx = self.downCntx(x)
-        downCntx = self.downCntx2(downCntx)
-        downCntx = self.downCntx3(downCntx)
+        return self.forward_suffix(self.forward_prefix(x))
+
+    def forward_prefix(self, x):
+        """ The part of the network without dropout (the context blocks and the first residual block at the input
+        resolution). Its outputs are the same for all MC dropout samples, so the MC dropout runs it once
+        and replicates only the outputs for forward_suffix.
+        """
+
+        downCntx = x
+        for name in self.context_names:
+            downCntx = getattr(self, name)(downCntx)
+        return self.resBlock1(downCntx)
 
-        down0c, down0b = self.resBlock1(downCntx)
+    def forward_suffix(self, prefix):
+        down0c, down0b = prefix
         down1c, down1b = self.resBlock2(down0c)
         down2c, down2b = self.resBlock3(down1c)
         down3c, down3b = self.resBlock4(down2c)
@@ -1,2 +1,6 @@
-from .partition import partition_cloud, create_superpoints, calculate_features
-from .redal_features import compute_redal_features
+from src.utils.lazy import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    '.partition': ['partition_cloud', 'create_superpoints', 'calculate_features'],
+    '.redal_features': ['compute_redal_features'],
+})
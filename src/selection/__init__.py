@@ -1,2 +1,7 @@
-from .base_selector import Selector
-from .main import get_selector, select_voxels
+from src.utils.lazy import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    '.base_selector': ['Selector'],
+    '.main': ['get_selector', 'select_voxels'],
+    '.compact': ['selection_chain'],
+})
@@ -1,8 +1,10 @@
+import os
 import torch
 import logging
 from torch_scatter import scatter_mean, scatter_std
 
 from src.datasets import Dataset
+from .spill import spill_tensor
 
 log = logging.getLogger(__name__)
 
@@ -21,35 +23,85 @@ class Cloud(object):
     After calculating the metrics for the voxels, the calculated values are saved in the
     cloud and all other information is deleted. This is done to save memory.
 
+    If the spill directory is specified, the per-voxel arrays (labels, geometric features, label mask and the
+    computed values) are written to memory-mapped files, so that the resident memory of the selection does not
+    grow with the size of the dataset.
+
     :param path: Path to the cloud
     :param size: Number of voxels in the cloud
     :param cloud_id: Unique id of the cloud
+    :param spill_dir: Directory of the memory-mapped arrays. If None, the arrays are kept in memory.
     """
 
     def __init__(self, path: str, size: int, cloud_id: int,
                  diversity_aware: bool, labels: torch.Tensor,
                  surface_variation: torch.Tensor,
-                 color_discontinuity: torch.Tensor = None):
+                 color_discontinuity: torch.Tensor = None,
+                 spill_dir: str = None):
 
         self.eps = 1e-6  # Small value to avoid division by zero
         self.path = path
         self.size = size
         self.id = cloud_id
-        self.labels = labels
+        self.spill_dir = spill_dir
+        self.labels = self._spill('labels', labels)
 
         self.diversity_aware = diversity_aware
-        self.surface_variation = surface_variation
-        self.color_discontinuity = color_discontinuity if color_discontinuity is not None \
-            else torch.zeros_like(self.surface_variation)
+        self.surface_variation = self._spill('surface_variation', surface_variation)
+        self.color_discontinuity = self._spill('color_discontinuity', color_discontinuity) \
+            if color_discontinuity is not None else torch.zeros_like(self.surface_variation)
 
         self.voxel_map = torch.zeros((0,), dtype=torch.int32)
         self.variances = torch.zeros((0,), dtype=torch.float32)
-        self.label_mask = torch.zeros((size,), dtype=torch.bool)
+        self.label_mask = self._spill('label_mask', torch.zeros((size,), dtype=torch.bool))
         self.predictions = torch.zeros((0,), dtype=torch.float32)
 
-    def _save_metric(self, values: torch.Tensor, features: torch.Tensor = None) -> None:
+    def _spill(self, name: str, tensor: torch.Tensor) -> torch.Tensor:
+        """ Moves the tensor to a memory-mapped file in the spill directory. If the spill directory
+        is not specified, the tensor is returned unchanged.
+        """
+
+        if self.spill_dir is None or tensor is None:
+            return tensor
+        return spill_tensor(tensor, os.path.join(self.spill_dir, f'{self.id:06d}_{name}.npy'))
+
+    def _save_metric(self, values: torch.Tensor, features: torch.Tensor = None, aggregated: bool = False,
+                     classes: torch.Tensor = None) -> None:
+        raise NotImplementedError
+
+    @property
+    def partition_sizes(self) -> torch.Tensor:
+        """ Returns the number of voxels of each selectable item of the cloud (voxel or superpoint).
+        """
+
+        raise NotImplementedError
+
+    @property
+    def partition_labels(self) -> torch.Tensor:
+        """ Returns the label of each selectable item of the cloud (voxel or superpoint).
+        """
+
+        raise NotImplementedError
+
+    def partition_voxels(self, indices: torch.Tensor) -> torch.Tensor:
+        """ Returns the indices of the voxels of the selectable items with the given indices.
+        """
+
         raise NotImplementedError
 
+    def aggregate_scores(self, scores: dict) -> dict:
+        """ Aggregates the voxel scores to the partition of the cloud. Returns None if the cloud is not partitioned.
+        """
+
+        return None
+
+    def _partition_scores(self, entry: dict) -> tuple[dict, bool]:
+        """ Returns the scores of the score store entry that correspond to the partition of the cloud
+        and whether they are already aggregated.
+        """
+
+        return entry['voxels'], False
+
     def __str__(self) -> str:
         raise NotImplementedError
 
@@ -107,27 +159,20 @@ class Cloud(object):
         voxel_std_predictions = torch.cat((std_predictions, zero_fill))
         return voxel_std_predictions
 
-    def add_predictions(self, predictions: torch.Tensor, voxel_map: torch.Tensor, mc_dropout: bool = False) -> None:
+    def add_predictions(self, predictions: torch.Tensor, voxel_map: torch.Tensor,
+                        variances: torch.Tensor = None) -> None:
         """ Adds the predictions of the model to the cloud. The predictions are mapped to the voxels and the
         predictions of the voxels that are already labeled are removed.
 
         :param predictions: Predictions of the model. The expected shape is (N, C) where N is the number of voxels
-                            and C is the number of semantic classes. The other option is (M, N, C) where M is the
-                            number of predictions (e.g. for MC dropout) and N and C are the same as before. In this
-                            case, the information stored for future calculations is the mean of the predictions and
-                            the variance. (must be specified with mc_dropout)
+                            and C is the number of semantic classes. For MC dropout, the predictions are the mean
+                            over the dropout samples.
         :param voxel_map: Mapping of the voxels to the point cloud. The expected shape is (N,) where N is the number
                             of voxels. The values of the tensor are the indices of the points in the point cloud.
-        :param mc_dropout: If True, the predictions are assumed to be the result of MC dropout and the mean and
-                            variance are calculated.
+        :param variances: Variances of the predictions over the MC dropout samples with the shape (N, C).
+                            If None, the predictions are assumed to be deterministic.
         """
 
-        if mc_dropout:
-            variances = predictions.var(dim=0)
-            predictions = predictions.mean(dim=0)
-        else:
-            variances = None
-
         # Remove the values of the voxels that are already labeled
         indices = torch.where(torch.isin(voxel_map, torch.nonzero(~self.label_mask).squeeze(1)))
 
@@ -157,14 +202,14 @@ class Cloud(object):
         viewpoint_deviations = scatter_std(self.predictions, self.voxel_map, dim=0, dim_size=self.size).mean(dim=1)
         voxel_mean_predictions = scatter_mean(self.predictions, self.voxel_map, dim=0, dim_size=self.size)
         features = voxel_mean_predictions if self.diversity_aware else None
-        self._save_metric(viewpoint_deviations, features=features)
+        self._save_metric(viewpoint_deviations, features=features, classes=voxel_mean_predictions.argmax(dim=1))
         self.__reset()
 
     def compute_epistemic_uncertainty(self) -> None:
         epistemic_uncertainties = scatter_mean(self.variances, self.voxel_map, dim=0, dim_size=self.size).mean(dim=1)
         voxel_mean_predictions = scatter_mean(self.predictions, self.voxel_map, dim=0, dim_size=self.size)
         features = voxel_mean_predictions if self.diversity_aware else None
-        self._save_metric(epistemic_uncertainties, features=features)
+        self._save_metric(epistemic_uncertainties, features=features, classes=voxel_mean_predictions.argmax(dim=1))
         self.__reset()
 
     def compute_redal_score(self, weights: list[float] = None) -> None:
@@ -176,7 +221,7 @@ class Cloud(object):
         redal_score = weights[0] * entropy + \
                       weights[1] * self.color_discontinuity + \
                       weights[2] * self.surface_variation
-        self._save_metric(redal_score, features=features)
+        self._save_metric(redal_score, features=features, classes=voxel_mean_predictions.argmax(dim=1))
         self.__reset()
 
     def compute_entropy(self) -> None:
@@ -184,7 +229,7 @@ class Cloud(object):
         features = voxel_mean_predictions if self.diversity_aware else None
         voxel_mean_predictions = torch.clamp(voxel_mean_predictions, min=self.eps, max=1 - self.eps)
         entropy = -torch.sum(voxel_mean_predictions * torch.log(voxel_mean_predictions), dim=1)
-        self._save_metric(entropy, features=features)
+        self._save_metric(entropy, features=features, classes=voxel_mean_predictions.argmax(dim=1))
         self.__reset()
 
     def compute_margin(self) -> None:
@@ -192,7 +237,7 @@ class Cloud(object):
         sorted_predictions = torch.sort(voxel_mean_predictions, dim=1, descending=True)[0]
         margin = sorted_predictions[:, 1] - sorted_predictions[:, 0]
         features = voxel_mean_predictions if self.diversity_aware else None
-        self._save_metric(margin, features=features)
+        self._save_metric(margin, features=features, classes=voxel_mean_predictions.argmax(dim=1))
         self.__reset()
 
     def compute_confidence(self) -> None:
@@ -200,8 +245,57 @@ class Cloud(object):
         voxel_confidence = torch.max(voxel_mean_predictions, dim=1)[0]
         least_confidence = 1 - voxel_confidence
         features = voxel_mean_predictions if self.diversity_aware else None
-        self._save_metric(least_confidence, features=features)
+        self._save_metric(least_confidence, features=features, classes=voxel_mean_predictions.argmax(dim=1))
+        self.__reset()
+
+    def compute_scores(self) -> dict:
+        """ Computes all metrics that can be derived from a single deterministic inference pass. The metrics
+        are returned for each voxel together with the mean class predictions. The predictions are reset afterwards.
+        """
+
+        voxel_mean_predictions = scatter_mean(self.predictions, self.voxel_map, dim=0, dim_size=self.size)
+        viewpoint_deviations = scatter_std(self.predictions, self.voxel_map, dim=0, dim_size=self.size).mean(dim=1)
+        sorted_predictions = torch.sort(voxel_mean_predictions, dim=1, descending=True)[0]
+        clamped_predictions = torch.clamp(voxel_mean_predictions, min=self.eps, max=1 - self.eps)
+
+        scores = {'entropy': -torch.sum(clamped_predictions * torch.log(clamped_predictions), dim=1),
+                  'margin': sorted_predictions[:, 1] - sorted_predictions[:, 0],
+                  'confidence': 1 - sorted_predictions[:, 0],
+                  'viewpoint_variance': viewpoint_deviations,
+                  'features': voxel_mean_predictions}
         self.__reset()
+        return scores
+
+    def load_scores(self, entry: dict, strategy: str, redal_weights: list[float] = None) -> None:
+        """ Saves the metric of the strategy from the score store entry.
+
+        :param entry: The entry of the score store (see ScoreStore.save).
+        :param strategy: The selection strategy.
+        :param redal_weights: The weights of the ReDAL score.
+        """
+
+        scores, aggregated = self._partition_scores(entry)
+
+        if strategy == 'ViewpointVariance':
+            values = scores['viewpoint_variance']
+        elif strategy == 'Entropy':
+            values = scores['entropy']
+        elif strategy == 'Margin':
+            values = scores['margin']
+        elif strategy == 'Confidence':
+            values = scores['confidence']
+        elif strategy == 'ReDAL':
+            color_discontinuity = scores.get('color_discontinuity', self.color_discontinuity)
+            surface_variation = scores.get('surface_variation', self.surface_variation)
+            values = redal_weights[0] * scores['entropy'] + \
+                     redal_weights[1] * color_discontinuity + \
+                     redal_weights[2] * surface_variation
+        else:
+            raise ValueError(f'Strategy {strategy} can not be computed from the score store.')
+
+        features = scores['features'] if self.diversity_aware else None
+        classes = scores['classes'] if 'classes' in scores else scores['features'].argmax(dim=1)
+        self._save_metric(values, features=features, aggregated=aggregated, classes=classes)
 
     def __reset(self) -> None:
         self.voxel_map = torch.zeros((0,), dtype=torch.int32)
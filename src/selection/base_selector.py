@@ -1,16 +1,29 @@
-from typing import Any
+from typing import Any, Iterator
+from collections import Counter, deque
+import os
+import copy
+import time
+import hashlib
 import logging
+from concurrent.futures import ProcessPoolExecutor
 
 import torch
 import numpy as np
 from tqdm import tqdm
-from omegaconf import DictConfig
-from sklearn.cluster import MiniBatchKMeans
+from omegaconf import DictConfig, OmegaConf
 from torch.utils.data import DataLoader
 
-from src.models import get_model
+from src.models import get_model, compile_model, quantize_model, CompiledModel, ModelRuntime
 from .base_cloud import Cloud
 from src.datasets import Dataset
+from src.utils.io import CloudInterface
+from .score_store import ScoreStore
+from .ranking import streaming_top_k, grouped_top_k, top_k_overlap
+from .checkpoint import SelectionCheckpoint
+from .compact import encode_selection, decode_selection
+from .coreset import k_center_greedy
+from .scan_subsampling import SelectionSubset, subsample_scans
+from .inference import MCDropoutEngine, auto_batch_size, configure_threads, estimate_image_memory, thread_scope
 
 log = logging.getLogger(__name__)
 
@@ -21,17 +34,88 @@ class Selector(object):
         self.device = device
         self.cloud_paths = cloud_paths
         self.project_name = project_name
-        self.model = get_model(cfg, device)
+        self.runtime = ModelRuntime(cfg.active.precision, cfg.active.channels_last, device)
+        self.model = self.runtime.prepare_model(get_model(cfg, device))
+        # The deterministic inference can use a compiled model, the MC dropout always runs the eager model
+        self.inference_model = compile_model(self.model, cfg.active.compile, cfg.active.compile_cache)
 
         self.strategy = cfg.active.strategy
         self.decay_rate = cfg.active.decay_rate
         self.num_clusters = cfg.active.num_clusters
         self.redal_weights = cfg.active.redal_weights
         self.diversity_aware = cfg.active.diversity_aware
-        self.batch_size = cfg.active.batch_size if device.type != 'cpu' else 1
+        self.diversity_mode = cfg.active.diversity_mode
+        self.coreset_weighted = cfg.active.coreset_weighted
+        self.coreset_candidates = cfg.active.coreset_candidates
+        self.coreset_chunk_size = cfg.active.coreset_chunk_size
+        self.max_cloud_fraction = cfg.active.max_cloud_fraction
+        self.min_class_share = self._class_shares(cfg.active.min_class_share)
+        self.max_batch_size = cfg.active.batch_size
+        self.num_workers = cfg.active.num_workers
+        self.memory_budget = cfg.active.memory_budget
+        self.selection_delta = cfg.active.selection_delta
+        self.selection_parent = None
+        self.scan_subsampling = cfg.active.scan_subsampling
+        self.scan_stride = cfg.active.scan_stride
+        self.min_views = cfg.active.viewpoint_min_views if self.strategy == 'ViewpointVariance' \
+            else cfg.active.min_views
+        self.scan_plan = dict()
+        self.num_shards = cfg.active.num_shards
         self.mc_dropout = True if self.strategy == 'EpistemicUncertainty' else False
+        self.mc_adaptive = cfg.active.mc_adaptive
+        self.mc_samples = cfg.active.mc_max_samples if self.mc_adaptive else cfg.active.mc_samples
+        self.mc_engine = MCDropoutEngine(self.model, self.mc_samples, self.memory_budget,
+                                         adaptive=self.mc_adaptive,
+                                         min_samples=cfg.active.mc_min_samples,
+                                         tolerance=cfg.active.mc_tolerance,
+                                         step=cfg.active.mc_step) if self.mc_dropout else None
+        self.mc_sample_counts = dict()
+
+        self.quantization = cfg.active.quantization
+        self.calibration_scans = cfg.active.calibration_scans
+        self.quantize_check = cfg.active.quantize_check
+        self.quantized_model = None
+        if self.quantization is not None and (device.type != 'cpu' or self.mc_dropout):
+            log.warning('The int8 quantization is supported only for the deterministic inference on CPU, '
+                        'the selection uses the fp32 model.')
+            self.quantization = None
+
+        self.score_store = None
+        if cfg.active.score_store is not None:
+            if self.mc_dropout:
+                log.info('Score store contains only deterministic metrics, it is not used for MC dropout.')
+            else:
+                self.score_store = ScoreStore(cfg.active.score_store)
+
+        self.out_of_core = cfg.active.out_of_core
+        self.spill_dir = cfg.active.spill_dir if self.out_of_core else None
+        if self.out_of_core and (self.max_cloud_fraction is not None or self.min_class_share is not None):
+            log.warning('Selection quotas are not supported in the out-of-core mode, they are ignored.')
+        if self.out_of_core and self.diversity_aware:
+            log.warning('Diversity aware selection clusters the features of all voxels at once, '
+                        'it is disabled in the out-of-core mode.')
+            self.diversity_aware = False
+
+        self.checkpoint = None
+        self.checkpoint_interval = cfg.active.checkpoint_interval
+        self.cloud_range = cfg.active.cloud_range
+        if cfg.active.checkpoint_dir is not None:
+            self.checkpoint = SelectionCheckpoint(cfg.active.checkpoint_dir, self._checkpoint_key())
+
+        if self.num_shards > 1 and device.type != 'cpu':
+            log.warning('Sharded selection is supported only on CPU, the selection runs in a single process.')
+            self.num_shards = 1
+
+        self.batch_size = None
+        self.image_memory = None
+        self.num_threads = cfg.active.num_threads if device.type == 'cpu' else None
+
+        self.init_workers = cfg.active.init_workers
+        self.selector_cache = cfg.active.selector_cache
+        self.label_counts = None
 
         self.clouds = []
+        self._cloud_keys = None
         self.num_voxels = 0
         self.voxels_labeled = 0
 
@@ -42,6 +126,80 @@ class Selector(object):
     def _initialize(self) -> None:
         raise NotImplementedError
 
+    def _load_cloud_data(self, superpoints: bool = False) -> Iterator[dict]:
+        """ Reads the data of the clouds needed for the initialization of the selector, one cloud at a time
+        in the order of the cloud paths. Each cloud is read in a single open of its file
+        (see CloudInterface.read_selection_data). With init_workers > 1 the clouds are read ahead in a spawned
+        process pool, but at most 2 * init_workers clouds are in flight, so the caller builds (and spills) every
+        cloud before the data of the later clouds are read and the peak memory does not grow with the number
+        of clouds. If the selector cache (a directory) is specified, the data of every cloud are saved to its own
+        file and later selectors with the same clouds load them from there.
+
+        :param superpoints: Whether to read the superpoints of the clouds.
+        :return: Iterator over the cloud data in the order of the cloud paths.
+        """
+
+        label_map = OmegaConf.to_container(self.cfg.ds.learning_map) if self.cfg.ds.learning_map is not None else None
+        cache_paths = [self._cloud_cache_path(cloud_path, label_map, superpoints) for cloud_path in self.cloud_paths]
+        cached = [path is not None and os.path.exists(path) for path in cache_paths]
+        if any(cached):
+            log.info(f'Loading the data of {sum(cached)} clouds from the cache {self.selector_cache}')
+
+        cloud_interface = CloudInterface(self.project_name, label_map)
+        missing = [cloud_path for cloud_path, hit in zip(self.cloud_paths, cached) if not hit]
+        reads = self._read_clouds(cloud_interface, missing, superpoints)
+        for cache_path, hit in tqdm(zip(cache_paths, cached), total=len(cache_paths), desc='Reading clouds'):
+            if hit:
+                yield torch.load(cache_path)
+                continue
+            data = next(reads)
+            if cache_path is not None:
+                # Write to a temporary file first, so that an interruption never leaves a corrupted entry
+                torch.save(data, f'{cache_path}.tmp')
+                os.replace(f'{cache_path}.tmp', cache_path)
+            yield data
+
+    def _read_clouds(self, cloud_interface: CloudInterface, cloud_paths: list, superpoints: bool) -> Iterator[dict]:
+        """ Reads the selection data of the clouds in the order of the paths, in a spawned process pool
+        with a bounded number of clouds in flight if init_workers > 1.
+        """
+
+        if self.init_workers <= 1 or len(cloud_paths) <= 1:
+            for cloud_path in cloud_paths:
+                yield cloud_interface.read_selection_data(cloud_path, superpoints)
+            return
+
+        context = torch.multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(self.init_workers, mp_context=context) as pool:
+            futures = deque()
+            for cloud_path in cloud_paths:
+                futures.append(pool.submit(cloud_interface.read_selection_data, cloud_path, superpoints))
+                if len(futures) >= 2 * self.init_workers:
+                    yield futures.popleft().result()
+            while len(futures) > 0:
+                yield futures.popleft().result()
+
+    def _cloud_cache_path(self, cloud_path: str, label_map: dict, superpoints: bool) -> str:
+        """ Returns the path of the cloud in the selector cache (None without the cache). The file name
+        is the hash of the cloud path, its modification time, the label map and the superpoints flag.
+        """
+
+        if self.selector_cache is None:
+            return None
+        os.makedirs(self.selector_cache, exist_ok=True)
+        sha = hashlib.sha1(f'{label_map}{superpoints}{cloud_path}{os.path.getmtime(cloud_path)}'.encode())
+        return os.path.join(self.selector_cache, f'{sha.hexdigest()}.pt')
+
+    def _count_labels(self, label_counts: list[np.ndarray]) -> None:
+        """ Sums the label histograms of the clouds into the label histogram of the selection pool.
+        """
+
+        num_classes = max((len(counts) for counts in label_counts), default=0)
+        self.label_counts = np.zeros((num_classes,), dtype=np.int64)
+        for counts in label_counts:
+            self.label_counts[:len(counts)] += counts
+        log.info(f'Label histogram of the selection pool: {self.label_counts.tolist()}')
+
     def select(self, dataset: Dataset, percentage: float = 0.5) -> dict:
         raise NotImplementedError
 
@@ -60,49 +218,571 @@ class Selector(object):
         return int(self.num_voxels * select_percentage / 100)
 
     def load_voxel_selection(self, voxel_selection: dict, dataset: Dataset = None) -> None:
-        self.voxels_labeled = 0
-        for cloud_name, label_mask in voxel_selection.items():
-            cloud = self.get_cloud(cloud_name)
-            voxels = torch.nonzero(label_mask).squeeze(1)
-            self.voxels_labeled += voxels.shape[0]
+        """ Applies the selection to the label masks of the clouds and optionally to the dataset. The selection
+        can be in the compact format (see compact.encode_selection) or a dictionary of the full label masks.
+        The selections are additive, so a delta selection is applied on top of the current labels. Only the clouds
+        with newly labeled voxels are updated, therefore the time is proportional to the new labels.
+
+        :param voxel_selection: The selection to be applied.
+        :param dataset: Dataset that contains the clouds. If specified, the new labels are written to the dataset.
+        """
+
+        selection, delta = decode_selection(voxel_selection)
+        cloud_voxels = dict()
+        for key, voxels in selection.items():
+            cloud = self.cloud_keys[key] if key in self.cloud_keys else self.get_cloud(key)
+            new_voxels = voxels[~cloud.label_mask[voxels]]
+            if new_voxels.shape[0] == 0:
+                continue
+            cloud.label_mask[new_voxels] = True
+            self.voxels_labeled += new_voxels.shape[0]
+            cloud_voxels[cloud.path] = torch.nonzero(cloud.label_mask).squeeze(1).numpy()
+
+        if dataset is not None and len(cloud_voxels) > 0:
+            dataset.label_clouds(cloud_voxels)
+
+        log.info(f'Loaded {"delta " if delta else ""}voxel selection with new labels in {len(cloud_voxels)} clouds, '
+                 f'{self.percentage_selected}% of the dataset labeled.')
 
-            cloud.label_mask[voxels] = True
-            if dataset is not None:
-                dataset.label_voxels(voxels.numpy(), cloud.path)
-
-        log.info(f'Loaded voxel selection with {self.percentage_selected}% of the dataset labeled.')
+    @property
+    def cloud_keys(self) -> dict:
+        """ Returns the dictionary {cloud selection key: cloud}.
+        """
+
+        if self._cloud_keys is None:
+            self._cloud_keys = {cloud.selection_key: cloud for cloud in self.clouds}
+        return self._cloud_keys
+
+    def _create_selection(self, selected_voxels: dict) -> dict:
+        """ Creates the compact selection from the newly selected voxels. The label masks of the clouds are not
+        changed, the selection is applied by load_voxel_selection.
+
+        :param selected_voxels: Dictionary {cloud id: indices of the selected voxels}.
+        :return: The compact selection. If active.selection_delta is set, only the new voxels are stored together
+                 with the artifact of the previous selection (selection_parent). Without the previous selection
+                 (no labeled voxels or unknown parent) the full selection is stored.
+        """
+
+        delta = self.selection_delta and self.voxels_labeled > 0
+        if delta and self.selection_parent is None:
+            log.warning('The previous selection is unknown, the full selection is stored instead of the delta.')
+            delta = False
+
+        clouds = dict()
+        for cloud in self.clouds:
+            voxels = selected_voxels.get(cloud.id, torch.zeros((0,), dtype=torch.long))
+            voxels = voxels[~cloud.label_mask[voxels]]
+            if not delta:
+                voxels = torch.cat((torch.nonzero(cloud.label_mask).squeeze(1), voxels))
+            elif voxels.shape[0] == 0:
+                continue
+            clouds[cloud.selection_key] = (torch.unique(voxels), cloud.size)
+        return encode_selection(clouds, delta=delta, parent=self.selection_parent)
+
+    def _configure_batch_size(self, dataset: Dataset) -> None:
+        """ Selects the batch size of the selection pass from the memory budget. The memory needed per image
+        is estimated once from the first scan of the dataset. For MC dropout, the batch size is the number of scans
+        whose replicas for the samples of the first forward pass (MCDropoutEngine.samples_per_pass) fit into
+        the budget, so that the engine can draw them in a single pass.
+        """
+
+        if self.image_memory is None:
+            scan = torch.from_numpy(dataset[0][0]).to(self.device)
+            self.model.eval()
+            self.image_memory = estimate_image_memory(self.model, scan)
+            log.info(f'Estimated inference memory per image: {self.image_memory / 1024 ** 2:.1f} MB')
+            if self.mc_engine is not None:
+                self.mc_engine.image_memory = self.image_memory
+        samples_per_pass = self.mc_engine.samples_per_pass if self.mc_engine is not None else 1
+        self.batch_size = auto_batch_size(self.image_memory * samples_per_pass, self.memory_budget, self.max_batch_size)
+        log.info(f'Selection batch size: {self.batch_size}' +
+                 (f' ({samples_per_pass} MC dropout samples per scan in a pass)' if self.mc_engine is not None else ''))
+
+    def _checkpoint_key(self) -> dict:
+        """ Returns the configuration that determines the values of the selection pass.
+        """
+
+        return {'dataset': self.cfg.ds.name,
+                'strategy': self.strategy,
+                'cloud_partitions': self.cfg.active.cloud_partitions,
+                'redal_weights': list(self.redal_weights),
+                'diversity_aware': self.diversity_aware,
+                'mc_samples': self.mc_samples if self.mc_dropout else None,
+                'mc_adaptive': [self.cfg.active.mc_min_samples, self.cfg.active.mc_tolerance, self.cfg.active.mc_step]
+                if self.mc_dropout and self.mc_adaptive else None,
+                'scan_subsampling': [self.scan_subsampling, self.scan_stride, self.min_views]
+                if self.scan_subsampling is not None else None,
+                'precision': self.runtime.precision,
+                'quantization': self.quantization}
+
+    def _load_stored_scores(self, clouds: list[Cloud]) -> list[Cloud]:
+        """ Loads the scores of the clouds from the score store. Returns the clouds that are not in the store
+        and must be computed by the inference pass.
+        """
+
+        # The scores depend on the execution of the pass (not on the strategy that ranks them)
+        key = {name: value for name, value in self._checkpoint_key().items()
+               if name in ['dataset', 'cloud_partitions', 'scan_subsampling', 'precision', 'quantization']}
+        self.score_store.bind(self.model, key=key)
+        missing = []
+        for cloud in tqdm(clouds, desc='Loading scores from the score store'):
+            entry = self.score_store.load(cloud)
+            if entry is None:
+                missing.append(cloud)
+            else:
+                cloud.load_scores(entry, self.strategy, self.redal_weights)
+        log.info(f'Loaded scores of {len(clouds) - len(missing)} / {len(clouds)} clouds from the store.')
+        return missing
+
+    def _load_checkpoint(self, clouds: list[Cloud]) -> tuple[list[Cloud], dict]:
+        """ Loads the completed clouds and the accumulated predictions of the partially processed clouds
+        from the checkpoint. Returns the clouds that are not completed and the number of already processed
+        scans of each partially processed cloud.
+        """
+
+        self.checkpoint.bind(self.model)
+        missing, scans_done = [], dict()
+        for cloud in tqdm(clouds, desc='Loading selection checkpoint'):
+            if self.checkpoint.load_values(cloud):
+                continue
+            missing.append(cloud)
+            num_scans = self.checkpoint.load_partial(cloud)
+            if num_scans > 0:
+                scans_done[cloud.id] = num_scans
+        log.info(f'Loaded {len(clouds) - len(missing)} completed and {len(scans_done)} partially processed clouds '
+                 f'from the checkpoint.')
+        return missing, scans_done
+
+    def _subsample_scans(self, dataset: Dataset, clouds: list[Cloud]) -> None:
+        """ Chooses the scans of the clouds that are used in the selection pass (see scan_subsampling). The choice
+        depends only on the poses and the voxel maps, therefore it is computed once and reused in every selection.
+        The coverage and the expected speedup of the inference are logged.
+        """
+
+        clouds = [cloud for cloud in clouds if cloud.id not in self.scan_plan]
+        if len(clouds) == 0:
+            return
+
+        start = time.time()
+        scan_cloud_ids = dataset.scan_cloud_ids
+        for cloud in tqdm(clouds, desc=f'Subsampling scans ({self.scan_subsampling})'):
+            scan_indices = np.flatnonzero(scan_cloud_ids == cloud.id)
+            chosen, statistics = subsample_scans(dataset.scan_files[scan_indices], self.scan_subsampling,
+                                                 self.min_views, self.scan_stride)
+            self.scan_plan[cloud.id] = (scan_indices[chosen], statistics)
+
+        report = {key: sum(plan[1][key] for plan in self.scan_plan.values())
+                  for key in ['num_scans', 'num_chosen', 'num_voxels', 'num_covered', 'num_below_k']}
+        log.info(f'Scan subsampling ({self.scan_subsampling}, k = {self.min_views}) computed '
+                 f'in {time.time() - start:.1f} s: {report["num_chosen"]} / {report["num_scans"]} scans '
+                 f'(speedup {report["num_scans"] / max(report["num_chosen"], 1):.2f}x), '
+                 f'{report["num_covered"] / max(report["num_voxels"], 1) * 100:.2f}% of voxels covered by k views, '
+                 f'{report["num_below_k"]} voxels observed by less than k scans in total.')
+
+    def _scan_indices(self, dataset: Dataset, clouds: list[Cloud], scans_done: dict = None) -> np.ndarray:
+        """ Returns the indices of the dataset scans that belong to the clouds (only the chosen scans if the scans
+        are subsampled). The first scans_done[cloud.id] scans of a cloud are skipped, because they are already
+        processed.
+        """
+
+        scans_done = scans_done if scans_done is not None else dict()
+        scan_cloud_ids = dataset.scan_cloud_ids
+        indices = []
+        for cloud in clouds:
+            if cloud.id in self.scan_plan:
+                cloud_scans = self.scan_plan[cloud.id][0]
+            else:
+                cloud_scans = np.flatnonzero(scan_cloud_ids == cloud.id)
+            indices.append(cloud_scans[scans_done.get(cloud.id, 0):])
+        return np.sort(np.concatenate(indices)) if len(indices) > 0 else np.zeros((0,), dtype=np.int64)
 
     def _compute_values(self, dataset: Dataset) -> None:
 
         dataset.select_mode()
-        loader = DataLoader(dataset, batch_size=self.batch_size, shuffle=False, num_workers=4)
-        with torch.no_grad():
-            for batch in tqdm(loader, desc=f'Calculating {self.strategy}'):
+        self.mc_sample_counts = dict()
+        clouds = self.clouds
+        if self.score_store is not None:
+            clouds = self._load_stored_scores(clouds)
+
+        scans_done = dict()
+        if self.checkpoint is not None and len(clouds) > 0:
+            clouds, scans_done = self._load_checkpoint(clouds)
+
+        # The clouds out of the range are computed by other processes, they are ranked only if they are completed
+        if self.cloud_range is not None:
+            start, end = self.cloud_range
+            for cloud in clouds:
+                if not start <= cloud.id < end:
+                    cloud.values, cloud.features = None, None
+            clouds = [cloud for cloud in clouds if start <= cloud.id < end]
+            log.info(f'Computing the values of {len(clouds)} clouds in the range [{start}, {end}).')
+        if len(clouds) == 0:
+            return
+        if self.scan_subsampling is not None:
+            self._subsample_scans(dataset, clouds)
+        if self.num_shards > 1 and len(clouds) > 1:
+            self._compute_sharded(dataset, clouds)
+        else:
+            # The threads are set only for the selection pass (the training in the same process keeps its own)
+            with thread_scope(self.num_threads):
+                self._configure_batch_size(dataset)
+                if self.quantization is not None:
+                    self._quantize(dataset)
+                self.__compute_predictions(dataset, clouds, scans_done, self.quantized_model)
+        self._log_mc_samples()
+
+        if self.quantization is not None and self.quantize_check > 0:
+            with thread_scope(self.num_threads):
+                self._check_quantization(dataset, clouds)
+
+    def __compute_predictions(self, dataset: Dataset, clouds: list[Cloud], scans_done: dict,
+                              quantized_model: torch.nn.Module = None, reference: bool = False) -> None:
+        """ Runs the inference pass over the scans of the clouds and computes the values of each cloud
+        after its last scan.
+
+        :param dataset: The dataset of the clouds in the selection mode.
+        :param clouds: The clouds to be computed.
+        :param scans_done: Number of already processed scans of each cloud (see _load_checkpoint).
+        :param quantized_model: The int8 model used instead of the fp32 inference model.
+        :param reference: Whether the pass computes the fp32 reference values of the quantization check.
+                          The values are neither checkpointed nor saved to the score store.
+        """
+
+        if isinstance(self.inference_model, CompiledModel):
+            self.inference_model.refresh()
+        checkpoint = self.checkpoint if not reference else None
+        cloud_map = {cloud.id: cloud for cloud in clouds}
+        subset = SelectionSubset(dataset, self._scan_indices(dataset, clouds, scans_done))
+        loader = DataLoader(subset, batch_size=self.batch_size, shuffle=False, num_workers=self.num_workers)
+        mc_samples = dict()
+        with torch.inference_mode():
+            for i, batch in enumerate(tqdm(loader, desc=f'Calculating {self.strategy}')):
                 scan_batch, _, voxel_map_batch, cloud_id_batch, end_batch = batch
-                scan_batch = scan_batch.to(self.device)
+                scan_batch = self.runtime.prepare_input(scan_batch.to(self.device))
 
                 data = self.__get_batch_data(voxel_map_batch, cloud_id_batch, end_batch)
                 cloud_ids, split_sizes, voxel_maps, valid_indices, end_indicators = data
 
                 if not self.mc_dropout:
-                    model_outputs = self.__get_model_predictions(scan_batch, split_sizes, valid_indices)
+                    model_outputs = self.__get_model_predictions(scan_batch, split_sizes, valid_indices,
+                                                                 quantized_model)
+                    model_variances = [None] * len(model_outputs)
                 else:
-                    batch_num_clouds = torch.unique(cloud_id_batch).shape[0]
-                    model_outputs = [torch.tensor([], device=self.device) for _ in range(batch_num_clouds)]
-
-                    for j in range(5):
-                        model_outputs_it = self.__get_model_predictions(scan_batch, split_sizes, valid_indices)
-                        model_outputs_it = [x.unsqueeze(0) for x in model_outputs_it]
-                        for i, model_output in enumerate(model_outputs_it):
-                            model_outputs[i] = torch.cat((model_outputs[i], model_output), dim=0)
-
-                for cloud_id, model_output, voxel_map, end in zip(cloud_ids, model_outputs, voxel_maps, end_indicators):
-                    cloud = self.get_cloud(cloud_id)
-                    cloud.add_predictions(model_output.cpu(), voxel_map, mc_dropout=self.mc_dropout)
+                    with self.runtime.autocast():
+                        mean, variance = self.mc_engine(scan_batch)
+                    scan_samples = torch.split(self.mc_engine.last_num_samples, split_sizes.tolist())
+                    for cloud_id, num_samples in zip(cloud_ids.tolist(), scan_samples):
+                        samples, scans = mc_samples.get(cloud_id, (0, 0))
+                        mc_samples[cloud_id] = (samples + num_samples.sum().item(), scans + num_samples.shape[0])
+                    model_outputs = self.__split_outputs(mean, split_sizes, valid_indices)
+                    model_variances = self.__split_outputs(variance, split_sizes, valid_indices)
+
+                outputs = zip(cloud_ids, split_sizes, model_outputs, model_variances, voxel_maps, end_indicators)
+                for cloud_id, num_scans, model_output, model_variance, voxel_map, end in outputs:
+                    cloud = cloud_map[cloud_id.item()]
+                    model_variance = model_variance.cpu() if model_variance is not None else None
+                    cloud.add_predictions(model_output.cpu(), voxel_map, variances=model_variance)
+                    scans_done[cloud.id] = scans_done.get(cloud.id, 0) + num_scans.item()
                     if end:
-                        self.__compute_cloud_values(cloud)
+                        if cloud.id in mc_samples:
+                            self.mc_sample_counts[cloud.id] = mc_samples.pop(cloud.id)
+                        self.__compute_cloud_values(cloud, store=not reference)
+                        del scans_done[cloud.id]
+                        if checkpoint is not None:
+                            checkpoint.save_values(cloud)
+
+                # Save the accumulated predictions of the clouds that are not completed yet
+                if checkpoint is not None and self.checkpoint_interval > 0 and (i + 1) % self.checkpoint_interval == 0:
+                    for cloud_id, num_scans in scans_done.items():
+                        checkpoint.save_partial(cloud_map[cloud_id], num_scans)
+
+    def _log_mc_samples(self) -> None:
+        """ Logs the mean number of MC dropout samples per scan of the computed clouds (mc_sample_counts).
+        """
+
+        for cloud_id, (samples, scans) in sorted(self.mc_sample_counts.items()):
+            log.info(f'MC dropout of cloud {cloud_id}: {samples / scans:.2f} samples per scan.')
+
+    def _quantize(self, dataset: Dataset) -> None:
+        """ Quantizes the current model to int8 (see models.quantize_model). The static quantization is calibrated
+        on active.calibration_scans randomly chosen scans of the selection pool (the same scans in every iteration).
+        The inference time of a calibration batch is compared with the fp32 model.
+        """
+
+        generator = torch.Generator().manual_seed(0)
+        num_scans = min(self.calibration_scans, len(dataset))
+        indices = torch.randperm(len(dataset), generator=generator)[:num_scans].tolist()
+        scans = [torch.from_numpy(dataset[i][0]) for i in indices]
+        batches = [self.runtime.prepare_input(torch.stack(scans[i:i + self.batch_size]))
+                   for i in range(0, len(scans), self.batch_size)]
+
+        self.model.eval()
+        self.quantized_model = quantize_model(self.model, batches, self.quantization)
+        if self.quantized_model is None:
+            return
+
+        with torch.inference_mode():
+            times = []
+            for model in [self.model, self.quantized_model]:
+                model(batches[0])
+                start = time.time()
+                model(batches[0])
+                times.append(time.time() - start)
+        log.info(f'Selection inference of {batches[0].shape[0]} scans: fp32 {times[0]:.3f} s, '
+                 f'int8 {times[1]:.3f} s (speedup {times[0] / max(times[1], 1e-9):.2f}x)')
+
+    def _check_quantization(self, dataset: Dataset, clouds: list[Cloud]) -> dict:
+        """ Compares the values of the quantized model with the fp32 model. The fp32 values of active.quantize_check
+        randomly chosen clouds are computed in an additional inference pass and the overlap of the top-k items
+        (the items selected from these clouds) is reported for several selection fractions.
+
+        :return: Dictionary {fraction: overlap of the top-k items}.
+        """
+
+        clouds = [cloud for cloud in clouds if cloud.values is not None]
+        if len(clouds) == 0:
+            return dict()
+        generator = torch.Generator().manual_seed(0)
+        sample = [clouds[i] for i in torch.randperm(len(clouds), generator=generator)[:self.quantize_check].tolist()]
+        references = [copy.deepcopy(cloud) for cloud in sample]
+        for reference in references:
+            reference.spill_dir = None
+        self._configure_batch_size(dataset)
+        self.__compute_predictions(dataset, references, dict(), reference=True)
+
+        values = torch.cat([cloud.values for cloud in sample])
+        reference_values = torch.cat([reference.values for reference in references])
+        overlaps = dict()
+        for fraction in [0.01, 0.05, 0.1]:
+            overlaps[fraction] = top_k_overlap(values, reference_values, max(1, int(fraction * values.shape[0])))
+        log.info(f'Top-k overlap of the {self.quantization} int8 selection with the fp32 selection '
+                 f'({len(sample)} clouds): ' + ', '.join(f'top {fraction * 100:g}%: {overlap * 100:.2f}%'
+                                                         for fraction, overlap in overlaps.items()))
+        return overlaps
+
+    def _shard_clouds(self, dataset: Dataset, clouds: list[Cloud]) -> list[list[Cloud]]:
+        """ Splits the clouds into contiguous shards with approximately the same number of scans.
+        """
+
+        scan_cloud_ids = dataset.scan_cloud_ids
+        num_scans = np.array([len(self.scan_plan[cloud.id][0]) if cloud.id in self.scan_plan
+                              else np.count_nonzero(scan_cloud_ids == cloud.id) for cloud in clouds])
+        targets = np.arange(1, self.num_shards) * num_scans.sum() / self.num_shards
+        bounds = np.searchsorted(np.cumsum(num_scans), targets)
+        shards = [[clouds[i] for i in shard] for shard in np.split(np.arange(len(clouds)), bounds)]
+        return [shard for shard in shards if len(shard) > 0]
+
+    def _compute_sharded(self, dataset: Dataset, clouds: list[Cloud]) -> None:
+        """ Computes the values of the clouds in several worker processes. Each worker gets a copy of the selector
+        restricted to a shard of the clouds (with its own model replica) and its share of the CPU threads.
+        The attributes referring to all clouds are reset, so that a worker receives only the clouds of its shard.
+        The logging is not configured in the spawned workers, therefore the MC dropout sample counts are returned
+        with the values and logged here.
+        The values are computed per cloud, so the merged values and the resulting ranking are the same as
+        in a single process (up to the determinism of the CPU kernels and the MC dropout sampling).
+        """
+
+        shards = self._shard_clouds(dataset, clouds)
+        num_threads = self.cfg.active.num_threads if self.cfg.active.num_threads is not None else os.cpu_count()
+        num_threads = max(1, num_threads // len(shards))
+        log.info(f'Computing {self.strategy} in {len(shards)} processes with {num_threads} threads each.')
+
+        jobs = []
+        for shard_clouds in shards:
+            shard = copy.copy(self)
+            shard.clouds, shard.num_shards, shard.cloud_range = shard_clouds, 1, None
+            shard._cloud_keys = None
+            shard.scan_plan = {cloud.id: self.scan_plan[cloud.id] for cloud in shard_clouds
+                               if cloud.id in self.scan_plan}
+            shard.num_workers = self.num_workers // len(shards)
+            shard.quantized_model, shard.quantize_check = None, 0
+            shard.num_threads = num_threads
+            jobs.append((shard, dataset, num_threads))
+
+        context = torch.multiprocessing.get_context('spawn')
+        with context.Pool(len(shards)) as pool:
+            results = pool.starmap(_compute_shard, jobs)
+
+        for result, mc_sample_counts in results:
+            for cloud_id, (values, features, classes) in result.items():
+                self.get_cloud(cloud_id)._save_metric(values, features=features, aggregated=True, classes=classes)
+            self.mc_sample_counts.update(mc_sample_counts)
+
+    def _select_out_of_core(self, selection_size: int, num_samples: int = 100000) -> tuple:
+        """ Selects the items (voxels or superpoints) with the highest values without concatenating the values
+        of all clouds. The threshold of the top-k is found by a streaming histogram search over the clouds
+        (see ranking.streaming_top_k), so only the values of a single cloud are paged in at a time. The metric
+        statistics are computed in the same streaming fashion, the value curves are estimated from a random sample.
+
+        :param selection_size: Number of voxels to be selected.
+        :param num_samples: Approximate number of values sampled for the value curves of the statistics.
+        :return: Tuple (compact selection, metric_statistics, None).
+        """
+
+        clouds = [cloud for cloud in self.clouds if cloud.values is not None]
+        if len(clouds) == 0:
+            raise ValueError('The out-of-core selection needs the values of the clouds.')
+
+        def chunks():
+            for c in clouds:
+                yield c, c.values, c.partition_sizes
+
+        # Exact moments of the values, the sums are accumulated in double precision
+        count, total, total_sq = 0, 0., 0.
+        minimum, maximum = float('inf'), float('-inf')
+        for cloud in clouds:
+            values = cloud.values.double()
+            count += values.numel()
+            total, total_sq = total + values.sum().item(), total_sq + (values ** 2).sum().item()
+            minimum, maximum = min(minimum, values.min().item()), max(maximum, values.max().item())
+        mean = total / count
+        std = ((total_sq - count * mean ** 2) / max(count - 1, 1)) ** 0.5
+
+        sample_probability = min(1., num_samples / count)
+        selected_sample, left_sample, label_counts = [], [], Counter()
+        generator = torch.Generator().manual_seed(0)
+
+        selected_voxels, num_selected = dict(), 0
+        for cloud, indices in tqdm(streaming_top_k(chunks, selection_size), total=len(clouds),
+                                   desc='Selecting out-of-core'):
+            selected_voxels[cloud.id] = cloud.partition_voxels(indices)
+            num_selected += indices.shape[0]
+
+            selected = torch.zeros(cloud.values.shape[0], dtype=torch.bool)
+            selected[indices] = True
+            sample = torch.rand(selected.shape[0], generator=generator) < sample_probability
+            selected_sample.append(cloud.values[selected & sample])
+            left_sample.append(cloud.values[~selected & sample])
+
+            labels, counts = torch.unique(cloud.partition_labels[indices], return_counts=True)
+            label_counts.update(dict(zip(labels.tolist(), counts.tolist())))
+
+        log.info(f'Selected {num_selected} items from {count} items out-of-core')
+
+        selected_labels = sorted(label_counts.keys())
+        metric_statistics = {'min': minimum,
+                             'max': maximum,
+                             'mean': mean,
+                             'std': std,
+                             'selected_values': self._value_curve(torch.cat(selected_sample)),
+                             'left_values': self._value_curve(torch.cat(left_sample)),
+                             'label_counts': [label_counts[label] for label in selected_labels],
+                             'selected_labels': selected_labels}
+        return self._create_selection(selected_voxels), metric_statistics, None
 
-    def _diversity_aware_order(self, values: torch.Tensor, features: torch.Tensor) -> torch.Tensor:
+    @staticmethod
+    def _value_curve(values: torch.Tensor, size: int = 1000) -> list:
+        """ Returns the values sorted in descending order and interpolated to at most the given size.
+        """
+
+        if values.shape[0] == 0:
+            return []
+        values = torch.sort(values.float(), descending=True)[0]
+        curve = torch.nn.functional.interpolate(values.unsqueeze(0).unsqueeze(0), size=min(size, values.shape[0]),
+                                                mode='linear', align_corners=True)
+        return curve.reshape(-1).tolist()
+
+    def _class_shares(self, min_class_share: DictConfig) -> dict:
+        """ Converts the minimal class shares from the configuration (keyed by the class id or the class name
+        from labels_train) to a dictionary {class id: share}.
+        """
+
+        if min_class_share is None:
+            return None
+        class_ids = {name: class_id for class_id, name in self.cfg.ds.labels_train.items()}
+        return {class_ids[key] if isinstance(key, str) else key: share for key, share in min_class_share.items()}
+
+    def _apply_quotas(self, order: torch.Tensor, cloud_map: torch.Tensor, selection_size: int,
+                      classes: torch.Tensor = None, sizes: torch.Tensor = None) -> torch.Tensor:
+        """ Reorders the items so that the selection respects the quotas. The items are taken in the given order
+        within each group:
+            - Items of the clouds that exceed active.max_cloud_fraction of the selection are moved to the end.
+            - The first items of each predicted class up to active.min_class_share of the selection are moved
+              to the beginning.
+
+        :param order: Order of the items (e.g. the descending order of the values).
+        :param cloud_map: Cloud id of each item.
+        :param selection_size: Number of voxels to be selected.
+        :param classes: Predicted class of each item. If None, the class shares are not applied.
+        :param sizes: Number of voxels of each item. If None, every item is a single voxel.
+        :return: The order respecting the quotas.
+        """
+
+        if self.max_cloud_fraction is None and (self.min_class_share is None or classes is None):
+            return order
+
+        # The earlier the item in the order, the higher its key
+        keys = torch.empty(order.shape[0], dtype=torch.float64)
+        keys[order] = -torch.arange(order.shape[0], dtype=torch.float64)
+        priorities = torch.ones(order.shape[0], dtype=torch.long)
+
+        over_limit = torch.zeros(order.shape[0], dtype=torch.bool)
+        if self.max_cloud_fraction is not None:
+            quotas = torch.full((len(self.clouds),), self.max_cloud_fraction * selection_size, dtype=torch.float64)
+            over_limit = ~grouped_top_k(keys, cloud_map, quotas, sizes)
+            keys[over_limit] = float('-inf')
+
+        if self.min_class_share is not None and classes is not None:
+            num_classes = max(max(self.min_class_share.keys()), classes.max().item()) + 1
+            quotas = torch.zeros((num_classes,), dtype=torch.float64)
+            for class_id, share in self.min_class_share.items():
+                quotas[class_id] = share * selection_size
+            priorities[grouped_top_k(keys, classes, quotas, sizes) & ~over_limit] = 0
+
+        priorities[over_limit] = 2
+        log.info(f'Quotas: {torch.sum(priorities == 0).item()} items guaranteed by the class shares, '
+                 f'{torch.sum(over_limit).item()} items over the cloud limit.')
+        return order[torch.sort(priorities[order], stable=True)[1]]
+
+    def _diversity_aware_order(self, values: torch.Tensor, features: torch.Tensor, selection_size: int,
+                               sizes: torch.Tensor = None) -> torch.Tensor:
+        """ Orders the items (voxels or superpoints) by their values and the diversity of their features.
+
+        :param values: Values of the items.
+        :param features: Features of the items (mean class predictions).
+        :param selection_size: Number of voxels to be selected.
+        :param sizes: Number of voxels of each item. If None, every item is a single voxel.
+        :return: Order of the items.
+        """
+
+        if self.diversity_mode == 'kmeans':
+            return self._kmeans_order(values, features)
+        elif self.diversity_mode == 'coreset':
+            return self._coreset_order(values, features, selection_size, sizes)
+        else:
+            raise ValueError(f'Diversity mode {self.diversity_mode} not implemented.')
+
+    def _coreset_order(self, values: torch.Tensor, features: torch.Tensor, selection_size: int,
+                       sizes: torch.Tensor = None) -> torch.Tensor:
+        """ Orders the items by the k-center greedy core-set of their features (optionally weighted by the values)
+        until the selection size is reached, the rest of the items follows in the descending order of the values.
+        For large datasets the core-set is computed from a random subsample of the candidates.
+        """
+
+        num_items = values.shape[0]
+        candidates = torch.arange(num_items)
+        if self.coreset_candidates is not None and num_items > self.coreset_candidates:
+            generator = torch.Generator().manual_seed(0)
+            candidates = torch.randperm(num_items, generator=generator)[:self.coreset_candidates]
+
+        weights = None
+        if self.coreset_weighted:
+            candidate_values = values[candidates].float()
+            weights = (candidate_values - candidate_values.min()) / \
+                      (candidate_values.max() - candidate_values.min()).clamp(min=1e-12)
+
+        candidate_sizes = sizes[candidates] if sizes is not None else None
+        chosen = k_center_greedy(features[candidates], selection_size, candidate_sizes, weights,
+                                 self.coreset_chunk_size)
+        chosen = candidates[chosen]
+        log.info(f'Core-set of {chosen.shape[0]} items chosen from {candidates.shape[0]} candidates.')
+
+        rest = torch.ones((num_items,), dtype=torch.bool)
+        rest[chosen] = False
+        rest = torch.nonzero(rest).squeeze(1)
+        return torch.cat((chosen, rest[torch.argsort(values[rest], descending=True)]))
+
+    def _kmeans_order(self, values: torch.Tensor, features: torch.Tensor) -> torch.Tensor:
 
         # Sort the values in descending order
         order = torch.argsort(values, descending=True)
@@ -110,6 +790,7 @@ class Selector(object):
         sorted_features = features[order]
 
         # Cluster the voxels based on their features
+        from sklearn.cluster import MiniBatchKMeans
         kmeans = MiniBatchKMeans(n_clusters=self.num_clusters, random_state=0, batch_size=10000).fit(sorted_features)
         clusters = kmeans.labels_
         clusters = torch.tensor(clusters, dtype=torch.long)
@@ -124,8 +805,11 @@ class Selector(object):
         weighted_order = order[torch.argsort(sorted_values, descending=True)]
         return weighted_order
 
-    def __compute_cloud_values(self, cloud: Cloud):
-        if self.strategy == 'ViewpointVariance':
+    def __compute_cloud_values(self, cloud: Cloud, store: bool = True):
+        if store and self.score_store is not None:
+            entry = self.score_store.save(cloud, cloud.compute_scores())
+            cloud.load_scores(entry, self.strategy, self.redal_weights)
+        elif self.strategy == 'ViewpointVariance':
             cloud.compute_viewpoint_variance()
         elif self.strategy == 'EpistemicUncertainty':
             cloud.compute_epistemic_uncertainty()
@@ -140,10 +824,18 @@ class Selector(object):
         else:
             raise ValueError(f'Criterion {self.strategy} not implemented.')
 
-    def __get_model_predictions(self, scan_batch: torch.Tensor,
-                                split_sizes: torch.Tensor, valid_indices: list):
-        self.model.eval() if not self.mc_dropout else self.model.train()
-        model_output = self.model(scan_batch)
+    def __get_model_predictions(self, scan_batch: torch.Tensor, split_sizes: torch.Tensor, valid_indices: list,
+                                quantized_model: torch.nn.Module = None):
+        self.model.eval()
+        if quantized_model is not None:
+            model_output = quantized_model(scan_batch)
+        else:
+            with self.runtime.autocast():
+                model_output = self.inference_model(scan_batch)
+        return self.__split_outputs(model_output.float(), split_sizes, valid_indices)
+
+    @staticmethod
+    def __split_outputs(model_output: torch.Tensor, split_sizes: torch.Tensor, valid_indices: list) -> list:
         model_outputs = torch.split(model_output, list(split_sizes))
         model_outputs = [x.permute(0, 2, 3, 1) for x in model_outputs]
         model_outputs = [x.reshape(-1, x.shape[-1]) for x in model_outputs]
@@ -189,3 +881,15 @@ class Selector(object):
                              'label_counts': label_counts.tolist(),
                              'selected_labels': selected_labels.tolist()}
         return metric_statistics
+
+
+def _compute_shard(selector: Selector, dataset: Dataset, num_threads: int) -> tuple[dict, dict]:
+    """ Worker of the sharded selection. Computes the values of the clouds of the selector and returns them
+    as a dictionary {cloud id: (values, features, classes)} together with the MC dropout sample counts
+    {cloud id: (samples, scans)}.
+    """
+
+    configure_threads(num_threads, 1)
+    selector._compute_values(dataset)
+    values = {cloud.id: (cloud.values, cloud.features, cloud.classes) for cloud in selector.clouds}
+    return values, selector.mc_sample_counts
@@ -0,0 +1,108 @@
+import os
+import json
+import hashlib
+import logging
+
+import torch
+import torch.nn as nn
+
+from .base_cloud import Cloud
+from .score_store import state_dict_hash, label_mask_hash
+
+log = logging.getLogger(__name__)
+
+
+class SelectionCheckpoint(object):
+    """ Checkpoint of the selection pass. The values of the completed clouds and the accumulated predictions
+    of the partially processed clouds are saved, so that an interrupted selection pass continues where it stopped.
+    The checkpoint is keyed by the model weights and the configuration of the selection:
+
+        {{ root }}/{{ hash of the model and the configuration }}/{{ cloud selection key }}.pt
+        {{ root }}/{{ hash of the model and the configuration }}/{{ cloud selection key }}.partial.pt
+
+    Several processes with the same model and configuration share the checkpoint, therefore one selection pass
+    can be split across processes by cloud ranges.
+
+    :param root: The root directory of the checkpoints.
+    :param key: Configuration of the selection that influences the values (e.g. strategy, number of MC samples).
+    """
+
+    def __init__(self, root: str, key: dict):
+        self.root = root
+        self.key = key
+        self.directory = None
+
+    def bind(self, model: nn.Module) -> None:
+        """ Binds the checkpoint to the current weights of the model and the configuration.
+        """
+
+        sha = hashlib.sha1()
+        sha.update(state_dict_hash(model.state_dict()).encode())
+        sha.update(json.dumps(self.key, sort_keys=True).encode())
+        self.directory = os.path.join(self.root, sha.hexdigest())
+        os.makedirs(self.directory, exist_ok=True)
+        log.info(f'Using selection checkpoint {self.directory}')
+
+    def path(self, cloud: Cloud, partial: bool = False) -> str:
+        assert self.directory is not None, 'The selection checkpoint is not bound to a model.'
+        suffix = '.partial.pt' if partial else '.pt'
+        return os.path.join(self.directory, f'{cloud.selection_key.replace("/", "_")}{suffix}')
+
+    def save_values(self, cloud: Cloud) -> None:
+        """ Saves the computed values of the cloud and removes its partial checkpoint.
+        """
+
+        self.__save({'label_hash': label_mask_hash(cloud.label_mask),
+                     'values': cloud.values,
+                     'classes': cloud.classes,
+                     'features': cloud.features}, self.path(cloud))
+        if os.path.exists(self.path(cloud, partial=True)):
+            os.remove(self.path(cloud, partial=True))
+
+    def load_values(self, cloud: Cloud) -> bool:
+        """ Loads the values of the cloud. Returns False if the cloud is not completed in the checkpoint.
+        """
+
+        entry = self.__load(self.path(cloud), cloud)
+        if entry is None:
+            return False
+        cloud._save_metric(entry['values'], features=entry['features'], aggregated=True,
+                           classes=entry.get('classes', None))
+        return True
+
+    def save_partial(self, cloud: Cloud, num_scans: int) -> None:
+        """ Saves the predictions accumulated in the cloud after the first num_scans scans of the cloud.
+        """
+
+        self.__save({'label_hash': label_mask_hash(cloud.label_mask),
+                     'num_scans': num_scans,
+                     'voxel_map': cloud.voxel_map,
+                     'variances': cloud.variances,
+                     'predictions': cloud.predictions}, self.path(cloud, partial=True))
+
+    def load_partial(self, cloud: Cloud) -> int:
+        """ Restores the accumulated predictions of the cloud. Returns the number of scans of the cloud
+        that are already processed (0 if there is no partial checkpoint).
+        """
+
+        entry = self.__load(self.path(cloud, partial=True), cloud)
+        if entry is None:
+            return 0
+        cloud.voxel_map, cloud.variances, cloud.predictions = entry['voxel_map'], entry['variances'], \
+            entry['predictions']
+        return entry['num_scans']
+
+    @staticmethod
+    def __save(entry: dict, path: str) -> None:
+        # Write to a temporary file first, so that an interruption never leaves a corrupted checkpoint
+        torch.save(entry, f'{path}.tmp')
+        os.replace(f'{path}.tmp', path)
+
+    @staticmethod
+    def __load(path: str, cloud: Cloud) -> dict:
+        if not os.path.exists(path):
+            return None
+        entry = torch.load(path)
+        if entry['label_hash'] != label_mask_hash(cloud.label_mask):
+            return None
+        return entry
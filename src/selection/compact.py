@@ -0,0 +1,100 @@
+from typing import Callable
+
+import torch
+import numpy as np
+
+FORMAT = 'compact'
+VERSION = 1
+
+
+def encode_voxels(voxels: torch.Tensor, size: int) -> dict:
+    """ Encodes the indices of the labeled voxels of a cloud either as sorted voxel ids (int32) or as a packed
+    bit mask, whichever is smaller. The ids are used for sparse selections (less than 1/32 of the cloud).
+
+    :param voxels: Sorted indices of the labeled voxels.
+    :param size: Number of voxels in the cloud.
+    :return: Encoded entry of the cloud.
+    """
+
+    if voxels.shape[0] * 4 <= (size + 7) // 8:
+        return {'size': size, 'ids': voxels.to(torch.int32)}
+    mask = np.zeros((size,), dtype=bool)
+    mask[voxels.numpy()] = True
+    return {'size': size, 'bits': torch.from_numpy(np.packbits(mask))}
+
+
+def decode_voxels(entry: dict) -> torch.Tensor:
+    """ Decodes the entry of a cloud created by encode_voxels to the sorted indices of the labeled voxels.
+    """
+
+    if 'ids' in entry:
+        return entry['ids'].long()
+    mask = np.unpackbits(entry['bits'].numpy(), count=entry['size']).astype(bool)
+    return torch.from_numpy(np.flatnonzero(mask))
+
+
+def encode_selection(clouds: dict, delta: bool = False, parent: str = None) -> dict:
+    """ Creates the compact selection. The size of the selection is proportional to the number of labeled voxels
+    instead of the number of voxels in the dataset:
+
+        {'format': 'compact', 'version': 1, 'delta': bool, 'parent': str, 'clouds': {cloud selection key: entry}}
+
+    If the selection is a delta, it contains only the voxels labeled since the previous selection and only
+    the clouds with such voxels. The previous selection (the W&B artifact) is stored as the parent, so that
+    the full state can be restored by selection_chain. Otherwise, it contains all labeled voxels of all clouds.
+
+    :param clouds: Dictionary {cloud selection key: (voxel indices, cloud size)}.
+    :param delta: Whether the selection is a delta against the previous selection.
+    :param parent: The artifact of the previous selection (only for a delta).
+    :return: The compact selection.
+    """
+
+    entries = {key: encode_voxels(voxels, size) for key, (voxels, size) in clouds.items()}
+    return {'format': FORMAT, 'version': VERSION, 'delta': delta, 'parent': parent if delta else None,
+            'clouds': entries}
+
+
+def is_compact(selection: dict) -> bool:
+    return selection.get('format', None) == FORMAT
+
+
+def decode_selection(selection: dict) -> tuple[dict, bool]:
+    """ Decodes a selection to the indices of the labeled voxels of each cloud. Both the compact selection
+    and the original selection (dictionary of the full label masks) are supported.
+
+    :param selection: The compact selection or the dictionary {cloud selection key: label mask}.
+    :return: Tuple (dictionary {cloud selection key: voxel indices}, whether the selection is a delta).
+    """
+
+    if is_compact(selection):
+        assert selection['version'] <= VERSION, f'Unsupported selection version {selection["version"]}.'
+        return {key: decode_voxels(entry) for key, entry in selection['clouds'].items()}, selection['delta']
+    return {key: torch.nonzero(label_mask).squeeze(1) for key, label_mask in selection.items()}, False
+
+
+def selection_chain(artifact: str, pull: Callable[[str], dict]) -> list[dict]:
+    """ Pulls the selection and, if it is a delta, the chain of its parent selections up to a full selection.
+    A delta selection alone contains only the voxels of its iteration, therefore it is never applied without
+    its parents.
+
+    :param artifact: The artifact of the selection.
+    :param pull: Function pulling the selection of an artifact (e.g. src.utils.wb.pull_artifact).
+    :return: The selections in the order of application (the full selection first).
+    :raises ValueError: If a selection of the chain is missing or a delta selection has no parent.
+    """
+
+    chain, visited = [], set()
+    while True:
+        if artifact in visited:
+            raise ValueError(f'Selection {artifact} is its own parent.')
+        visited.add(artifact)
+        selection = pull(artifact)
+        if selection is None:
+            raise ValueError(f'Selection {artifact} not found.')
+        chain.append(selection)
+        if not is_compact(selection) or not selection['delta']:
+            return chain[::-1]
+        if selection.get('parent', None) is None:
+            raise ValueError(f'Selection {artifact} is a delta without a parent selection, '
+                             f'it can not be restored on its own.')
+        artifact = selection['parent']
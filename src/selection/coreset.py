@@ -0,0 +1,40 @@
+import torch
+
+
+def k_center_greedy(features: torch.Tensor, budget: float, sizes: torch.Tensor = None, weights: torch.Tensor = None,
+                    chunk_size: int = 65536) -> torch.Tensor:
+    """ Greedy k-center (core-set) selection. Each step adds the item that is the farthest from the already chosen
+    items, optionally with the distance multiplied by the weight of the item (e.g. its uncertainty). The distance
+    of every item to its nearest chosen item is kept in a single array and updated with the new center
+    in chunks, so the memory is O(N) and each added item costs O(N * d).
+
+    :param features: Features of the items with the shape (N, d).
+    :param budget: The items are added until the sum of their sizes reaches the budget.
+    :param sizes: Sizes of the items (e.g. number of voxels of a superpoint). If None, every item has the size 1.
+    :param weights: Non-negative weights of the items. If None, the items are not weighted.
+    :param chunk_size: Number of items in one chunk of the distance update.
+    :return: Indices of the chosen items in the order of the selection.
+    """
+
+    num_items = features.shape[0]
+    if weights is not None:
+        # Strictly positive weights keep the already chosen items (distance -inf) at the end of the ranking
+        weights = weights.float() + 1e-6
+    min_distances = torch.full((num_items,), float('inf'))
+
+    chosen, total = [], 0.
+    index = torch.argmax(weights).item() if weights is not None else 0
+    while total < budget and len(chosen) < num_items:
+        chosen.append(index)
+        total += sizes[index].item() if sizes is not None else 1
+        center = features[index].float()
+        for start in range(0, num_items, chunk_size):
+            distances = torch.sum((features[start:start + chunk_size].float() - center) ** 2, dim=1)
+            block = min_distances[start:start + chunk_size]
+            torch.minimum(block, distances, out=block)
+        min_distances[index] = float('-inf')
+
+        scores = min_distances * weights if weights is not None else min_distances
+        index = torch.argmax(scores).item()
+
+    return torch.tensor(chosen, dtype=torch.long)
@@ -0,0 +1,241 @@
+import logging
+from contextlib import contextmanager
+
+import torch
+import torch.nn as nn
+
+log = logging.getLogger(__name__)
+
+
+def enable_mc_dropout(model: nn.Module) -> int:
+    """ Puts the model to the evaluation mode and activates only its dropout layers. BatchNorm layers
+    therefore use (and do not update) their running statistics while the dropout still samples
+    a different sub-network for every forward pass.
+
+    :param model: The model to be prepared for the MC dropout inference.
+    :return: The number of activated dropout layers.
+    """
+
+    model.eval()
+    num_dropout = 0
+    for module in model.modules():
+        if isinstance(module, nn.modules.dropout._DropoutNd):
+            module.train()
+            num_dropout += 1
+    if num_dropout == 0:
+        log.warning('The model does not contain any dropout layers, MC dropout samples will be identical.')
+    return num_dropout
+
+
+def estimate_image_memory(model: nn.Module, image: torch.Tensor) -> int:
+    """ Estimates the memory (in bytes) needed for the inference of a single image. The estimate is the sum of
+    the sizes of all intermediate outputs of the leaf modules, which is an upper bound of the peak memory
+    of the inference without gradients.
+
+    :param model: The model used for the inference. The mode of the model (train / eval) is not changed.
+    :param image: A single input image with the shape (C, H, W).
+    :return: Estimated number of bytes needed per image.
+    """
+
+    total = [image.numel() * image.element_size()]
+
+    def hook(_, __, output):
+        if isinstance(output, torch.Tensor):
+            total[0] += output.numel() * output.element_size()
+
+    handles = [m.register_forward_hook(hook) for m in model.modules() if len(list(m.children())) == 0]
+    try:
+        with torch.no_grad():
+            model(image.unsqueeze(0))
+    finally:
+        for handle in handles:
+            handle.remove()
+    return total[0]
+
+
+def auto_batch_size(image_memory: int, memory_budget: float, max_batch_size: int = None) -> int:
+    """ Selects the largest batch size whose activations fit into the memory budget.
+
+    :param image_memory: Estimated memory (in bytes) needed for the inference of a single image.
+    :param memory_budget: Memory (in MB) that can be used for the activations of one forward pass.
+    :param max_batch_size: Upper bound of the batch size. If None, only the memory budget is used.
+    :return: The batch size (at least 1).
+    """
+
+    batch_size = max(1, int(memory_budget * 1024 ** 2) // image_memory)
+    if max_batch_size is not None:
+        batch_size = min(batch_size, max_batch_size)
+    return batch_size
+
+
+def configure_threads(num_threads: int = None, num_interop_threads: int = None) -> None:
+    """ Sets the number of intra-op and inter-op threads used by PyTorch on the CPU. The settings are process-wide,
+    therefore the function is called only by the processes that run nothing but the selection (the selection entry
+    point and the workers of the sharded selection), see thread_scope otherwise. The inter-op threads can be set
+    only once before any parallel work is started, later calls are ignored with a warning.
+
+    :param num_threads: Number of intra-op threads (e.g. for the convolution kernels). If None, it is not changed.
+    :param num_interop_threads: Number of inter-op threads. If None, it is not changed.
+    """
+
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads is not None and torch.get_num_interop_threads() != num_interop_threads:
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError as e:
+            log.warning(f'Number of inter-op threads could not be changed: {e}')
+    log.info(f'Using {torch.get_num_threads()} intra-op and {torch.get_num_interop_threads()} inter-op threads.')
+
+
+@contextmanager
+def thread_scope(num_threads: int = None):
+    """ Sets the number of intra-op threads for the duration of the context and restores the previous number
+    afterwards, so that the other work of the process (e.g. the training in the active learning loop)
+    keeps its own settings.
+
+    :param num_threads: Number of intra-op threads inside the context. If None, it is not changed.
+    """
+
+    previous = torch.get_num_threads()
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+        log.info(f'Using {num_threads} intra-op threads for the selection.')
+    try:
+        yield
+    finally:
+        torch.set_num_threads(previous)
+
+
+class MCDropoutEngine(object):
+    """ Monte Carlo dropout inference engine. The batch is replicated along the batch dimension so that a single
+    forward pass produces multiple dropout samples for every image. The number of replicas in one forward pass
+    is limited by the memory budget. The samples are not stacked, instead they are reduced on the fly into
+    the running mean and the unbiased variance (Chan's parallel variant of the Welford algorithm).
+
+    If the model splits its forward pass into forward_prefix (the layers before the first dropout layer) and
+    forward_suffix (e.g. SalsaNext), the prefix runs once per batch and only its outputs are replicated,
+    so the deterministic layers at the full resolution are not recomputed for every sample.
+
+    In the adaptive mode, every scan is sampled until the largest change of its per-pixel variance estimate
+    since the previous estimate is within the tolerance or max_samples samples are drawn. The first estimate
+    is taken at min_samples samples, the next ones after every step samples (independently of the memory budget,
+    a step may need several forward passes). The converged scans are not sampled anymore, only the remaining
+    scans are replicated for the next step.
+
+    :param model: The model with the dropout layers.
+    :param num_samples: Number of MC dropout samples for every image (in the adaptive mode the maximum).
+    :param memory_budget: Memory (in MB) that can be used for the activations of one forward pass.
+    :param image_memory: Estimated memory (in bytes) needed per image. If None, it is estimated on the first batch.
+    :param adaptive: Whether to stop sampling a scan when its variance estimate converges.
+    :param min_samples: Minimal number of samples in the adaptive mode.
+    :param tolerance: Maximal absolute change of the per-pixel variance between two estimates in the adaptive mode.
+    :param step: Number of samples between two convergence checks in the adaptive mode.
+    :param share_prefix: Whether to run the deterministic prefix of the model only once (if the model supports it).
+    """
+
+    def __init__(self, model: nn.Module, num_samples: int, memory_budget: float, image_memory: int = None,
+                 adaptive: bool = False, min_samples: int = 2, tolerance: float = 1e-3, step: int = 1,
+                 share_prefix: bool = True):
+        assert num_samples > 1, 'MC dropout needs at least two samples to estimate the variance.'
+        assert min_samples > 1, 'MC dropout needs at least two samples to estimate the variance.'
+        assert step > 0, 'MC dropout step must be positive.'
+        self.model = model
+        self.num_samples = num_samples
+        self.memory_budget = memory_budget
+        self.image_memory = image_memory
+        self.adaptive = adaptive
+        self.min_samples = min(min_samples, num_samples)
+        self.tolerance = tolerance
+        self.step = step
+        self.share_prefix = share_prefix
+        self.last_num_samples = None
+
+    @property
+    def samples_per_pass(self) -> int:
+        """ Number of samples drawn for every scan in the first forward pass if the memory allows it
+        (used to size the scan batch).
+        """
+
+        return self.min_samples if self.adaptive else self.num_samples
+
+    def max_replicas(self, scan_batch: torch.Tensor) -> int:
+        """ Returns the number of samples that fit into a single forward pass of the batch.
+        """
+
+        if self.image_memory is None:
+            self.image_memory = estimate_image_memory(self.model, scan_batch[0])
+        replicas = auto_batch_size(self.image_memory * scan_batch.shape[0], self.memory_budget)
+        return min(self.num_samples, replicas)
+
+    def __call__(self, scan_batch: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        """ Computes the mean and the variance of the model predictions over the MC dropout samples.
+        The numbers of drawn samples of the scans are stored in last_num_samples (tensor with the shape (B,)).
+
+        :param scan_batch: Batch of the input images with the shape (B, C, H, W).
+        :return: Mean and variance of the predictions, both with the shape (B, K, H, W).
+        """
+
+        enable_mc_dropout(self.model)
+        batch_size = scan_batch.shape[0]
+        counts = torch.zeros(batch_size, dtype=torch.long)
+
+        # The deterministic prefix of the network is computed only once for all samples
+        split = self.share_prefix and hasattr(self.model, 'forward_prefix') and hasattr(self.model, 'forward_suffix')
+        prefix = self.model.forward_prefix(scan_batch) if split else scan_batch
+        prefix = prefix if isinstance(prefix, tuple) else (prefix,)
+
+        # All scans that are still sampled have the same number of samples (count)
+        active = torch.arange(batch_size, device=scan_batch.device)
+        count, mean, m2, previous = 0, None, None, None
+        while active.shape[0] > 0 and count < self.num_samples:
+            if not self.adaptive:
+                target = self.num_samples
+            elif count < self.min_samples:
+                target = self.min_samples
+            else:
+                target = min(count + self.step, self.num_samples)
+
+            while count < target:
+                num = min(self.max_replicas(scan_batch[active]), target - count)
+
+                # The statistics are accumulated in fp32 also if the model runs in autocast
+                replicated = tuple(x[active].repeat(num, 1, 1, 1) for x in prefix)
+                outputs = self.model.forward_suffix(replicated) if split else self.model(replicated[0])
+                outputs = outputs.float()
+                outputs = outputs.reshape(num, active.shape[0], *outputs.shape[1:])
+                if mean is None:
+                    _, mean, m2 = self.merge(0, None, None, outputs)
+                else:
+                    _, mean[active], m2[active] = self.merge(count, mean[active], m2[active], outputs)
+                count += num
+            counts[active.cpu()] = count
+
+            if self.adaptive:
+                variance = m2[active] / (count - 1)
+                if previous is None:
+                    previous = variance
+                    continue
+                change = torch.abs(variance - previous[active]).amax(dim=(1, 2, 3))
+                previous[active] = variance
+                active = active[change > self.tolerance]
+
+        self.last_num_samples = counts
+        return mean, m2 / (counts.to(m2.device) - 1).view(-1, 1, 1, 1).to(m2.dtype)
+
+    @staticmethod
+    def merge(count: int, mean: torch.Tensor, m2: torch.Tensor, samples: torch.Tensor) -> tuple:
+        """ Merges a chunk of samples with the shape (N, ...) into the running statistics.
+        """
+
+        num = samples.shape[0]
+        chunk_mean = samples.mean(dim=0)
+        chunk_m2 = ((samples - chunk_mean) ** 2).sum(dim=0)
+        if count == 0:
+            return num, chunk_mean, chunk_m2
+
+        total = count + num
+        delta = chunk_mean - mean
+        mean = mean + delta * (num / total)
+        m2 = m2 + chunk_m2 + delta ** 2 * (count * num / total)
+        return total, mean, m2
@@ -7,6 +7,8 @@ import numpy as np
 from omegaconf import DictConfig
 
 from .base_selector import Selector
+from .compact import selection_chain
+from .inference import configure_threads
 from .voxel_selector import VoxelSelector
 from .superpoint_selector import SuperpointSelector
 
@@ -57,6 +59,10 @@ def select_voxels(cfg: DictConfig, experiment: Experiment, device: torch.device)
     dataset = SemanticDataset(split='train', cfg=cfg.ds, dataset_path=cfg.ds.path, project_name=experiment.info,
                               num_clouds=cfg.train.dataset_size, al_experiment=True, selection_mode=True)
 
+    # The process runs only the selection, so the inter-op threads can be set process-wide
+    if device.type == 'cpu':
+        configure_threads(num_interop_threads=cfg.active.num_interop_threads)
+
     if seed:
         selector = get_selector(selection_objects=cloud_partitions, criterion='Random',
                                 dataset_path=cfg.ds.path, project_name=experiment.info,
@@ -71,8 +77,9 @@ def select_voxels(cfg: DictConfig, experiment: Experiment, device: torch.device)
         # Load the selection from W&B
         selection_artifact = cfg.active.selection if cfg.active.selection is not None else \
             f'{experiment.selection}:{selection_version}'
-        selection = load_artifact(selection_artifact)
-        selector.load_voxel_selection(selection, dataset)
+        for selection in selection_chain(selection_artifact, load_artifact):
+            selector.load_voxel_selection(selection, dataset)
+        selector.selection_parent = selection_artifact
 
         # Load the model from W&B
         model_artifact = cfg.active.model if cfg.active.model is not None else \
@@ -0,0 +1,122 @@
+import math
+from typing import Any, Callable, Iterable, Iterator
+
+import torch
+
+ChunkFn = Callable[[], Iterable[tuple[Any, torch.Tensor, torch.Tensor]]]
+
+
+def weighted_threshold(chunks: ChunkFn, budget: float, num_bins: int = 4096, max_rounds: int = 4) -> tuple:
+    """ Streaming threshold search for the weighted top-k. The function finds an interval [low, high) such that
+    all items with value >= high fit into the budget and the items in the interval would exceed it. Each round
+    reads all chunks once and refines the interval with a weighted histogram, so the memory is independent
+    of the number of chunks.
+
+    :param chunks: Function returning an iterable of (key, values, weights) chunks. It is called once per pass.
+    :param budget: Maximal total weight of the selected items.
+    :param num_bins: Number of histogram bins in one refinement round.
+    :param max_rounds: Maximal number of refinement rounds.
+    :return: Tuple (low, high, remaining) where remaining is the budget left for the items in [low, high).
+    """
+
+    total, low, high = 0., math.inf, -math.inf
+    for _, values, weights in chunks():
+        if values.numel() == 0:
+            continue
+        total += weights.sum().item()
+        low, high = min(low, values.min().item()), max(high, values.max().item())
+
+    if total <= budget:
+        return -math.inf, -math.inf, 0.
+
+    # The interval is half-open, move the upper bound above the maximum
+    high = math.nextafter(high, math.inf)
+    above = 0.
+    for _ in range(max_rounds):
+        edges = torch.linspace(low, high, num_bins + 1, dtype=torch.float64)
+        hist = torch.zeros(num_bins, dtype=torch.float64)
+        for _, values, weights in chunks():
+            values = values.double()
+            mask = (values >= low) & (values < high)
+            bins = torch.bucketize(values[mask], edges[1:-1], right=True)
+            hist += torch.bincount(bins, weights=weights[mask].double(), minlength=num_bins)
+
+        # Find the bin in which the cumulative weight (from the top) exceeds the budget
+        cumulative = above + torch.flip(torch.cumsum(torch.flip(hist, [0]), 0), [0])
+        b = torch.nonzero(cumulative > budget).max().item()
+        above = cumulative[b + 1].item() if b + 1 < num_bins else above
+
+        new_low, new_high = edges[b].item(), edges[b + 1].item()
+        if new_low == low and new_high == high:
+            break
+        low, high = new_low, new_high
+
+    return low, high, budget - above
+
+
+def streaming_top_k(chunks: ChunkFn, budget: float, num_bins: int = 4096,
+                    max_rounds: int = 4) -> Iterator[tuple[Any, torch.Tensor]]:
+    """ Selects the items with the highest values until their total weight reaches the budget. The items are
+    streamed in chunks (e.g. one chunk per cloud) and only one chunk is in memory at a time. Items with
+    the boundary value are taken in the chunk order.
+
+    :param chunks: Function returning an iterable of (key, values, weights) chunks. It is called once per pass.
+    :param budget: Maximal total weight of the selected items (e.g. number of voxels).
+    :param num_bins: Number of histogram bins in one refinement round of the threshold search.
+    :param max_rounds: Maximal number of refinement rounds of the threshold search.
+    :return: Iterator of (key, indices) with the indices of the selected items in each chunk.
+    """
+
+    low, high, remaining = weighted_threshold(chunks, budget, num_bins, max_rounds)
+    for key, values, weights in chunks():
+        values = values.double()
+        selected = values >= high
+        border = torch.nonzero((values >= low) & (values < high)).squeeze(1)
+        if remaining > 0 and border.numel() > 0:
+            cumulative = torch.cumsum(weights[border].double(), 0)
+            taken = border[cumulative <= remaining]
+            remaining -= weights[taken].sum().item()
+            selected[taken] = True
+        yield key, torch.nonzero(selected).squeeze(1)
+
+
+def grouped_top_k(values: torch.Tensor, groups: torch.Tensor, quotas: torch.Tensor,
+                  sizes: torch.Tensor = None) -> torch.Tensor:
+    """ Segment-wise top-k. In every group the items with the highest values are taken while their total size
+    is within the quota of the group. The items are sorted once by the value and once (stable) by the group, the
+    cumulative sizes within the groups are then obtained from the global cumulative sum and the group offsets,
+    so there is no loop over the groups.
+
+    :param values: Values of the items with the shape (N,).
+    :param groups: Group of each item (e.g. cloud id or predicted class) in the range [0, G).
+    :param quotas: Maximal total size of the taken items of each group with the shape (G,).
+    :param sizes: Sizes of the items (e.g. number of voxels of a superpoint). If None, every item has the size 1.
+    :return: Boolean mask of the taken items with the shape (N,).
+    """
+
+    sizes = sizes.double() if sizes is not None else torch.ones(values.shape[0], dtype=torch.float64)
+    order = torch.argsort(values, descending=True)
+    order = order[torch.sort(groups[order], stable=True)[1]]
+    sorted_groups, sorted_sizes = groups[order].long(), sizes[order]
+
+    # Cumulative size of each item within its group
+    group_sizes = torch.bincount(sorted_groups, weights=sorted_sizes, minlength=quotas.shape[0])
+    group_offsets = torch.cumsum(group_sizes, 0) - group_sizes
+    cumulative = torch.cumsum(sorted_sizes, 0) - group_offsets[sorted_groups]
+
+    taken = torch.zeros(values.shape[0], dtype=torch.bool)
+    taken[order] = cumulative <= quotas.double()[sorted_groups]
+    return taken
+
+
+def top_k_overlap(values: torch.Tensor, reference: torch.Tensor, k: int) -> float:
+    """ Returns the fraction of the k items with the highest values that are also among the k items
+    with the highest reference values.
+    """
+
+    k = min(k, values.shape[0])
+    if k == 0:
+        return 1.
+    selected = torch.topk(values, k)[1]
+    reference_selected = torch.topk(reference, k)[1]
+    return torch.isin(selected, reference_selected).float().mean().item()
@@ -0,0 +1,126 @@
+import heapq
+import logging
+
+import h5py
+import numpy as np
+from torch.utils.data import Subset
+
+from src.datasets import Dataset
+
+log = logging.getLogger(__name__)
+
+
+class SelectionSubset(Subset):
+    """ Subset of the dataset scans used in the selection pass. The end-of-cloud flag of the dataset is replaced
+    by the flag of the last scan of each cloud in the subset, so that the clouds are completed even if their last
+    scans are not in the subset.
+
+    :param dataset: The dataset in the selection mode.
+    :param indices: Sorted indices of the scans.
+    """
+
+    def __init__(self, dataset: Dataset, indices: np.ndarray):
+        super().__init__(dataset, indices)
+        cloud_ids = dataset.scan_cloud_ids[indices]
+        self.ends = np.append(cloud_ids[1:] != cloud_ids[:-1], True) if len(indices) > 0 else np.zeros((0,), bool)
+
+    def __getitem__(self, idx):
+        *item, _ = self.dataset[self.indices[idx]]
+        return *item, bool(self.ends[idx])
+
+
+def read_scan_views(path: str) -> tuple[np.ndarray, np.ndarray]:
+    """ Reads the position of the sensor and the unique voxels observed by the scan.
+    """
+
+    with h5py.File(path, 'r') as f:
+        position = np.asarray(f['pose'])[:3, 3].astype(np.float64)
+        voxels = np.unique(np.asarray(f['voxel_map']).flatten())
+    return position, voxels[voxels >= 0].astype(np.int32)
+
+
+def stride_scans(positions: np.ndarray, stride: float) -> list[int]:
+    """ Chooses the scans along the trajectory so that the consecutive chosen poses are at least
+    stride meters apart. The first scan is always chosen.
+    """
+
+    chosen, last = [0], positions[0]
+    for i in range(1, positions.shape[0]):
+        if np.linalg.norm(positions[i] - last) >= stride:
+            chosen.append(i)
+            last = positions[i]
+    return chosen
+
+
+def repair_coverage(views: list[np.ndarray], chosen: list[int], min_views: int) -> tuple[list[int], dict]:
+    """ Adds scans to the chosen ones until every voxel is observed by at least min_views chosen scans
+    (or by all scans that observe it, if there are fewer of them). The scans are added greedily by the number
+    of voxels that still lack views. The gain of a scan can only decrease, so the gains are evaluated lazily.
+
+    :param views: Unique voxels observed by each scan of the cloud.
+    :param chosen: Indices of the initially chosen scans.
+    :param min_views: Required number of views (k) of every voxel.
+    :return: Sorted indices of the chosen scans and the coverage statistics.
+    """
+
+    size = max((v.max() + 1 for v in views if v.shape[0] > 0), default=0)
+    total = np.zeros((size,), dtype=np.int64)
+    for v in views:
+        total[v] += 1
+    need = np.minimum(total, min_views)
+    chosen = list(chosen)
+    for i in chosen:
+        need[views[i]] -= 1
+
+    candidates = set(range(len(views))) - set(chosen)
+    heap = [(-np.count_nonzero(need[views[i]] > 0), i) for i in candidates]
+    heapq.heapify(heap)
+    while heap:
+        gain, i = heapq.heappop(heap)
+        if gain == 0:
+            break
+        current = np.count_nonzero(need[views[i]] > 0)
+        if current < -gain:
+            heapq.heappush(heap, (-current, i))
+            continue
+        chosen.append(i)
+        need[views[i]] -= 1
+
+    observed = total > 0
+    counts = np.zeros((size,), dtype=np.int64)
+    for i in chosen:
+        counts[views[i]] += 1
+    statistics = {'num_scans': len(views),
+                  'num_chosen': len(chosen),
+                  'num_voxels': int(np.count_nonzero(observed)),
+                  'num_covered': int(np.count_nonzero(counts[observed] >= np.minimum(total, min_views)[observed])),
+                  'num_below_k': int(np.count_nonzero(total[observed] < min_views)),
+                  'views': int(counts.sum()),
+                  'all_views': int(total.sum())}
+    return sorted(chosen), statistics
+
+
+def subsample_scans(scan_files: np.ndarray, mode: str, min_views: int, stride: float = None) -> tuple[list, dict]:
+    """ Chooses the scans of a cloud that are used in the selection pass.
+
+    Modes:
+        - stride: Scans are chosen by the distance of their poses, then the coverage is repaired.
+        - coverage: Scans are chosen only by the greedy voxel coverage.
+
+    In both modes every voxel of the cloud is observed by at least min_views chosen scans (or by all of its views).
+
+    :param scan_files: Paths of the scans of the cloud in the order of the dataset.
+    :param mode: The subsampling mode ('stride' or 'coverage').
+    :param min_views: Required number of views (k) of every voxel.
+    :param stride: Minimal distance (in meters) of the chosen poses for the stride mode.
+    :return: Indices of the chosen scans (into scan_files) and the coverage statistics.
+    """
+
+    positions, views = zip(*[read_scan_views(path) for path in scan_files])
+    if mode == 'stride':
+        chosen = stride_scans(np.stack(positions), stride)
+    elif mode == 'coverage':
+        chosen = []
+    else:
+        raise ValueError(f'Unknown scan subsampling mode: {mode}')
+    return repair_coverage(list(views), chosen, min_views)
@@ -0,0 +1,101 @@
+import os
+import json
+import hashlib
+import logging
+
+import torch
+import numpy as np
+import torch.nn as nn
+
+from .base_cloud import Cloud
+
+log = logging.getLogger(__name__)
+
+
+def state_dict_hash(state_dict: dict) -> str:
+    """ Computes a hash of the model weights. The hash is used to identify the model that produced
+    the stored scores, so that the scores are never reused with a different checkpoint.
+
+    :param state_dict: State dictionary of the model.
+    :return: Hexadecimal SHA-1 digest of the state dictionary.
+    """
+
+    sha = hashlib.sha1()
+    for key in sorted(state_dict.keys()):
+        sha.update(key.encode())
+        sha.update(state_dict[key].detach().cpu().contiguous().numpy().tobytes())
+    return sha.hexdigest()
+
+
+def label_mask_hash(label_mask: torch.Tensor) -> str:
+    sha = hashlib.sha1()
+    sha.update(np.packbits(label_mask.numpy()).tobytes())
+    return sha.hexdigest()
+
+
+class ScoreStore(object):
+    """ Persistent store of the selection scores. A single deterministic inference pass computes all non-MC metrics
+    (entropy, margin, confidence, viewpoint variance and the mean class predictions) for every voxel of a cloud,
+    so that the selection with any strategy can be done without running the model again.
+
+    The scores are saved in the directory of the model checkpoint hash and the hash of the execution of the pass
+    (precision, quantization and the scan subsampling plan, which all change the scores of the same weights):
+
+        {{ root }}/{{ model hash }}_{{ execution hash }}/{{ cloud selection key }}.pt
+
+    Each entry stores the voxel scores, the superpoint aggregates (if the cloud is partitioned into superpoints)
+    and the hash of the label mask, because the predictions of the already labeled voxels are not used for the
+    computation of the scores.
+
+    :param root: The root directory of the store.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.directory = None
+
+    def bind(self, model: nn.Module, key: dict = None) -> None:
+        """ Binds the store to the current weights of the model. The key distinguishes the scores of different
+        executions of the same weights (e.g. the quantized model or a different scan subsampling).
+        """
+
+        directory = state_dict_hash(model.state_dict())
+        if key is not None:
+            directory = f'{directory}_{hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]}'
+        self.directory = os.path.join(self.root, directory)
+        os.makedirs(self.directory, exist_ok=True)
+        log.info(f'Using score store {self.directory}')
+
+    def path(self, cloud: Cloud) -> str:
+        assert self.directory is not None, 'The score store is not bound to a model.'
+        return os.path.join(self.directory, f'{cloud.selection_key.replace("/", "_")}.pt')
+
+    def save(self, cloud: Cloud, scores: dict) -> dict:
+        """ Saves the voxel scores of the cloud together with the partition aggregates.
+
+        :param cloud: The cloud the scores belong to.
+        :param scores: The voxel scores computed by Cloud.compute_scores.
+        :return: The saved entry.
+        """
+
+        entry = {'label_hash': label_mask_hash(cloud.label_mask),
+                 'voxels': scores,
+                 'superpoints': cloud.aggregate_scores(scores)}
+        # Write to a temporary file first, so that an interruption never leaves a corrupted entry
+        path = self.path(cloud)
+        torch.save(entry, f'{path}.tmp')
+        os.replace(f'{path}.tmp', path)
+        return entry
+
+    def load(self, cloud: Cloud) -> dict:
+        """ Loads the entry of the cloud. If the entry does not exist or it was computed with a different
+        label mask, None is returned.
+        """
+
+        path = self.path(cloud)
+        if not os.path.exists(path):
+            return None
+        entry = torch.load(path)
+        if entry['label_hash'] != label_mask_hash(cloud.label_mask):
+            return None
+        return entry
@@ -0,0 +1,25 @@
+import os
+
+import torch
+import numpy as np
+
+
+def spill_tensor(tensor: torch.Tensor, path: str) -> torch.Tensor:
+    """ Writes the tensor to a memory-mapped .npy file and returns a tensor that shares the memory with the file.
+    The data are paged in by the operating system only when they are accessed, so the resident memory does not
+    grow with the number of spilled tensors.
+
+    :param tensor: The tensor to be spilled (on CPU).
+    :param path: Path of the .npy file.
+    :return: Tensor backed by the memory-mapped file.
+    """
+
+    # Unlink the old file instead of truncating it, tensors of previous selections may still map it
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    array = tensor.detach().cpu().numpy()
+    mapped = np.lib.format.open_memmap(path, mode='w+', dtype=array.dtype, shape=array.shape)
+    mapped[...] = array
+    mapped.flush()
+    return torch.from_numpy(mapped)
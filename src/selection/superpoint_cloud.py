@@ -12,16 +12,21 @@ class SuperpointCloud(Cloud):
                  superpoint_map: torch.Tensor,
                  diversity_aware: bool, labels: torch.Tensor,
                  surface_variation: torch.Tensor,
-                 color_discontinuity: torch.Tensor = None):
+                 color_discontinuity: torch.Tensor = None,
+                 spill_dir: str = None):
         super().__init__(path, size, cloud_id, diversity_aware, labels,
-                         surface_variation, color_discontinuity)
-        self.superpoint_map = superpoint_map
+                         surface_variation, color_discontinuity, spill_dir)
+        self.superpoint_map = self._spill('superpoint_map', superpoint_map)
 
         self.values = None
+        self.classes = None
         self.features = None
-        self.ids = torch.full((self.num_superpoints,), self.id, dtype=torch.long)
         self.superpoint_indices, self.superpoint_sizes = torch.unique(self.superpoint_map, return_counts=True)
 
+    @property
+    def ids(self) -> torch.Tensor:
+        return torch.full((self.num_superpoints,), self.id, dtype=torch.long)
+
     @property
     def num_superpoints(self) -> int:
         return self.superpoint_map.max().item() + 1
@@ -31,10 +36,47 @@ class SuperpointCloud(Cloud):
         label_mean = scatter_mean(self.labels.float(), self.superpoint_map, dim=0)
         return torch.round(label_mean).long()
 
-    def _save_metric(self, values: torch.Tensor, features: torch.Tensor = None) -> None:
-        self.values = scatter_mean(values, self.superpoint_map, dim=0)
-        if features is not None:
-            self.features = scatter_mean(features, self.superpoint_map, dim=0)
+    @property
+    def partition_sizes(self) -> torch.Tensor:
+        return torch.bincount(self.superpoint_map.long(), minlength=self.num_superpoints)
+
+    @property
+    def partition_labels(self) -> torch.Tensor:
+        return self.superpoint_labels
+
+    def partition_voxels(self, indices: torch.Tensor) -> torch.Tensor:
+        return torch.nonzero(torch.isin(self.superpoint_map, indices)).squeeze(1)
+
+    def _save_metric(self, values: torch.Tensor, features: torch.Tensor = None, aggregated: bool = False,
+                     classes: torch.Tensor = None) -> None:
+        if not aggregated:
+            values = scatter_mean(values, self.superpoint_map, dim=0)
+            features = scatter_mean(features, self.superpoint_map, dim=0) if features is not None else None
+            classes = self.majority_classes(classes) if classes is not None else None
+        self.values = self._spill('values', values)
+        self.classes = self._spill('classes', classes)
+        self.features = self._spill('features', features)
+
+    def majority_classes(self, classes: torch.Tensor) -> torch.Tensor:
+        """ Returns the most frequent class of the voxels of each superpoint.
+        """
+
+        num_classes = classes.max().item() + 1
+        counts = torch.bincount(self.superpoint_map.long() * num_classes + classes,
+                                minlength=self.num_superpoints * num_classes)
+        return counts.view(self.num_superpoints, num_classes).argmax(dim=1)
+
+    def aggregate_scores(self, scores: dict) -> dict:
+        aggregates = {key: scatter_mean(value, self.superpoint_map, dim=0) for key, value in scores.items()}
+        aggregates['classes'] = self.majority_classes(scores['features'].argmax(dim=1))
+        aggregates['surface_variation'] = scatter_mean(self.surface_variation, self.superpoint_map, dim=0)
+        aggregates['color_discontinuity'] = scatter_mean(self.color_discontinuity, self.superpoint_map, dim=0)
+        return aggregates
+
+    def _partition_scores(self, entry: dict) -> tuple[dict, bool]:
+        if entry['superpoints'] is not None:
+            return entry['superpoints'], True
+        return self.aggregate_scores(entry['voxels']), True
 
     def __str__(self):
         ret = f'\nSuperpointCloud:\n' \
@@ -5,7 +5,6 @@ from omegaconf import DictConfig
 from torch.utils.data import Dataset
 
 from .base_selector import Selector
-from src.utils.io import CloudInterface
 from .superpoint_cloud import SuperpointCloud
 
 log = logging.getLogger(__name__)
@@ -17,24 +16,25 @@ class SuperpointSelector(Selector):
         self._initialize()
 
     def _initialize(self):
-        cloud_interface = CloudInterface(self.project_name, self.cfg.ds.learning_map)
-        for cloud_id, cloud_path in enumerate(self.cloud_paths):
-            labels = torch.from_numpy(cloud_interface.read_labels(cloud_path))
-            superpoint_map = torch.from_numpy(cloud_interface.read_superpoints(cloud_path))
-            surface_variation = torch.from_numpy(cloud_interface.read_surface_variation(cloud_path))
-            color_discontinuity = cloud_interface.read_color_discontinuity(cloud_path)
+        # The clouds are built one by one as they are read, so that only one cloud is held before it is spilled
+        label_counts = []
+        for cloud_id, (cloud_path, data) in enumerate(zip(self.cloud_paths, self._load_cloud_data(superpoints=True))):
+            label_counts.append(data['label_counts'])
+            color_discontinuity = data['color_discontinuity']
             color_discontinuity = torch.from_numpy(color_discontinuity) if color_discontinuity is not None else None
 
-            num_voxels = superpoint_map.shape[0]
+            num_voxels = data['superpoints'].shape[0]
             self.num_voxels += num_voxels
             self.clouds.append(SuperpointCloud(path=cloud_path,
                                                size=num_voxels,
                                                cloud_id=cloud_id,
-                                               superpoint_map=superpoint_map,
-                                               labels=labels,
+                                               superpoint_map=torch.from_numpy(data['superpoints'].astype(np.int64)),
+                                               labels=torch.from_numpy(data['labels']),
                                                diversity_aware=self.diversity_aware,
-                                               surface_variation=surface_variation,
-                                               color_discontinuity=color_discontinuity))
+                                               surface_variation=torch.from_numpy(data['surface_variation']),
+                                               color_discontinuity=color_discontinuity,
+                                               spill_dir=self.spill_dir))
+        self._count_labels(label_counts)
 
     def select(self, dataset: Dataset, percentage: float = 0.5) -> tuple:
         if self.strategy == 'Random':
@@ -61,10 +61,13 @@ class SuperpointSelector(Selector):
     def _select_by_criterion(self, dataset: Dataset, percentage: float) -> tuple:
         selection_size = self.get_selection_size(percentage)
         self._compute_values(dataset)
+        if self.out_of_core:
+            return self._select_out_of_core(selection_size)
 
         values = torch.tensor([], dtype=torch.float32)
         labels = torch.tensor([], dtype=torch.long)
         cloud_map = torch.tensor([], dtype=torch.long)
+        classes = torch.tensor([], dtype=torch.long)
         features = torch.tensor([], dtype=torch.float32)
         superpoint_map = torch.tensor([], dtype=torch.long)
         superpoint_sizes = torch.tensor([], dtype=torch.long)
@@ -73,6 +76,8 @@ class SuperpointSelector(Selector):
             if cloud.values is None:
                 continue
             values = torch.cat((values, cloud.values))
+            if cloud.classes is not None:
+                classes = torch.cat((classes, cloud.classes))
             labels = torch.cat((labels, cloud.superpoint_labels))
             cloud_map = torch.cat((cloud_map, cloud.ids))
             superpoint_map = torch.cat((superpoint_map, cloud.superpoint_indices))
@@ -81,25 +86,32 @@ class SuperpointSelector(Selector):
                 features = torch.cat((features, cloud.features))
 
         values = None if values.shape[0] == 0 else values
+        classes = None if classes.shape[0] != superpoint_map.shape[0] else classes
         features = None if features.shape[0] == 0 else features
 
         return self._choose_voxels(superpoint_map, superpoint_sizes, labels, cloud_map, selection_size, values,
-                                   features)
+                                   features, classes)
 
     def _choose_voxels(self, superpoint_map: torch.Tensor, superpoint_sizes: torch.Tensor, labels: torch.Tensor,
                        cloud_map: torch.Tensor, selection_size: int, values: torch.Tensor = None,
-                       features: torch.Tensor = None) -> tuple:
+                       features: torch.Tensor = None, classes: torch.Tensor = None) -> tuple:
 
         normal_order, weighted_order = None, None
         normal_metric_statistics, weighted_metric_statistics = None, None
 
         if values is None:
-            order = torch.randperm(superpoint_map.shape[0])
+            order = self._apply_quotas(torch.randperm(superpoint_map.shape[0]), cloud_map, selection_size,
+                                       sizes=superpoint_sizes)
             normal_metric_statistics = None
             weighted_metric_statistics = None
         else:
             normal_order = torch.argsort(values, descending=True)
-            weighted_order = self._diversity_aware_order(values, features) if features is not None else None
+            normal_order = self._apply_quotas(normal_order, cloud_map, selection_size, classes, superpoint_sizes)
+            weighted_order = self._diversity_aware_order(values, features, selection_size, superpoint_sizes) \
+                if features is not None else None
+            if weighted_order is not None:
+                weighted_order = self._apply_quotas(weighted_order, cloud_map, selection_size, classes,
+                                                    superpoint_sizes)
             order = weighted_order if weighted_order is not None else normal_order
 
         cloud_map, superpoint_map = cloud_map[order], superpoint_map[order]
@@ -125,8 +137,5 @@ class SuperpointSelector(Selector):
         voxel_selection = dict()
         for cloud in self.clouds:
             superpoints = selected_superpoints[selected_cloud_map == cloud.id]
-            for superpoint in superpoints:
-                voxels = torch.nonzero(cloud.superpoint_map == superpoint).squeeze(1)
-                cloud.label_voxels(voxels)
-            voxel_selection[cloud.selection_key] = cloud.label_mask
-        return voxel_selection, normal_metric_statistics, weighted_metric_statistics
+            voxel_selection[cloud.id] = cloud.partition_voxels(superpoints)
+        return self._create_selection(voxel_selection), normal_metric_statistics, weighted_metric_statistics
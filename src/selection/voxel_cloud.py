@@ -8,17 +8,38 @@ class VoxelCloud(Cloud):
                  labels: torch.Tensor,
                  diversity_aware: bool,
                  surface_variation: torch.Tensor,
-                 color_discontinuity: torch.Tensor = None):
+                 color_discontinuity: torch.Tensor = None,
+                 spill_dir: str = None):
         super().__init__(path, size, cloud_id, diversity_aware, labels,
-                         surface_variation, color_discontinuity)
+                         surface_variation, color_discontinuity, spill_dir)
         self.values = None
+        self.classes = None
         self.features = None
-        self.voxel_indices = torch.arange(self.size, dtype=torch.long)
-        self.ids = torch.full((self.size,), self.id, dtype=torch.long)
 
-    def _save_metric(self, values: torch.Tensor, features: torch.Tensor = None):
-        self.values = values
-        self.features = features
+    @property
+    def voxel_indices(self) -> torch.Tensor:
+        return torch.arange(self.size, dtype=torch.long)
+
+    @property
+    def ids(self) -> torch.Tensor:
+        return torch.full((self.size,), self.id, dtype=torch.long)
+
+    @property
+    def partition_sizes(self) -> torch.Tensor:
+        return torch.ones((self.size,), dtype=torch.long)
+
+    @property
+    def partition_labels(self) -> torch.Tensor:
+        return self.labels
+
+    def partition_voxels(self, indices: torch.Tensor) -> torch.Tensor:
+        return indices
+
+    def _save_metric(self, values: torch.Tensor, features: torch.Tensor = None, aggregated: bool = False,
+                     classes: torch.Tensor = None):
+        self.values = self._spill('values', values)
+        self.classes = self._spill('classes', classes)
+        self.features = self._spill('features', features)
 
     def __str__(self):
         ret = f'\nVoxelCloud:\n' \
@@ -1,6 +1,5 @@
 import logging
 
-import h5py
 import torch
 import numpy as np
 import torch.nn as nn
@@ -10,7 +9,6 @@ from omegaconf import DictConfig
 from src.datasets import Dataset
 from .base_selector import Selector
 from .voxel_cloud import VoxelCloud
-from src.utils.io import CloudInterface
 
 log = logging.getLogger(__name__)
 
@@ -21,23 +19,23 @@ class VoxelSelector(Selector):
         self._initialize()
 
     def _initialize(self):
-        cloud_interface = CloudInterface(self.project_name, self.cfg.ds.learning_map)
-        for cloud_id, cloud_path in enumerate(self.cloud_paths):
-            with h5py.File(cloud_path, 'r') as f:
-                labels = torch.from_numpy(cloud_interface.read_labels(cloud_path))
-                surface_variation = torch.from_numpy(cloud_interface.read_surface_variation(cloud_path))
-                color_discontinuity = cloud_interface.read_color_discontinuity(cloud_path)
-                color_discontinuity = torch.from_numpy(color_discontinuity) if color_discontinuity is not None else None
-
-                num_voxels = f['points'].shape[0]
-                self.num_voxels += num_voxels
-                self.clouds.append(VoxelCloud(path=cloud_path,
-                                              size=num_voxels,
-                                              cloud_id=cloud_id,
-                                              labels=labels,
-                                              diversity_aware=self.diversity_aware,
-                                              surface_variation=surface_variation,
-                                              color_discontinuity=color_discontinuity))
+        # The clouds are built one by one as they are read, so that only one cloud is held before it is spilled
+        label_counts = []
+        for cloud_id, (cloud_path, data) in enumerate(zip(self.cloud_paths, self._load_cloud_data())):
+            label_counts.append(data['label_counts'])
+            color_discontinuity = data['color_discontinuity']
+            color_discontinuity = torch.from_numpy(color_discontinuity) if color_discontinuity is not None else None
+
+            self.num_voxels += data['size']
+            self.clouds.append(VoxelCloud(path=cloud_path,
+                                          size=data['size'],
+                                          cloud_id=cloud_id,
+                                          labels=torch.from_numpy(data['labels']),
+                                          diversity_aware=self.diversity_aware,
+                                          surface_variation=torch.from_numpy(data['surface_variation']),
+                                          color_discontinuity=color_discontinuity,
+                                          spill_dir=self.spill_dir))
+        self._count_labels(label_counts)
 
     def select(self, dataset: Dataset, model: nn.Module = None, percentage: float = 0.5) -> tuple:
         if self.strategy == 'Random':
@@ -62,17 +60,22 @@ class VoxelSelector(Selector):
     def _select_by_criterion(self, dataset: Dataset, percentage: float) -> tuple:
         selection_size = self.get_selection_size(percentage)
         self._compute_values(dataset)
+        if self.out_of_core:
+            return self._select_out_of_core(selection_size)
 
         values = torch.tensor([], dtype=torch.float32)
         labels = torch.tensor([], dtype=torch.long)
         voxel_map = torch.tensor([], dtype=torch.long)
         cloud_map = torch.tensor([], dtype=torch.long)
+        classes = torch.tensor([], dtype=torch.long)
         features = torch.tensor([], dtype=torch.float32)
 
         for cloud in self.clouds:
             if cloud.values is None:
                 continue
             values = torch.cat((values, cloud.values))
+            if cloud.classes is not None:
+                classes = torch.cat((classes, cloud.classes))
             labels = torch.cat((labels, cloud.labels))
             cloud_map = torch.cat((cloud_map, cloud.ids))
             voxel_map = torch.cat((voxel_map, cloud.voxel_indices))
@@ -80,23 +83,29 @@ class VoxelSelector(Selector):
                 features = torch.cat((features, cloud.features))
 
         values = None if values.shape[0] == 0 else values
+        classes = None if classes.shape[0] != voxel_map.shape[0] else classes
         features = None if features.shape[0] == 0 else features
 
-        return self._choose_voxels(voxel_map, labels, cloud_map, selection_size, values, features)
+        return self._choose_voxels(voxel_map, labels, cloud_map, selection_size, values, features, classes)
 
     def _choose_voxels(self, voxel_map: torch.Tensor, labels: torch.Tensor, cloud_map: torch.Tensor,
-                       selection_size: int, values: torch.Tensor = None, features: torch.Tensor = None) -> tuple:
+                       selection_size: int, values: torch.Tensor = None, features: torch.Tensor = None,
+                       classes: torch.Tensor = None) -> tuple:
 
         normal_order, weighted_order = None, None
         normal_metric_statistics, weighted_metric_statistics = None, None
 
         if values is None:
-            order = torch.randperm(voxel_map.shape[0])
+            order = self._apply_quotas(torch.randperm(voxel_map.shape[0]), cloud_map, selection_size)
             normal_metric_statistics = None
             weighted_metric_statistics = None
         else:
             normal_order = torch.argsort(values, descending=True)
-            weighted_order = self._diversity_aware_order(values, features) if features is not None else None
+            normal_order = self._apply_quotas(normal_order, cloud_map, selection_size, classes)
+            weighted_order = self._diversity_aware_order(values, features, selection_size) \
+                if features is not None else None
+            if weighted_order is not None:
+                weighted_order = self._apply_quotas(weighted_order, cloud_map, selection_size, classes)
             order = weighted_order if weighted_order is not None else normal_order
 
         cloud_map, voxel_map = cloud_map[order], voxel_map[order]
@@ -114,9 +123,5 @@ class VoxelSelector(Selector):
         log.info(f'Selected {selection_size} voxels')
         log.info(f"Order type: {'Weighted' if weighted_order is not None else 'Normal'}")
 
-        voxel_selection = dict()
-        for cloud in self.clouds:
-            cloud.label_voxels(selected_voxels[selected_cloud_map == cloud.id])
-            voxel_selection[cloud.selection_key] = cloud.label_mask
-
-        return voxel_selection, normal_metric_statistics, weighted_metric_statistics
+        voxel_selection = {cloud.id: selected_voxels[selected_cloud_map == cloud.id] for cloud in self.clouds}
+        return self._create_selection(voxel_selection), normal_metric_statistics, weighted_metric_statistics
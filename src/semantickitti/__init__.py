@@ -1 +1,5 @@
-from .converter import SemanticKITTIConverter
+from src.utils.lazy import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    '.converter': ['SemanticKITTIConverter'],
+})
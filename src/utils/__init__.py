@@ -1,11 +1,17 @@
-from .project import project_points
-from .experiment import Experiment
-from .map import colorize_values, map_labels, map_colors, colorize_instances
-from .io import set_paths, load_dataset, ScanInterface, CloudInterface
-from .visualize import plot, bar_chart, grouped_bar_chart, plot_confusion_matrix
-from .cloud import transform_points, downsample_cloud, nearest_neighbors, nearest_neighbors_2, \
-    connected_label_components, nn_graph, visualize_cloud, visualize_cloud_values, compute_elevation, normalize_xy, \
-    visualize_global_cloud, calculate_radial_distances, augment_points
-from .log import log_class_iou, log_class_accuracy, log_confusion_matrix, \
-    log_dataset_statistics, log_most_labeled_sample, log_model, log_history, \
-    log_selection, log_selection_metric_statistics, log_gradient_flow
+from .lazy import lazy_exports
+
+# The exports are imported on the first access, see lazy_exports
+__getattr__, __dir__ = lazy_exports(__name__, {
+    '.project': ['project_points'],
+    '.experiment': ['Experiment'],
+    '.map': ['colorize_values', 'map_labels', 'map_colors', 'colorize_instances'],
+    '.io': ['set_paths', 'load_dataset', 'ScanInterface', 'CloudInterface'],
+    '.visualize': ['plot', 'bar_chart', 'grouped_bar_chart', 'plot_confusion_matrix'],
+    '.cloud': ['transform_points', 'downsample_cloud', 'nearest_neighbors', 'nearest_neighbors_2',
+               'connected_label_components', 'nn_graph', 'visualize_cloud', 'visualize_cloud_values',
+               'compute_elevation', 'normalize_xy', 'visualize_global_cloud', 'calculate_radial_distances',
+               'augment_points'],
+    '.log': ['log_class_iou', 'log_class_accuracy', 'log_confusion_matrix', 'log_dataset_statistics',
+             'log_most_labeled_sample', 'log_model', 'log_history', 'log_selection',
+             'log_selection_metric_statistics', 'log_gradient_flow'],
+})
@@ -1,18 +1,17 @@
 import random
 
 import numpy as np
-import open3d as o3d
 from tqdm import tqdm
-from sklearn.neighbors import NearestNeighbors
-from sklearn.linear_model import RANSACRegressor
 from scipy.spatial.transform import Rotation as R
 
-import wandb
-from src.ply_c import libply_c
 from src.utils.map import colorize_values, colorize_instances
 
+# open3d, sklearn, wandb and libply_c are imported in the functions that use them, so that importing
+# the module (e.g. for augment_points in the datasets) does not load them
+
 
 def visualize_cloud(points: np.ndarray, colors: np.ndarray):
+    import open3d as o3d
     pcd = o3d.geometry.PointCloud()
     pcd.points = o3d.utility.Vector3dVector(points)
     pcd.colors = o3d.utility.Vector3dVector(colors)
@@ -29,6 +28,7 @@ def visualize_cloud_values(points: np.ndarray, values: np.ndarray, random_colors
 
 def downsample_cloud(points: np.ndarray, colors: np.ndarray = None, labels: np.ndarray = None,
                      voxel_size: float = 0.1) -> tuple:
+    import open3d as o3d
     device = o3d.core.Device("CPU:0")
     pcd = o3d.t.geometry.PointCloud(device)
 
@@ -51,11 +51,13 @@ def downsample_cloud(points: np.ndarray, colors: np.ndarray = None, labels: np.n
 
 
 def nearest_neighbors(points: np.ndarray, k_nn: int) -> np.ndarray:
+    from sklearn.neighbors import NearestNeighbors
     nn = NearestNeighbors(n_neighbors=k_nn + 1, algorithm='kd_tree').fit(points)
     return np.array(nn.kneighbors(points))[..., 1:].astype(np.uint32)
 
 
 def nearest_neighbors_2(points_1: np.ndarray, points_2: np.ndarray, k_nn: int) -> tuple:
+    from sklearn.neighbors import NearestNeighbors
     nn = NearestNeighbors(n_neighbors=k_nn, algorithm='kd_tree').fit(points_1)
     distances, neighbors = nn.kneighbors(points_2)
     if k_nn == 1:
@@ -78,6 +80,7 @@ def nn_graph(points: np.ndarray, k_nn: int):
 
 
 def connected_label_components(labels: np.ndarray, edg_source: np.ndarray, edg_target: np.ndarray):
+    from src.ply_c import libply_c
     label_transition = labels[edg_source] != labels[edg_target]
     _, components = libply_c.connected_comp(len(labels), edg_source.astype('uint32'),
                                             edg_target.astype('uint32'),
@@ -90,6 +93,7 @@ def compute_elevation(points: np.ndarray, plane_threshold=5, min_plane_points=10
     xy = points[:, :2]
     plane = (z - z.min() < plane_threshold).nonzero()[0]
     if len(plane) > min_plane_points:
+        from sklearn.linear_model import RANSACRegressor
         reg = RANSACRegressor(random_state=0).fit(xy[plane], z[plane])
         elevation = z - reg.predict(xy)
     else:
@@ -122,6 +126,7 @@ def visualize_global_cloud(points: iter, colors: iter, poses: iter, voxel_size:
     cloud, color = downsample_cloud(cloud, color, voxel_size=voxel_size)
 
     if log:
+        import wandb
         wandb.log({'global_cloud': [wandb.Object3D(np.concatenate([cloud, color * 255], axis=1))]})
     else:
         visualize_cloud(cloud, color)
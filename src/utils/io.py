@@ -151,6 +151,36 @@ class CloudInterface(object):
             if 'color_discontinuity' in f:
                 return np.asarray(f['color_discontinuity']).astype(np.float32)
 
+    def read_selection_data(self, path: str, superpoints: bool = False) -> dict:
+        """ Reads all data of the cloud needed by the selector in a single open of the file.
+
+        :param path: Path to the cloud.
+        :param superpoints: Whether to read the superpoints of the cloud.
+        :return: Dictionary with the number of voxels, labels, label histogram, surface variation,
+                 color discontinuity and superpoints (None if not available or not requested).
+        """
+
+        with h5py.File(path, 'r') as f:
+            size = f['points'].shape[0]
+            labels = np.asarray(f['labels']).flatten().astype(np.int64)
+            surface_variation = np.asarray(f['surface_variation']).astype(np.float32) \
+                if 'surface_variation' in f else None
+            color_discontinuity = np.asarray(f['color_discontinuity']).astype(np.float32) \
+                if 'color_discontinuity' in f else None
+            superpoint_map = np.asarray(f['superpoints']).astype(np.int32) \
+                if superpoints and 'superpoints' in f else None
+
+        if self.label_map is not None:
+            labels = map_labels(labels, self.label_map)
+        label_counts = np.bincount(labels[labels >= 0])
+
+        return {'size': size,
+                'labels': labels,
+                'label_counts': label_counts,
+                'surface_variation': surface_variation,
+                'color_discontinuity': color_discontinuity,
+                'superpoints': superpoint_map}
+
     def read_cloud(self, path: str):
         ret = dict()
         with h5py.File(path, 'r') as f:
@@ -0,0 +1,31 @@
+import importlib
+
+
+def lazy_exports(package: str, exports: dict) -> tuple:
+    """ Creates the module __getattr__ and __dir__ of a package whose exports are imported on the first access.
+    Importing the package (e.g. for a single submodule) then does not import the heavy dependencies
+    (open3d, wandb, matplotlib, ...) of the other submodules.
+
+    Usage in the __init__.py of the package:
+
+        __getattr__, __dir__ = lazy_exports(__name__, {'.module': ['name', ...], ...})
+
+    :param package: The name of the package (__name__).
+    :param exports: Dictionary {relative module name: names exported from the module}.
+    :return: Tuple (__getattr__, __dir__).
+    """
+
+    modules = {name: module for module, names in exports.items() for name in names}
+    namespace = importlib.import_module(package).__dict__
+
+    def __getattr__(name: str):
+        if name not in modules:
+            raise AttributeError(f'module {package!r} has no attribute {name!r}')
+        value = getattr(importlib.import_module(modules[name], package), name)
+        namespace[name] = value
+        return value
+
+    def __dir__() -> list:
+        return sorted(set(namespace) | set(modules))
+
+    return __getattr__, __dir__
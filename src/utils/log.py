@@ -1,8 +1,6 @@
 import torch
 import wandb
 import numpy as np
-import seaborn as sn
-import matplotlib.pyplot as plt
 from omegaconf import DictConfig
 from torch.utils.data import Dataset
 from src.utils.wb import push_artifact
@@ -42,6 +40,8 @@ def log_confusion_matrix(confusion_matrix: torch.Tensor, labels: list[str],
     conf_matrix = np.delete(conf_matrix, ignore_index, axis=-2)
 
     # Plot confusion matrix
+    import seaborn as sn
+    import matplotlib.pyplot as plt
     sn.set()
     plt.figure(figsize=(16, 16))
     sn.heatmap(conf_matrix, annot=True, cmap='Blues', fmt='.2f',
@@ -161,6 +161,7 @@ def log_selection_metric_statistics(cfg, metric_statistics: dict, metric_statist
     left_values = metric_statistics['left_values']
     x = np.linspace(0, 1, len(selected_values) + len(left_values))
 
+    import matplotlib.pyplot as plt
     plt.figure(figsize=(10, 8))
     plt.plot(x[:len(selected_values)], selected_values, label='Selected Values', linewidth=3)
     plt.plot(x[len(selected_values):], left_values, label='Left Values', linewidth=3)
@@ -189,6 +190,7 @@ def log_selection_metric_statistics(cfg, metric_statistics: dict, metric_statist
 
 
 def log_gradient_flow(average_gradients: np.ndarray, maximum_gradients: np.ndarray, step: int) -> None:
+    import matplotlib.pyplot as plt
     fig = plt.figure(figsize=(10, 8))
     fig.patch.set_facecolor('white')  # Set the figure face color to white
     ax = fig.add_subplot(111)
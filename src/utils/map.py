@@ -1,7 +1,4 @@
 import numpy as np
-import matplotlib as mpl
-import matplotlib.cm as cm
-from matplotlib import pyplot as plt
 
 
 def map_labels(data: np.ndarray, mapping: dict):
@@ -39,6 +36,10 @@ def colorize_values(data: np.ndarray, color_map: str = 'viridis', data_range: tu
     :param data_range: Range of data
     :param ignore: Ignore values (set to dark gray)
     """
+    import matplotlib as mpl
+    import matplotlib.cm as cm
+    from matplotlib import pyplot as plt
+
     # Create color map
     cmap = plt.get_cmap(color_map)
     cmap.set_bad(color=np.full(3, 0.1))
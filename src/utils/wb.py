@@ -80,7 +80,7 @@ def pull_artifact(artifact: str, device: torch.device = torch.device('cpu')) ->
 
 
 def push_artifact(artifact: str, data: Any, artifact_type: str, metadata: dict = None,
-                  description: str = None):
+                  description: str = None, aliases: list = None):
     """ Pushes a data to W&B as an artifact. The data can be a torch.Tensor
     or a dictionary of torch.Tensors.
 
@@ -89,6 +89,7 @@ def push_artifact(artifact: str, data: Any, artifact_type: str, metadata: dict =
     :param artifact_type: The type of the artifact.
     :param metadata: The metadata of the artifact.
     :param description: The description of the artifact.
+    :param aliases: Additional aliases of the artifact version (the version is always aliased as latest).
     """
 
     assert isinstance(data, (torch.Tensor, dict, OrderedDict)), \
@@ -102,10 +103,33 @@ def push_artifact(artifact: str, data: Any, artifact_type: str, metadata: dict =
                               metadata=metadata,
                               description=description)
     artifact.add_file(path)
-    wandb.log_artifact(artifact)
+    wandb.log_artifact(artifact, aliases=['latest'] + (aliases if aliases is not None else []))
     os.remove(path)
 
 
+def pull_run_metric(project: str, group: str, run_name: str, metric: str) -> float:
+    """ Pulls the maximum of a logged metric from a finished W&B run.
+
+    :param project: The project of the run (entity/project or project).
+    :param group: The group of the run.
+    :param run_name: The display name of the run.
+    :param metric: The name of the logged metric (e.g. "MIoU Val").
+    :return: The maximum of the metric or None if there is no such run.
+    """
+
+    try:
+        runs = wandb.Api().runs(project, filters={'group': group, 'display_name': run_name})
+    except (ValueError, wandb.errors.CommError):
+        log.warning(f'Project {project} not found in W&B.')
+        return None
+
+    values = [row[metric] for run in runs for row in run.scan_history(keys=[metric])]
+    if len(values) == 0:
+        log.warning(f'Metric {metric} of run {project}/{group}/{run_name} not found in W&B.')
+        return None
+    return float(max(values))
+
+
 def delete_empty_directory(directory_path):
     if os.path.exists(directory_path):
         if len(os.listdir(directory_path)) == 0:
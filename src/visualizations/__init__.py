@@ -0,0 +1,13 @@
+from src.utils.lazy import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    '.dataset': ['visualize_scans', 'visualize_clouds', 'visualize_statistics', 'visualize_augmentation',
+                 'visualize_scan_mapping'],
+    '.superpoints': ['visualize_feature', 'visualize_superpoints'],
+    '.experiment': ['visualize_model_comparison', 'visualize_learning', 'visualize_loss_comparison',
+                    'visualize_baseline', 'visualize_class_distribution'],
+    '.filters': ['visualize_filters'],
+    '.model': ['visualize_model_predictions'],
+    '.selection': ['visualize_voxel_selection', 'visualize_superpoint_selection',
+                   'visualize_uncertainty_score_voxels', 'visualize_uncertainty_score_superpoints'],
+})
@@ -99,7 +99,7 @@ def visualize_uncertainty_score_voxels(cfg: DictConfig) -> None:
     model_state_dict = pull_artifact(cfg.active.model_artifact, device=device)
     selector.model.load_state_dict(model_state_dict)
 
-    # Compute the uncertainty score for each voxel
+    # Compute the uncertainty score for each voxel (or read it from the score store if active.score_store is set)
     selector._compute_values(dataset)
 
     CI = CloudInterface(label_map=cfg.ds.learning_map)
@@ -123,7 +123,7 @@ def visualize_uncertainty_score_superpoints(cfg: DictConfig) -> None:
     model_state_dict = pull_artifact(cfg.active.model_artifact, device=device)
     selector.model.load_state_dict(model_state_dict)
 
-    # Compute the uncertainty score for each voxel
+    # Compute the uncertainty score for each voxel (or read it from the score store if active.score_store is set)
     selector._compute_values(dataset)
     CI = CloudInterface(label_map=cfg.ds.learning_map)
     for cloud in selector.clouds:
@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+omegaconf = pytest.importorskip('omegaconf')
+pytest.importorskip('hydra')
+pytest.importorskip('torch')
+
+from src.benchmarks.imports import benchmark_imports, measure_import
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG = omegaconf.OmegaConf.merge(omegaconf.OmegaConf.create({'benchmark': omegaconf.OmegaConf.load(
+    os.path.join(ROOT, 'conf', 'benchmark', 'default.yaml'))}), {'path': {'root': ROOT}})
+
+
+@pytest.mark.parametrize('script', list(CONFIG.benchmark.import_budgets.keys()))
+def test_entry_point_imports_no_heavy_modules(script):
+    result = measure_import(script, list(CONFIG.benchmark.heavy_modules), ROOT)
+    assert result['modules'] == []
+
+
+def test_entry_point_import_budgets():
+    results = benchmark_imports(CONFIG)
+    assert all(r['budget'] is None or r['time'] <= r['budget'] for r in results)
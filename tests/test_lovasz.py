@@ -0,0 +1,50 @@
+import pytest
+import torch
+
+from src.old import lovasz as old_lovasz
+from src.losses import lovasz
+
+
+def random_batch(batch_size: int = 3, num_classes: int = 5, ignore: int = 0, seed: int = 0):
+    generator = torch.Generator().manual_seed(seed)
+    logits = torch.randn(batch_size, num_classes, 8, 16, generator=generator)
+    labels = torch.randint(0, num_classes, (batch_size, 8, 16), generator=generator)
+    labels[torch.rand(labels.shape, generator=generator) < 0.2] = ignore
+    return torch.softmax(logits, dim=1), labels
+
+
+@pytest.mark.parametrize('classes', ['present', 'all', [1, 3]])
+@pytest.mark.parametrize('per_image', [False, True])
+@pytest.mark.parametrize('ignore', [None, 0])
+def test_lovasz_softmax_equivalence(classes, per_image, ignore):
+    probs, labels = random_batch()
+    probs_old = probs.clone().requires_grad_(True)
+    probs_new = probs.clone().requires_grad_(True)
+
+    expected = old_lovasz.lovasz_softmax(probs_old, labels, classes, per_image, ignore)
+    loss = lovasz.lovasz_softmax(probs_new, labels, classes, per_image, ignore)
+    expected.backward()
+    loss.backward()
+
+    assert torch.allclose(loss, expected, atol=1e-6)
+    assert torch.allclose(probs_new.grad, probs_old.grad, atol=1e-6)
+
+
+def test_lovasz_softmax_per_image_void_image():
+    probs, labels = random_batch()
+    labels[1] = 0
+
+    # The original loop adds zero for the image with only void pixels and averages over all images
+    expected = sum(old_lovasz.lovasz_softmax(probs[i:i + 1], labels[i:i + 1], ignore=0) for i in [0, 2]) / 3
+    loss = lovasz.lovasz_softmax(probs, labels, per_image=True, ignore=0)
+    assert torch.allclose(loss, expected, atol=1e-6)
+
+
+def test_lovasz_softmax_flat_without_classes():
+    probs = torch.softmax(torch.randn(10, 4), dim=1).requires_grad_(True)
+    labels = torch.full((10,), 7)
+
+    loss = lovasz.lovasz_softmax_flat(probs, labels)
+    assert isinstance(loss, torch.Tensor) and loss.item() == 0
+    loss.backward()
+    assert torch.all(probs.grad == 0)
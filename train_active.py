@@ -7,7 +7,8 @@ from omegaconf import DictConfig
 from hydra.core.hydra_config import HydraConfig
 
 from src.utils.io import set_paths
-from src.learn.active import train_model_active, create_seed
+from src.learn.distributed import launch
+import src.learn as learn
 
 log = logging.getLogger(__name__)
 
@@ -22,9 +23,11 @@ def main(cfg: DictConfig):
         device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
     if cfg.option == 'train':
-        train_model_active(cfg, device)
+        launch(learn.train_model_active, cfg.train.world_size, cfg, device)
+    elif cfg.option == 'resume':
+        launch(learn.train_model_active, cfg.train.world_size, cfg, device, True)
     elif cfg.option == 'create_seed':
-        create_seed(cfg, device)
+        learn.create_seed(cfg, device)
     else:
         raise ValueError(f'Option "{cfg.option}" is not supported')
 
@@ -7,7 +7,8 @@ from omegaconf import DictConfig
 from hydra.core.hydra_config import HydraConfig
 
 from src.utils.io import set_paths
-from src.learn.passive import train_model_passive, train_semantickitti_original
+from src.learn.distributed import launch
+import src.learn as learn
 
 log = logging.getLogger(__name__)
 
@@ -22,9 +23,9 @@ def main(cfg: DictConfig):
         device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
     if cfg.option == 'baseline':
-        train_model_passive(cfg, device)
+        launch(learn.train_model_passive, cfg.train.world_size, cfg, device)
     elif cfg.option == 'original':
-        train_semantickitti_original(cfg, device)
+        learn.train_semantickitti_original(cfg, device)
     else:
         raise ValueError(f'Option "{cfg.option}" is not supported')
 